@@ -41,6 +41,7 @@ from rtCommon.bidsCommon import (
     niftiImagesAppendCompatible,
 )
 from rtCommon.bidsIncremental import BidsIncremental
+from rtCommon.bidsIndex import BidsIndex
 from rtCommon.bidsRun import BidsRun
 from rtCommon.errors import (
     DimensionError,
@@ -53,11 +54,14 @@ from rtCommon.errors import (
 
 logger = logging.getLogger(__name__)
 
+# Extensions of the files PyBids treats as images (BIDSImageFile)
+IMAGE_EXTENSIONS = ['.nii', '.nii.gz', '.gii']
+
 
 def failIfEmpty(func):
     @functools.wraps(func)
     def emptyFailWrapFunction(*args, **kwargs):
-        if args[0].data is None:
+        if args[0].isEmpty():
             raise StateError("Dataset empty")
         else:
             return func(*args, **kwargs)
@@ -88,14 +92,34 @@ class BidsArchive:
             Sessions: 3 | Runs: 2
         """
         self.rootPath = os.path.abspath(rootPath)
-        # Formatting initialization logic this way enables the creation of an
-        # empty BIDS archive that an incremntal can then be appended to
-        try:
-            self.data = BIDSLayout(rootPath)
-        except Exception as e:
-            logger.debug("Failed to open dataset at %s (%s)",
-                         self.rootPath, str(e))
-            self.data: BIDSLayout = None
+        # The PyBids layout is expensive to build for large archives, so it is
+        # only built when first needed, and re-built when next needed after
+        # files are added to the archive. The index of the archive's files is
+        # instead updated one file at a time.
+        self._layout: BIDSLayout = None
+        self.layoutStale = True
+        self.index = BidsIndex(self.rootPath)
+        # absolute image path -> state of the image being appended in place,
+        # see _appendInPlace
+        self.inPlaceAppends = {}
+
+    @property
+    def data(self) -> BIDSLayout:
+        """
+        The PyBids layout of the archive, None if the archive is empty (or isn't
+        a valid BIDS dataset).
+        """
+        if self.layoutStale:
+            # Formatting initialization logic this way enables the creation of
+            # an empty BIDS archive that an incremntal can then be appended to
+            try:
+                self._layout = BIDSLayout(self.rootPath)
+            except Exception as e:
+                logger.debug("Failed to open dataset at %s (%s)",
+                             self.rootPath, str(e))
+                self._layout = None
+            self.layoutStale = False
+        return self._layout
 
     def __str__(self):
         out = str(self.data)
@@ -184,6 +208,10 @@ class BidsArchive:
             <BIDSImageFile filename=/tmp/archive/sub-01/func/sub-01_task-test\
             _bold.nii.gz
         """
+        # Files that aren't in the archive's index aren't looked up in PyBids
+        if not self.index.hasFile(path):
+            return None
+
         # 1) Path with leading slash, relative to filesystem root
         # 3) Path with no leading slash, assume relative to archive root
         archiveFile = self.data.get_file(path)
@@ -256,6 +284,15 @@ class BidsArchive:
             >>> print(len(images))
             0
         """
+        imagePaths = self._findImages(matchExact, **entities)
+        # The PyBids layout is only used for images that are in the archive
+        return [self.data.get_file(path) for path in imagePaths]
+
+    def _findImages(self, matchExact: bool = False, **entities) -> List[str]:
+        """
+        Same as getImages, but returns the absolute paths of the images, found
+        with the archive's index rather than PyBids.
+        """
         # Validate image extension specified
         extension = entities.pop('extension', None)
         if extension is not None:
@@ -263,35 +300,42 @@ class BidsArchive:
                 raise ValueError('Extension for images must be either .nii or '
                                  '.nii.gz')
 
-        results = self.data.get(**entities)
-        results = [r for r in results if type(r) is BIDSImageFile]
+        # Only image files are checked, so extension is irrelevant
+        results = [relPath for relPath in
+                   self.index.getFiles(matchExact=matchExact, **entities)
+                   if self.index.getEntities(relPath).get('extension') in
+                   IMAGE_EXTENSIONS]
 
         if len(results) == 0:
-            logger.debug(f"Found no images with all entities: {entities}")
+            if matchExact:
+                logger.debug(f"Found no images exactly matching: {entities}")
+            else:
+                logger.debug(f"Found no images with all entities: {entities}")
             return []
         elif matchExact:
-            for result in results:
-                # Only BIDSImageFiles are checked, so extension is irrelevant
-                result_entities = result.get_entities()
-                result_entities.pop('extension', None)
-
-                if result_entities == entities:
-                    return [result]
-
-            logger.debug(f"Found no images exactly matching: {entities}")
-            return []
+            return [self.absPathFromRelPath(results[0])]
         else:
-            return results
+            return [self.absPathFromRelPath(relPath) for relPath in results]
 
-    def _updateLayout(self):
+    def _updateLayout(self, newFiles: List[str] = None):
         """
-        Updates the layout of the dataset so that any new metadata or image
-        files are added to the index.
+        Updates the index of the dataset so that any new metadata or image
+        files are added to it.
+
+        Args:
+            newFiles: Paths (absolute or relative to the archive root) of the
+                files added to the archive. If None, the whole archive is
+                re-indexed.
         """
-        # Updating layout is currently quite expensive. However, the underlying
-        # PyBids implementation uses a SQL database to store the index, and it
-        # has no public methods to cleanly and incrementally update the DB.
-        self.data = BIDSLayout(self.rootPath)
+        if newFiles is None:
+            self.index.rescan()
+        else:
+            for path in newFiles:
+                self.index.addFile(path)
+        # Updating the PyBids layout is expensive, as it has no public methods
+        # to cleanly and incrementally update its SQL database. So it is only
+        # re-built when it's next used.
+        self.layoutStale = True
 
     def _addImage(self, img: nib.Nifti1Image, path: str,
                   updateLayout: bool = True) -> None:
@@ -309,7 +353,7 @@ class BidsArchive:
                            root=self.rootPath, conflicts='overwrite')
 
         if updateLayout:
-            self._updateLayout()
+            self._updateLayout([path])
 
     def _addMetadata(self, metadata: dict, path: str,
                      updateLayout: bool = True) -> None:
@@ -329,10 +373,12 @@ class BidsArchive:
                            conflicts='overwrite')
 
         if updateLayout:
-            self._updateLayout()
+            self._updateLayout([path])
 
     def isEmpty(self) -> bool:
-        return (self.data is None)
+        # PyBids requires a dataset description to open a dataset
+        return not os.path.isfile(os.path.join(self.rootPath,
+                                               'dataset_description.json'))
 
     @failIfEmpty
     def getSidecarMetadata(self, image: Union[str, BIDSImageFile],
@@ -364,22 +410,30 @@ class BidsArchive:
             {'AcquisitionMatrixPE': 320, 'AcquisitionNumber': 1, ... }
         """
         if isinstance(image, BIDSImageFile):
-            target = image
+            path = image.path
         elif type(image) is str:
-            target = self.tryGetFile(image)
-            if target is None:
-                raise NoMatchError("File doesn't exist, can't get metadata")
+            path = image
         else:
             raise TypeError("Expected image as str or BIDSImageFile "
                             f"(got {type(image)})")
 
-        # Counter-intuitively, in PyBids, 'None' returns all available entities,
-        # both those from the filename and those from the sidecar metadata. True
-        # returns only the metadata in the sidecar file, and False returns only
-        # entities in the filename.
-        metadataParameter = None if includeEntities else True
+        # The sidecar metadata is merged from the JSON files the image inherits
+        # from, which the archive's index keeps track of
+        entities = self.index.getEntities(path)
+        if entities is None:
+            raise NoMatchError("File doesn't exist, can't get metadata")
+        metadata = self.index.getMetadata(path)
+        if includeEntities:
+            metadata.update(entities)
+
+        return metadata
 
-        return target.get_entities(metadata=metadataParameter)
+    def _getDatasetDescription(self) -> dict:
+        """Reads the dataset description, without the PyBids layout"""
+        descriptionPath = os.path.join(self.rootPath,
+                                       'dataset_description.json')
+        with open(descriptionPath) as descriptionFile:
+            return json.load(descriptionFile)
 
     @failIfEmpty
     def getEvents(self, matchExact: bool = False,
@@ -425,23 +479,24 @@ class BidsArchive:
 
         entities['suffix'] = 'events'
 
-        results = self.data.get(**entities)
-        # filter to only include BIDSDataFile results
-        results = [r for r in results if type(r) is BIDSDataFile]
+        results = [relPath for relPath in
+                   self.index.getFiles(matchExact=matchExact, **entities)
+                   if self.index.getEntities(relPath).get('extension') in
+                   validExtensions]
 
         if len(results) == 0:
-            logger.debug(f"No event files have all provided entities: "
-                         f"{entities}")
+            if matchExact:
+                logger.debug(f"No event files were an exact match for: "
+                             f"{entities}")
+            else:
+                logger.debug(f"No event files have all provided entities: "
+                             f"{entities}")
             return []
         elif matchExact:
-            for result in results:
-                if result.get_entities() == entities:
-                    return [result]
-
-            logger.debug(f"No event files were an exact match for: {entities}")
-            return []
-        else:
-            return results
+            results = results[:1]
+        # The PyBids layout is only used for files that are in the archive
+        return [self.data.get_file(self.absPathFromRelPath(relPath))
+                for relPath in results]
 
     def _appendIncremental(self,
                            incremental: BidsIncremental,
@@ -501,23 +556,34 @@ class BidsArchive:
         # Write the specified part of an incremental, taking appropriate actions
         # for the layout update
         def writeIncremental(onlyData=False):
-            incremental.writeToDisk(self.rootPath, onlyData=onlyData)
-            self._updateLayout()
+            newFiles = incremental.writeToDisk(self.rootPath, onlyData=onlyData)
+            self._updateLayout(newFiles)
 
         # 2.0) Archive is empty and must be created
         if self.isEmpty():
             if makePath:
                 writeIncremental()
+                # Set up later appends to be validated and written in place
+                absImgPath = self.absPathFromRelPath(imgPath)
+                self._initInPlaceAppend(incremental, absImgPath,
+                                        nib.load(absImgPath),
+                                        self.getSidecarMetadata(absImgPath))
                 return True
             # If can't create new files in an empty archive, no valid append
             else:
                 return False
 
         # 2.1) Image already exists within archive, append this NIfTI to it
-        imageFile = self.tryGetFile(imgPath)
-        if imageFile is not None:
+        # Appending to an uncompressed image already validated on a previous
+        # append only writes the new data to the end of the file
+        absImgPath = self.absPathFromRelPath(imgPath)
+        if self._appendInPlace(incremental, absImgPath, validateAppend):
+            return True
+
+        if self.index.hasFile(imgPath):
             logger.debug("Image exists in archive, appending")
-            archiveImg = imageFile.get_image()
+            archiveImg = nib.load(absImgPath)
+            sidecarMetadata = self.getSidecarMetadata(absImgPath)
 
             # Validate header match
             if validateAppend:
@@ -528,12 +594,16 @@ class BidsArchive:
                         "NIfTI headers not append compatible: " + errorMsg)
 
                 compatible, errorMsg = metadataAppendCompatible(
-                    incremental.getImageMetadata(),
-                    self.getSidecarMetadata(imageFile))
+                    incremental.getImageMetadata(), sidecarMetadata)
                 if not compatible:
                     raise MetadataMismatchError(
                         "Image metadata not append compatible: " + errorMsg)
 
+            if self._initInPlaceAppend(incremental, absImgPath, archiveImg,
+                                       sidecarMetadata):
+                self._appendInPlace(incremental, absImgPath, validateAppend)
+                return True
+
             # Ensure archive image is 4D, expanding if not
             archiveData = getNiftiData(archiveImg)
             nDimensions = len(archiveData.shape)
@@ -569,11 +639,147 @@ class BidsArchive:
         if self.dirExistsInArchive(dataDirPath) or makePath:
             logger.debug("Image doesn't exist in archive, creating")
             writeIncremental(onlyData=True)
+            self._initInPlaceAppend(incremental, absImgPath,
+                                    nib.load(absImgPath),
+                                    self.getSidecarMetadata(absImgPath))
             return True
 
         # 2.3) No image append possible and no creation possible; fail append
         return False
 
+    def _initInPlaceAppend(self, incremental: BidsIncremental, absImgPath: str,
+                           archiveImg: nib.Nifti1Image,
+                           sidecarMetadata: dict) -> bool:
+        """
+        Checks whether the incremental's data can be appended to an existing
+        image file in place, i.e. by writing its raw bytes at the end of the file
+        and updating the header's time dimension, rather than re-writing the whole
+        image. This requires an uncompressed single file NIfTI (.nii) without data
+        scaling, and incremental data of the same spatial shape and a type that
+        casts safely to the file's data type. If so, the state for the in-place
+        appends to this image is stored.
+
+        Args:
+            incremental: The BIDS Incremental to append
+            absImgPath: Absolute path of the image file in the archive
+            archiveImg: The image loaded from the file (its data isn't read)
+            sidecarMetadata: The image's sidecar metadata, for validating appends
+
+        Returns:
+            True if appends to the image can be done in place, False otherwise.
+        """
+        self.inPlaceAppends.pop(absImgPath, None)
+        if not absImgPath.endswith('.nii') or \
+                type(archiveImg) not in (nib.Nifti1Image, nib.Nifti2Image):
+            return False
+        header = archiveImg.header
+        archiveShape = header.get_data_shape()
+        if len(archiveShape) not in (3, 4):
+            return False
+        slope, inter = header.get_slope_inter()
+        if slope not in (None, 1) or inter not in (None, 0):
+            return False
+        incrementalData = incremental.image.dataobj
+        if incremental.getImageDimensions()[:3] != archiveShape[:3] or \
+                not np.can_cast(incrementalData.dtype, header.get_data_dtype(),
+                                casting='safe'):
+            return False
+        # The header as it is on disk, which is patched on each append (the
+        # loaded image's header copy doesn't keep the data offset)
+        with open(absImgPath, 'rb') as imgFile:
+            diskHeader = type(archiveImg).header_class.from_fileobj(imgFile)
+        numVolumes = archiveShape[3] if len(archiveShape) == 4 else 1
+        volumeBytes = int(np.prod(archiveShape[:3])) * \
+            header.get_data_dtype().itemsize
+        dataOffset = int(diskHeader['vox_offset'])
+        # The file must hold exactly the data described by the header
+        fileSize = os.path.getsize(absImgPath)
+        if dataOffset < diskHeader.sizeof_hdr or \
+                fileSize != dataOffset + numVolumes * volumeBytes:
+            return False
+        self.inPlaceAppends[absImgPath] = {
+            'image': archiveImg,
+            'diskHeader': diskHeader,
+            'sidecarMetadata': sidecarMetadata,
+            'numVolumes': numVolumes,
+            'volumeBytes': volumeBytes,
+            'fileSize': fileSize,
+        }
+        return True
+
+    def _appendInPlace(self, incremental: BidsIncremental, absImgPath: str,
+                       validateAppend: bool = True) -> bool:
+        """
+        Appends the incremental's image data to an image previously set up with
+        _initInPlaceAppend, by writing the raw data at the end of the file and
+        patching the header's dimensions in place. Each append then costs the
+        size of the new data, rather than re-writing the whole image.
+
+        Returns:
+            True if the data was appended, False if the image isn't set up for in
+            place appends (or the file was changed by something else since).
+        """
+        state = self.inPlaceAppends.get(absImgPath)
+        if state is None:
+            return False
+        if not os.path.isfile(absImgPath) or \
+                os.path.getsize(absImgPath) != state['fileSize']:
+            del self.inPlaceAppends[absImgPath]
+            return False
+        archiveImg = state['image']
+        header = archiveImg.header
+        archiveShape = header.get_data_shape()
+        incrementalData = incremental.image.dataobj
+        if incremental.getImageDimensions()[:3] != archiveShape[:3] or \
+                not np.can_cast(incrementalData.dtype, header.get_data_dtype(),
+                                casting='safe'):
+            del self.inPlaceAppends[absImgPath]
+            return False
+
+        # The archive image header and sidecar were validated on the first
+        # append, later incrementals are checked against those in memory
+        if validateAppend:
+            compatible, errorMsg = niftiImagesAppendCompatible(
+                incremental.image, archiveImg)
+            if not compatible:
+                raise MetadataMismatchError(
+                    "NIfTI headers not append compatible: " + errorMsg)
+
+            compatible, errorMsg = metadataAppendCompatible(
+                incremental.getImageMetadata(), state['sidecarMetadata'])
+            if not compatible:
+                raise MetadataMismatchError(
+                    "Image metadata not append compatible: " + errorMsg)
+
+        newData = getNiftiData(incremental.image)
+        if newData.ndim == 3:
+            newData = np.expand_dims(newData, 3)
+        newVolumes = newData.shape[3]
+        # NIfTI data is stored in Fortran order, so the new volumes follow the
+        # existing ones on disk
+        dataBytes = np.asarray(newData, dtype=header.get_data_dtype()) \
+            .tobytes(order='F')
+
+        numVolumes = state['numVolumes'] + newVolumes
+        diskHeader = state['diskHeader']
+        diskHeader.set_data_shape((*archiveShape[:3], numVolumes))
+        if len(archiveShape) == 3:
+            correct3DHeaderTo4D(archiveImg, incremental.getMetadataField(
+                "RepetitionTime"))
+            diskHeader.set_zooms(archiveImg.header.get_zooms())
+            diskHeader.set_xyzt_units(*archiveImg.header.get_xyzt_units())
+        header.set_data_shape((*archiveShape[:3], numVolumes))
+        # The header block has a fixed size, so re-writing it leaves any header
+        # extensions and the data in place
+        with open(absImgPath, 'r+b') as imgFile:
+            imgFile.seek(state['fileSize'])
+            imgFile.write(dataBytes)
+            imgFile.seek(0)
+            imgFile.write(diskHeader.binaryblock)
+        state['numVolumes'] = numVolumes
+        state['fileSize'] += len(dataBytes)
+        return True
+
     @failIfEmpty
     def _getIncremental(self, imageIndex: int = 0, **entities) \
             -> BidsIncremental:
@@ -624,7 +830,7 @@ class BidsArchive:
         if imageIndex < 0:
             raise IndexError(f"Image index must be >= 0 (got {imageIndex})")
 
-        candidates = self.getImages(**entities)
+        candidates = self._findImages(**entities)
 
         # Throw error if not exactly one match
         if len(candidates) == 0:
@@ -637,7 +843,7 @@ class BidsArchive:
 
         # Create BIDS-I
         candidate = candidates[0]
-        image = candidate.get_image()
+        image = nib.load(candidate)
 
         # Process error conditions and extract image from volume if necessary
         nDimensions = len(image.dataobj.shape)
@@ -676,6 +882,36 @@ class BidsArchive:
             raise MissingMetadataError("Archive lacks required metadata for "
                                        "BIDS Incremental creation: " + str(e))
 
+    @failIfEmpty
+    def getRunImagePath(self, **entities) -> str:
+        """
+        Get the path of the image file of a run in the archive.
+
+        Args:
+            entities: Entities defining a run in the archive.
+
+        Returns:
+            The absolute path of the run's image file.
+
+        Raises:
+            NoMatchError: If the entities don't match any runs in the archive.
+            QueryError: If the entities match more than one run in the archive.
+
+        Examples:
+            >>> archive = BidsArchive('/tmp/dataset')
+            >>> archive.getRunImagePath(subject='01', task='test', run=1)
+            '/tmp/dataset/sub-01/func/sub-01_task-test_run-1_bold.nii'
+        """
+        images = self._findImages(**entities)
+        if len(images) == 0:
+            raise NoMatchError(f"Found no runs matching entities {entities}")
+        if len(images) > 1:
+            entities = [self.index.getEntities(img) for img in images]
+            raise QueryError("Provided entities were not unique to one run; "
+                             "try specifying more entities "
+                             f" (got runs with these entities: {entities}")
+        return images[0]
+
     @failIfEmpty
     def getBidsRun(self, **entities) -> BidsRun:
         """
@@ -698,92 +934,66 @@ class BidsArchive:
             >>> print(run.numIncrementals())
             53
         """
-        images = self.getImages(**entities)
-        if len(images) == 0:
-            raise NoMatchError(f"Found no runs matching entities {entities}")
-        if len(images) > 1:
-            entities = [img.get_entities() for img in images]
-            raise QueryError("Provided entities were not unique to one run; "
-                             "try specifying more entities "
-                             f" (got runs with these entities: {entities}")
-        else:
-            bidsImage = images[0]
-            niftiImage = bidsImage.get_image()
-            # TODO: Add inheritance processing for higher-level metadata JSON
-            # files, in the style of the below events file inheritance
-            metadata = self.getSidecarMetadata(bidsImage)
-            metadata.pop('extension')  # only used in PyBids
-
-            # This incremental will typically have a 4th (time) dimension > 1
-            incremental = BidsIncremental(niftiImage, metadata)
-
-            # Get dataset description, set
-            incremental.datasetDescription = self.getDatasetDescription()
-
-            # Get README, set
-            with open(self.getReadme().path) as readmeFile:
-                incremental.readme = readmeFile.read()
-
-            # Get events file, set
-            # Due to inheritance, must find and process all events files the
-            # target image inherits from to create the final events file for
-            # this run
-
-            # Parse out the events files that the image file inherits from
-            inheritedFiles = []
-            searchEntities = bidsImage.get_entities()
-            # only want to compare entities, not file type
-            searchEntities.pop('extension', None)
-            searchEntities.pop('suffix', None)
-
-            allEventsFiles = self.getEvents()
-            for eventFile in allEventsFiles:
-                fileEntities = eventFile.get_entities()
-                # only want to compare entities, not file type
-                fileEntities.pop('extension', None)
-                fileEntities.pop('suffix', None)
-                if all(item in searchEntities.items() for item in
-                       fileEntities.items()):
-                    inheritedFiles.append(eventFile)
-
-            # Sort the files by their position in the hierarchy.
-            # Metric: Files with shorter path lengths are higher in the
-            # inheritance hierarchy.
-            inheritedFiles.sort(key=lambda eventsFile: len(eventsFile.path))
-
-            # Merge every subsequent events file's DataFrame, in order of
-            # inheritance (from top level to bottom level)
-            # Using a dictionary representation of the DataFrame gives access to
-            # the dict.update() method, which has exactly the desired
-            # combination behavior for inheritance (replace conflicting values
-            # with the new values, keep any non-conflicting values)
-            def mergeEventsFiles(base: dict,
-                                 eventsFile: BIDSDataFile):
-                # Set DataFrame to be indexed by 'onset' column to ensure
-                # dictionary update changes rows when onsets match
-                dfToAdd = eventsFile.get_df()
-                dfToAdd.set_index('onset', inplace=True, drop=False)
-                base.update(dfToAdd.to_dict(orient='index'))
-                return base
-
-            eventsDFDict = functools.reduce(mergeEventsFiles, inheritedFiles, {})
-            eventsDF = pd.DataFrame.from_dict(eventsDFDict, orient='index')
-            # If there's no data in the DataFrame, create the default empty
-            # events file DataFrame
-            if eventsDF.empty:
-                eventsDF = pd.DataFrame(columns=DEFAULT_EVENTS_HEADERS)
-
-            # Ensure the events file order is the same as presentation/onset
-            # order
-            eventsDF.sort_values(by='onset', inplace=True,
-                                 ignore_index=True)
-            incremental.events = correctEventsFileDatatypes(eventsDF)
-
-            run = BidsRun()
-            # appendIncremental will take care of splitting the BidsIncremental
-            # into its component 3-D images
-            run.appendIncremental(incremental, validateAppend=False)
-            return run
+        imagePath = self.getRunImagePath(**entities)
+        niftiImage = nib.load(imagePath)
+        # The metadata is inherited from all the image's sidecar JSON files
+        metadata = self.getSidecarMetadata(imagePath)
+        metadata.pop('extension')  # only used in PyBids
+
+        # This incremental will typically have a 4th (time) dimension > 1
+        incremental = BidsIncremental(niftiImage, metadata)
+
+        # Get dataset description, set
+        incremental.datasetDescription = self._getDatasetDescription()
+
+        # Get README, set
+        with open(self.getReadme().path) as readmeFile:
+            incremental.readme = readmeFile.read()
+
+        # Get events file, set
+        # Due to inheritance, must find and process all events files the
+        # target image inherits from to create the final events file for
+        # this run
+
+        # The events files that the image file inherits from, sorted by
+        # their position in the hierarchy (from top level to bottom level)
+        inheritedFiles = [
+            self.absPathFromRelPath(relPath) for relPath in
+            self.index.getInheritanceChain(imagePath, suffix='events',
+                                           extensions=('.tsv', '.tsv.gz'))]
+
+        # Merge every subsequent events file's DataFrame, in order of
+        # inheritance (from top level to bottom level)
+        # Using a dictionary representation of the DataFrame gives access to
+        # the dict.update() method, which has exactly the desired
+        # combination behavior for inheritance (replace conflicting values
+        # with the new values, keep any non-conflicting values)
+        def mergeEventsFiles(base: dict, eventsPath: str):
+            # Set DataFrame to be indexed by 'onset' column to ensure
+            # dictionary update changes rows when onsets match
+            dfToAdd = pd.read_csv(eventsPath, sep='\t', na_values='n/a')
+            dfToAdd.set_index('onset', inplace=True, drop=False)
+            base.update(dfToAdd.to_dict(orient='index'))
+            return base
+
+        eventsDFDict = functools.reduce(mergeEventsFiles, inheritedFiles, {})
+        eventsDF = pd.DataFrame.from_dict(eventsDFDict, orient='index')
+        # If there's no data in the DataFrame, create the default empty
+        # events file DataFrame
+        if eventsDF.empty:
+            eventsDF = pd.DataFrame(columns=DEFAULT_EVENTS_HEADERS)
+
+        # Ensure the events file order is the same as presentation/onset
+        # order
+        eventsDF.sort_values(by='onset', inplace=True,
+                             ignore_index=True)
+        incremental.events = correctEventsFileDatatypes(eventsDF)
+
+        run = BidsRun()
+        # appendIncremental will take care of splitting the BidsIncremental
+        # into its component 3-D images
+        run.appendIncremental(incremental, validateAppend=False)
+        return run
 
     def appendBidsRun(self, run: BidsRun) -> None:
         """
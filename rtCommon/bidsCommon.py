@@ -11,6 +11,7 @@ from typing import Any, Callable, Tuple
 import functools
 import logging
 import re
+import threading
 
 from bids.layout.models import Config as BidsConfig
 import nibabel as nib
@@ -265,6 +266,14 @@ def getDicomMetadata(dicomImg: pydicom.dataset.Dataset, kind='all') -> dict:
         raise TypeError("Expected pydicom.dataset.Dataset as argument")
 
     metadata = {}
+    for _, cleanedKey, value in _dicomMetadataItems(dicomImg, kind):
+        metadata[cleanedKey] = value
+
+    return metadata
+
+
+def _dicomMetadataItems(dicomImg: pydicom.dataset.Dataset, kind='all'):
+    """Yields (tag, cleanedKey, value) for each metadata field getDicomMetadata returns"""
     STORE_PRIVATE = (kind == 'all' or kind == 'private')
     STORE_PUBLIC = (kind == 'all' or kind == 'public')
 
@@ -274,18 +283,161 @@ def getDicomMetadata(dicomImg: pydicom.dataset.Dataset, kind='all') -> dict:
         if elem.name in ignoredTags:
             continue
 
-        cleanedKey = makeDicomFieldBidsCompatible(elem.name)
         # in DICOM, public tags have even group numbers and private tags are odd
         # http://dicom.nema.org/dicom/2013/output/chtml/part05/chapter_7.html
-        value = str(elem.value)
-
         if elem.tag.is_private:
-            if STORE_PRIVATE:
-                metadata[cleanedKey] = value
-        elif STORE_PUBLIC:
-            metadata[cleanedKey] = value
+            if not STORE_PRIVATE:
+                continue
+        elif not STORE_PUBLIC:
+            continue
 
-    return metadata
+        cleanedKey = makeDicomFieldBidsCompatible(elem.name)
+        yield elem.tag, cleanedKey, dicomValueToStr(elem.value)
+
+
+def dicomValueToStr(value) -> str:
+    """Returns the metadata string of a DICOM value, empty numeric values are '' not 'None'"""
+    if value is None:
+        return ''
+    return str(value)
+
+
+class DicomMetadataCache:
+    """
+    Per-series template of the DICOM metadata, so that only the fields that change
+    from volume to volume are read for each new volume.
+
+    Most of a series' header (and nearly all of its size, i.e. the Siemens CSA series
+    header) is the same for every volume. The first volume of a series is parsed fully
+    with getDicomMetadata and kept as the template. The second volume is also parsed
+    fully and compared to the template, which adds any other changing fields to the
+    per-volume fields. Later volumes copy the template and read only the per-volume
+    fields, which also means pydicom only decodes those elements of the file.
+
+    A volume from a different series (SeriesInstanceUID) or with a different image size
+    starts a new template. A volume whose set of DICOM tags (other than the per-volume
+    ones) differs from the template's is parsed fully and compared again, as for the
+    second volume. A field that has the
+    same value in the first two volumes and then changes, without any tag being added
+    or removed, is only picked up if relearnInterval is set.
+    """
+    # Fields known to change between the volumes of a series
+    volumeFields = ['SOPInstanceUID', 'InstanceNumber', 'AcquisitionNumber',
+                    'AcquisitionDate', 'AcquisitionTime', 'AcquisitionDateTime',
+                    'ContentDate', 'ContentTime', 'InstanceCreationDate',
+                    'InstanceCreationTime', 'ImagePositionPatient', 'SliceLocation',
+                    'TriggerTime', 'SmallestImagePixelValue', 'LargestImagePixelValue',
+                    'WindowCenter', 'WindowWidth', 'SourceImageSequence', 'ImageComments']
+    # Private fields known to change, the Siemens CSA image header
+    volumePrivateTags = [0x00291010]
+
+    def __init__(self, kind='all', relearnInterval=0):
+        """
+        Args:
+            kind: Metadata category to get, as in getDicomMetadata: 'public',
+                'private' or 'all'.
+            relearnInterval: Also parse every Nth volume fully and compare it to the
+                template, to pick up fields that start changing later in the series.
+                0 only compares volumes whose set of tags changed.
+        """
+        self.kind = kind
+        self.relearnInterval = relearnInterval
+        self.lock = threading.Lock()
+        self.seriesKey = None
+        self.template = None
+        self.templateTags = None
+        # the DICOM tags (other than the per-volume ones) of the last volume the
+        #   template was learned from
+        self.templateSignature = None
+        self.numVolumes = 0
+        self.defaultVolumeTags = set()
+        for keyword in self.volumeFields:
+            self.defaultVolumeTags.add(pydicom.tag.Tag(keyword))
+        for tag in self.volumePrivateTags:
+            self.defaultVolumeTags.add(pydicom.tag.Tag(tag))
+        # map from tag to cleanedKey of the per-volume fields
+        self.volumeTags = {}
+
+    def getMetadata(self, dicomImg: pydicom.dataset.Dataset) -> dict:
+        """
+        Returns the metadata of the DICOM image, the same as
+        getDicomMetadata(dicomImg, kind).
+
+        Args:
+            dicomImg: A Pydicom object to read metadata from.
+
+        Returns:
+            Dictionary containing requested metadata from the DICOM image.
+        """
+        if not isinstance(dicomImg, pydicom.dataset.Dataset):
+            raise TypeError("Expected pydicom.dataset.Dataset as argument")
+
+        seriesKey = (dicomImg.get('SeriesInstanceUID'), dicomImg.get('Rows'),
+                     dicomImg.get('Columns'))
+        if seriesKey[0] is None:
+            # no way to tell which volumes belong together
+            return getDicomMetadata(dicomImg, self.kind)
+
+        with self.lock:
+            if seriesKey != self.seriesKey:
+                self._newTemplate(dicomImg, seriesKey)
+                return dict(self.template)
+            # numVolumes + 1 is this volume's number in the series
+            relearn = (self.relearnInterval > 0 and
+                       (self.numVolumes + 1) % self.relearnInterval == 0)
+            if self.numVolumes == 1 or relearn or \
+                    self._signature(dicomImg) != self.templateSignature:
+                return self._learnVolumeFields(dicomImg)
+            template = self.template
+            volumeTags = list(self.volumeTags.items())
+            self.numVolumes += 1
+
+        metadata = dict(template)
+        for tag, cleanedKey in volumeTags:
+            elem = dicomImg.get(tag)
+            if elem is None:
+                metadata.pop(cleanedKey, None)
+            else:
+                metadata[cleanedKey] = dicomValueToStr(elem.value)
+        return metadata
+
+    def _signature(self, dicomImg) -> frozenset:
+        # the tags of the volume other than the per-volume ones, which may come and go
+        return frozenset(tag for tag in dicomImg.keys() if tag not in self.volumeTags)
+
+    def _newTemplate(self, dicomImg, seriesKey) -> None:
+        self.template = {}
+        self.templateTags = {}
+        self.volumeTags = {}
+        for tag, cleanedKey, value in _dicomMetadataItems(dicomImg, self.kind):
+            self.template[cleanedKey] = value
+            self.templateTags[cleanedKey] = tag
+            if tag in self.defaultVolumeTags:
+                self.volumeTags[tag] = cleanedKey
+        self.templateSignature = self._signature(dicomImg)
+        self.seriesKey = seriesKey
+        self.numVolumes = 1
+
+    def _learnVolumeFields(self, dicomImg) -> dict:
+        # parse the volume fully (i.e. the second volume), anything that differs from
+        #   the template is also read per volume from now on
+        metadata = {}
+        templateTags = {}
+        for tag, cleanedKey, value in _dicomMetadataItems(dicomImg, self.kind):
+            metadata[cleanedKey] = value
+            templateTags[cleanedKey] = tag
+            if tag in self.defaultVolumeTags or self.template.get(cleanedKey) != value:
+                self.volumeTags[tag] = cleanedKey
+        for cleanedKey in self.template.keys() - templateTags.keys():
+            # a field this volume doesn't have is read per volume from now on
+            self.volumeTags[self.templateTags[cleanedKey]] = cleanedKey
+        self.template = metadata
+        self.templateTags = templateTags
+        self.templateSignature = self._signature(dicomImg)
+        self.numVolumes += 1
+        logger.debug("DicomMetadataCache: %d per-volume fields of %d",
+                     len(self.volumeTags), len(metadata))
+        return dict(metadata)
 
 
 def symmetricDictDifference(d1: dict, d2: dict,
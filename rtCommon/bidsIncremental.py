@@ -9,7 +9,7 @@ different applications.
 from copy import deepcopy
 from datetime import datetime
 from operator import eq as opeq
-from typing import Any, Callable
+from typing import Any, Callable, List
 import json
 import os
 
@@ -39,7 +39,7 @@ from rtCommon.bidsCommon import (
     symmetricDictDifference,
     writeDataFrameToEvents,
 )
-from rtCommon.utils import getTimeToNextTR
+from rtCommon.utils import getTimeToNextTR, replayClockTimeOfDay
 from rtCommon.errors import MissingMetadataError
 
 logger = logging.getLogger(__name__)
@@ -581,11 +581,11 @@ class BidsIncremental:
         acquisitionTime = self.getAcquisitionTime()
         repetitionTime = self.getRepetitionTime()
         if now is None:  # now variable can be passed in for testing
-            now = datetime.now().time()
+            now = replayClockTimeOfDay()
         secToNextTr = getTimeToNextTR(acquisitionTime, repetitionTime, now, clockSkew)
         return secToNextTr
 
-    def writeToDisk(self, datasetRoot: str, onlyData=False) -> None:
+    def writeToDisk(self, datasetRoot: str, onlyData=False) -> List[str]:
         """
         Writes the incremental's data to a directory on disk. NOTE: The
         directory is assumed to be empty, and no checks are made for data that
@@ -598,6 +598,9 @@ class BidsIncremental:
                 existing archive and you don't want to overwrite existing README
                 or dataset_description.json files.
 
+        Returns:
+            The paths of the files written.
+
         Examples:
             >>> from bidsArchive import BidsArchive
             >>> incremental = BidsIncremental(image, metadata)
@@ -628,6 +631,7 @@ class BidsIncremental:
             json.dump(metadataToWrite, metadataFile, sort_keys=True, indent=4)
 
         writeDataFrameToEvents(self.events, eventsPath)
+        writtenPaths = [imagePath, metadataPath, eventsPath]
 
         if not onlyData:
             # Write out dataset description
@@ -637,5 +641,8 @@ class BidsIncremental:
             # Write out readme
             with open(readmePath, mode='w') as readme:
                 readme.write(self.readme)
+            writtenPaths.extend([descriptionPath, readmePath])
+
+        return writtenPaths
 
     """ END BIDS-I ARCHIVE EMULTATION API """
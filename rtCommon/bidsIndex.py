@@ -0,0 +1,306 @@
+"""-----------------------------------------------------------------------------
+
+bidsIndex.py
+
+Implements an index of the files in an on-disk BIDS Archive and the BIDS
+entities in their paths, which can be updated one file at a time. The index
+answers the queries needed when streaming to or from an archive (the files with
+given entities, and the sidecar metadata and events files a file inherits from)
+with dictionary lookups, rather than PyBids database queries.
+
+-----------------------------------------------------------------------------"""
+import functools
+import json
+import logging
+import os
+import threading
+
+from bids.layout.models import Config as BidsConfig
+
+logger = logging.getLogger(__name__)
+
+# Top-level directories that aren't part of the raw dataset, the same ones
+# PyBids ignores by default
+IGNORED_DIRECTORIES = ['code', 'derivatives', 'sourcedata', 'stimuli']
+
+
+@functools.lru_cache(maxsize=1)
+def loadPathEntities() -> list:
+    """
+    Loads the entities PyBids extracts from the paths of raw BIDS dataset
+    files, as a list of (name, compiled regex, value type) tuples.
+    """
+    entities = BidsConfig.load('bids').entities
+    return [(name, entity.regex, entity.dtype)
+            for name, entity in entities.items()]
+
+
+@functools.lru_cache(maxsize=1)
+def loadEntityTypes() -> dict:
+    """Returns the type of each entity's values, as PyBids converts them"""
+    return {name: dtype for name, _, dtype in loadPathEntities()}
+
+
+def normalizeEntityValue(name: str, value):
+    """
+    Converts an entity value to the type parsed from paths (e.g., the run
+    entity '01' or 1 to an int), so it can be used for index lookups.
+    """
+    dtype = loadEntityTypes().get(name)
+    if dtype is None or value is None:
+        return value
+    try:
+        return dtype(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def parseBidsPath(relPath: str) -> dict:
+    """
+    Extracts the BIDS entities from the path of a file in a BIDS archive, the
+    same way PyBids does.
+
+    Args:
+        relPath: Path of the file relative to the archive root
+
+    Returns:
+        Dictionary of the entities in the path (including the 'suffix',
+        'datatype' and 'extension' pseudo-entities, if present).
+
+    Examples:
+        >>> parseBidsPath('sub-01/func/sub-01_task-faces_run-1_bold.nii')
+        {'subject': '01', 'task': 'faces', 'run': 1, 'suffix': 'bold',
+         'datatype': 'func', 'extension': '.nii'}
+    """
+    # Entity patterns expect the file to be below a directory separator
+    path = '/' + relPath.replace(os.sep, '/').lstrip('/')
+    entities = {}
+    for name, regex, dtype in loadPathEntities():
+        match = regex.search(path)
+        if match is not None:
+            entities[name] = dtype(match.group(1))
+    return entities
+
+
+class BidsIndex:
+    def __init__(self, rootPath: str):
+        """
+        BidsIndex keeps the paths of the files in a BIDS archive along with the
+        entities parsed from them. It is built with one walk of the archive
+        directory, and then updated as files are added to the archive, rather
+        than re-indexing the whole archive.
+
+        Args:
+            rootPath: Path to the archive on disk.
+        """
+        self.rootPath = os.path.abspath(rootPath)
+        self.lock = threading.RLock()
+        # relative path -> entities
+        self.files = {}
+        # entity name -> entity value -> set of relative paths, for subset
+        #   queries by set intersection
+        self.entityIndex = {}
+        # frozenset of the entity items other than extension -> set of
+        #   relative paths, for exact queries
+        self.exactIndex = {}
+        # (relative path, suffix, extensions) -> inheritance chain
+        self.inheritanceChains = {}
+        self.rescan()
+
+    def __len__(self):
+        return len(self.files)
+
+    def relPath(self, path: str) -> str:
+        """
+        Returns the path relative to the archive root, for a path that is
+        absolute or relative to the archive root.
+        """
+        if path.startswith(self.rootPath + os.sep):
+            return os.path.relpath(path, self.rootPath)
+        return os.path.normpath(path.lstrip('/'))
+
+    def rescan(self) -> None:
+        """Re-builds the index from the files currently in the archive"""
+        with self.lock:
+            self.files = {}
+            self.entityIndex = {}
+            self.exactIndex = {}
+            self.inheritanceChains = {}
+            if os.path.isdir(self.rootPath):
+                self._scanDir(self.rootPath, '', topLevel=True)
+
+    def _scanDir(self, absDir: str, relDir: str, topLevel: bool = False):
+        with os.scandir(absDir) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                relPath = os.path.join(relDir, entry.name)
+                if entry.is_dir():
+                    if topLevel and entry.name in IGNORED_DIRECTORIES:
+                        continue
+                    self._scanDir(entry.path, relPath)
+                else:
+                    self._indexFile(relPath, parseBidsPath(relPath))
+
+    @staticmethod
+    def _exactKey(entities: dict) -> frozenset:
+        return frozenset((name, value) for name, value in entities.items()
+                         if name != 'extension')
+
+    def _indexFile(self, relPath: str, entities: dict) -> None:
+        self._unindexFile(relPath)
+        self.files[relPath] = entities
+        for name, value in entities.items():
+            self.entityIndex.setdefault(name, {}).setdefault(value, set()) \
+                .add(relPath)
+        self.exactIndex.setdefault(self._exactKey(entities), set()).add(relPath)
+
+    def _unindexFile(self, relPath: str) -> None:
+        entities = self.files.pop(relPath, None)
+        if entities is None:
+            return
+        for name, value in entities.items():
+            self.entityIndex[name][value].discard(relPath)
+        self.exactIndex[self._exactKey(entities)].discard(relPath)
+
+    def addFile(self, path: str) -> dict:
+        """
+        Adds (or updates) a file in the index.
+
+        Args:
+            path: Absolute path, or path relative to the archive root, of the
+                file
+
+        Returns:
+            The entities of the file.
+        """
+        relPath = self.relPath(path)
+        entities = parseBidsPath(relPath)
+        with self.lock:
+            self._indexFile(relPath, entities)
+            # A new file can change any file's inheritance
+            self.inheritanceChains = {}
+        logger.debug("Indexed %s: %s", relPath, entities)
+        return entities
+
+    def removeFile(self, path: str) -> None:
+        """Removes a file from the index, if it is in it"""
+        with self.lock:
+            self._unindexFile(self.relPath(path))
+            self.inheritanceChains = {}
+
+    def hasFile(self, path: str) -> bool:
+        """Returns whether the file is in the index"""
+        return self.relPath(path) in self.files
+
+    def getEntities(self, path: str) -> dict:
+        """Returns the entities of an indexed file, or None if it isn't indexed"""
+        return self.files.get(self.relPath(path))
+
+    def getFiles(self, matchExact: bool = False, **entities) -> list:
+        """
+        Returns the relative paths of the indexed files that have all of the
+        provided entities.
+
+        Args:
+            matchExact: Only return files that have exactly the provided
+                entities (other than the extension, if it isn't provided).
+            entities: Entities the files must have. A list of values matches
+                any of the values.
+
+        Returns:
+            Sorted list of the relative paths of the matching files.
+        """
+        entities = {name: (value if isinstance(value, (list, tuple, set))
+                           else normalizeEntityValue(name, value))
+                    for name, value in entities.items()}
+        with self.lock:
+            if matchExact:
+                extension = entities.get('extension')
+                matches = self.exactIndex.get(self._exactKey(entities), set())
+                if extension is not None:
+                    matches = {relPath for relPath in matches
+                               if self.files[relPath].get('extension') ==
+                               extension}
+                return sorted(matches)
+
+            matchSets = []
+            for name, value in entities.items():
+                values = self.entityIndex.get(name, {})
+                if isinstance(value, (list, tuple, set)):
+                    matchSets.append(set().union(
+                        *[values.get(normalizeEntityValue(name, v), set())
+                          for v in value]))
+                else:
+                    matchSets.append(values.get(value, set()))
+            if len(matchSets) == 0:
+                return sorted(self.files.keys())
+            matchSets.sort(key=len)
+            return sorted(set.intersection(*matchSets))
+
+    def getInheritanceChain(self, path: str, suffix: str = None,
+                            extensions: tuple = ('.json',)) -> list:
+        """
+        Returns the files a file inherits from under the BIDS inheritance
+        principle: files with the given suffix and extension, in the file's
+        directory or one above it, whose entities are all also entities of the
+        file. The chains are computed once and kept until the index changes.
+
+        Args:
+            path: Path (absolute or relative to the archive root) of the file
+            suffix: Suffix of the inherited files, the file's suffix if None
+            extensions: Extensions of the inherited files (e.g. '.json' for
+                sidecar metadata, or '.tsv' for events)
+
+        Returns:
+            Relative paths of the inherited files, from the top of the
+            hierarchy (least specific) to the bottom (most specific).
+        """
+        relPath = self.relPath(path)
+        with self.lock:
+            targetEntities = self.files.get(relPath)
+            if targetEntities is None:
+                targetEntities = parseBidsPath(relPath)
+            if suffix is None:
+                suffix = targetEntities.get('suffix')
+            key = (relPath, suffix, tuple(extensions))
+            chain = self.inheritanceChains.get(key)
+            if chain is not None:
+                return chain
+
+            ignored = ('suffix', 'extension')
+            targetDir = os.path.dirname(relPath)
+            chain = []
+            for candidate in self.getFiles(suffix=suffix,
+                                           extension=list(extensions)):
+                if candidate == relPath:
+                    continue
+                candidateDir = os.path.dirname(candidate)
+                if candidateDir != '' and candidateDir != targetDir and \
+                        not targetDir.startswith(candidateDir + os.sep):
+                    continue
+                candidateEntities = self.files[candidate]
+                if all(targetEntities.get(name) == value
+                       for name, value in candidateEntities.items()
+                       if name not in ignored):
+                    chain.append(candidate)
+            # Files higher in the directory tree, and then those with fewer
+            # entities, are less specific
+            chain.sort(key=lambda candidate: (candidate.count(os.sep),
+                                              len(self.files[candidate])))
+            self.inheritanceChains[key] = chain
+            return chain
+
+    def getMetadata(self, path: str) -> dict:
+        """
+        Returns the sidecar metadata of a file, merged from the JSON files it
+        inherits from (more specific files override less specific ones). As in
+        PyBids, fields named like entities aren't part of the metadata.
+        """
+        metadata = {}
+        for relPath in self.getInheritanceChain(path, extensions=('.json',)):
+            with open(os.path.join(self.rootPath, relPath)) as jsonFile:
+                metadata.update(json.load(jsonFile))
+        entityTypes = loadEntityTypes()
+        return {field: value for field, value in metadata.items()
+                if field not in entityTypes}
@@ -8,18 +8,21 @@ and another at the control room computer, run as a service and with dataRemote=F
 
 When not using RPC, i.e. when the projectServer is run without --dataRemote, there will be only
 one instance of dataInterface, as part of the projectServer with dataRemote=False.
+
+The BIDS modules (pybids, pandas, nibabel) are imported when a stream is first opened
+so that services using this interface start quickly.
 """
 import os
 import time
+import threading
+from typing import TYPE_CHECKING
 from rtCommon.remoteable import RemoteableExtensible
-from rtCommon.bidsArchive import BidsArchive
-from rtCommon.bidsIncremental import BidsIncremental
-from rtCommon.bidsCommon import getDicomMetadata
-from rtCommon.imageHandling import convertDicomImgToNifti
 from rtCommon.dataInterface import DataInterface
 from rtCommon.openNeuro import OpenNeuroCache
 from rtCommon.errors import RequestError, MissingMetadataError
 from rtCommon.utils import demoDelay
+if TYPE_CHECKING:
+    from rtCommon.bidsIncremental import BidsIncremental
 
 class BidsInterface(RemoteableExtensible):
     """
@@ -47,14 +50,18 @@ class BidsInterface(RemoteableExtensible):
         if dataRemote is True:
             return
         # local version initialization here
-        # TODO - make multithread streams possible
-        #      - get next streamId in thread safe way
-        #      - cleanup stale streams
-        nextStreamId = 1
+        # map from streamId to the open DicomToBidsStream or BidsStream
         self.streamMap = {}
+        # map from streamId to the stream's OnlinePreprocessor, if set
+        self.streamPreprocessors = {}
+        self.nextStreamId = 1
+        self.streamLock = threading.Lock()
         # Store the allowed directories to be used by the DicomToBidsStream class
         self.allowedDirs = allowedDirs
         self.scannerClockSkew = scannerClockSkew
+        # DataInterface shared by the DicomToBidsStreams, so all streams are served by
+        #   one FileWatcher, created when the first DicomToBidsStream is opened
+        self.dicomDataInterface = None
         self.openNeuroCache = OpenNeuroCache(cachePath="/tmp/openneuro")
 
 
@@ -77,30 +84,32 @@ class BidsInterface(RemoteableExtensible):
         Returns:
             streamId: An int identifier to be used when calling stream functions, such as getIncremental()
         """
-        # TODO - allow multiple simultaneous streams to be instantiated
-        streamId = 1
-        dicomBidsStream = DicomToBidsStream(self.allowedDirs)
+        with self.streamLock:
+            if self.dicomDataInterface is None:
+                self.dicomDataInterface = DataInterface(dataRemote=False,
+                                                        allowedDirs=self.allowedDirs,
+                                                        allowedFileTypes=['.dcm'])
+        dicomBidsStream = DicomToBidsStream(self.allowedDirs, dataInterface=self.dicomDataInterface)
         dicomBidsStream.initStream(dicomDir, dicomFilePattern, dicomMinSize,
                                    anonymize=anonymize, **entities)
-        self.streamMap[streamId] = dicomBidsStream
-        return streamId
+        return self._addStream(dicomBidsStream)
 
-    def initBidsStream(self, archivePath, **entities) -> int:
+    def initBidsStream(self, archivePath, lazy=False, prefetch=0, **entities) -> int:
         """
         Initialize a data stream from an existing BIDS archive.
 
         Args:
             archivePath: Full path to the BIDS archive
+            lazy: Read each volume from the archive when it is requested rather than
+                loading the whole run when the stream is opened
+            prefetch: With lazy, the number of volumes to read ahead in the background
             entities: BIDS entities (subject, session, task, run, suffix, datatype) that
                 define the particular subject/run of the data to stream
         Returns:
             streamId: An int identifier to be used when calling stream functions, such as getIncremental()
         """
-        # TODO - allow multiple simultaneous streams to be instantiated
-        streamId = 1
-        bidsStream = BidsStream(archivePath, **entities)
-        self.streamMap[streamId] = bidsStream
-        return streamId
+        bidsStream = BidsStream(archivePath, lazy=lazy, prefetch=prefetch, **entities)
+        return self._addStream(bidsStream)
 
     def initOpenNeuroStream(self, dsAccessionNumber, **entities) -> int:
         """
@@ -117,13 +126,18 @@ class BidsInterface(RemoteableExtensible):
             raise RequestError("initOpenNeuroStream: Must specify subject and run number")
         print(f'Caching data for dataset {dsAccessionNumber}')
         archivePath = self.openNeuroCache.downloadData(dsAccessionNumber, **entities)
-        # TODO - allow multiple simultaneous streams to be instantiated
-        streamId = 1
         bidsStream = BidsStream(archivePath, **entities)
-        self.streamMap[streamId] = bidsStream
+        return self._addStream(bidsStream)
+
+    def _addStream(self, stream) -> int:
+        """Add stream to the streamMap and return its new streamId"""
+        with self.streamLock:
+            streamId = self.nextStreamId
+            self.nextStreamId += 1
+            self.streamMap[streamId] = stream
         return streamId
 
-    def getIncremental(self, streamId, volIdx=-1, timeout=5, demoStep=0) -> BidsIncremental:
+    def getIncremental(self, streamId, volIdx=-1, timeout=5, demoStep=0) -> 'BidsIncremental':
         """
         Get a BIDS Incremental from a stream
 
@@ -141,6 +155,68 @@ class BidsInterface(RemoteableExtensible):
         bidsIncremental = stream.getIncremental(volIdx, timeout=timeout, demoStep=demoStep)
         return bidsIncremental
 
+    def setStreamPreprocessing(self, streamId, detrendOrder: int=None, emaAlpha: float=None,
+                               zscore: bool=False) -> None:
+        """
+        Attach an online preprocessing stage to a stream, each volume retrieved with
+        getPreprocessedIncremental() is then also preprocessed (see onlinePreprocessing).
+        The running state is updated with each volume in the order they are retrieved.
+
+        Args:
+            streamId: The stream handle returned by the initXXStream call
+            detrendOrder: Polynomial order of the incremental detrending (1 for linear),
+                None for no detrending
+            emaAlpha: Alpha of an exponential moving average baseline to subtract,
+                None for no baseline subtraction
+            zscore: Whether to z-score each voxel with its running mean and std
+        """
+        from rtCommon.onlinePreprocessing import OnlinePreprocessor
+        if streamId not in self.streamMap:
+            raise RequestError(f"setStreamPreprocessing: stream {streamId} not found")
+        self.streamPreprocessors[streamId] = OnlinePreprocessor(detrendOrder=detrendOrder,
+                                                                emaAlpha=emaAlpha,
+                                                                zscore=zscore)
+
+    def getPreprocessedIncremental(self, streamId, volIdx=-1, timeout=5, demoStep=0) -> tuple:
+        """
+        Get a BIDS Incremental from a stream along with its preprocessed volume, the
+        stream's preprocessing must be set with setStreamPreprocessing(). Same args as
+        getIncremental.
+
+        Returns:
+            A tuple of the BidsIncremental (raw data) and a dict of the preprocessed
+            3D arrays, with 'processed' the output of the last stage
+        """
+        preprocessor = self.streamPreprocessors.get(streamId)
+        if preprocessor is None:
+            raise RequestError(f"getPreprocessedIncremental: no preprocessing set for "
+                               f"stream {streamId}, call setStreamPreprocessing()")
+        bidsIncremental = self.getIncremental(streamId, volIdx, timeout=timeout, demoStep=demoStep)
+        volume = bidsIncremental.getImageData()
+        if volume.ndim == 4:
+            volume = volume[..., 0]
+        return bidsIncremental, preprocessor.process(volume)
+
+    def setStreamRealignment(self, streamId, referenceFile: str=None, numLevels: int=2,
+                             maxIterations: int=5) -> None:
+        """
+        Realign each volume of a stream to a reference volume (rigid body, 6 DOF), see
+        realignment.RigidRealigner. The incrementals returned by getIncremental() then
+        have the realigned image, with the motion params [tx, ty, tz, rx, ry, rz]
+        (mm and radians) in the 'RealignmentParameters' metadata field.
+
+        Args:
+            streamId: The stream handle returned by the initXXStream call
+            referenceFile: A Nifti file of the reference volume, None to use the
+                next volume retrieved from the stream as the reference
+            numLevels: Number of resolution pyramid levels
+            maxIterations: Max Gauss-Newton iterations per level
+        """
+        if streamId not in self.streamMap:
+            raise RequestError(f"setStreamRealignment: stream {streamId} not found")
+        self.streamMap[streamId].setRealignment(referenceFile, numLevels=numLevels,
+                                                maxIterations=maxIterations)
+
     def getNumVolumes(self, streamId) -> int:
         """
         Return the number of image volumes contained in the stream. This is only
@@ -156,7 +232,23 @@ class BidsInterface(RemoteableExtensible):
 
     def closeStream(self, streamId):
         # remove the stream from the map
-        self.streamMap.pop(streamId, None)
+        stream = self.streamMap.pop(streamId, None)
+        self.streamPreprocessors.pop(streamId, None)
+        if stream is not None:
+            stream.close()
+
+    def close(self):
+        """
+        Close the open streams and the DataInterface serving the DicomToBidsStreams.
+        Called when the client session using this interface ends.
+        """
+        with self.streamLock:
+            streamIds = list(self.streamMap.keys())
+        for streamId in streamIds:
+            self.closeStream(streamId)
+        if self.dicomDataInterface is not None:
+            self.dicomDataInterface.close()
+            self.dicomDataInterface = None
 
     def getClockSkew(self, callerClockTime: float, roundTripTime: float) -> float:
         """
@@ -195,8 +287,23 @@ class DicomToBidsStream():
     script process data directly as BIDS as it arrives from the scanner.
     """
 
-    def __init__(self, allowedDirs=[]):
+    def __init__(self, allowedDirs=[], dataInterface=None, catchUpVolumes=8):
+        """
+        Args:
+            allowedDirs: Directories that Dicom files are allowed to be read from
+            dataInterface: A local DataInterface to open the DICOM stream with, which can be
+                shared by several streams. If None the stream creates its own.
+            catchUpVolumes: Max number of volumes, already written to the Dicom directory,
+                to convert together when catching up on a backlog
+        """
         self.allowedDirs = allowedDirs
+        self.dataInterface = dataInterface
+        self.catchUpVolumes = catchUpVolumes
+        # volume index -> (Dicom image, Nifti image) converted ahead while catching up
+        self.convertedBacklog = {}
+        self.dicomStreamId = None
+        self.metadataCache = None
+        self.realigner = None
 
     def initStream(self, dicomDir, dicomFilePattern, dicomMinSize,
                    anonymize=True, **entities):
@@ -229,14 +336,19 @@ class DicomToBidsStream():
         self.dicomDir = dicomDir
         self.dicomFilePattern = dicomFilePattern
         # TODO - restrict allowed directories, check that dicomDir is in allowed dir
-        self.dataInterface = DataInterface(dataRemote=False,
-                                           allowedDirs=self.allowedDirs,
-                                           allowedFileTypes=['.dcm'])
+        if self.dataInterface is None:
+            self.dataInterface = DataInterface(dataRemote=False,
+                                               allowedDirs=self.allowedDirs,
+                                               allowedFileTypes=['.dcm'])
         self.dicomStreamId = self.dataInterface.initScannerStream(dicomDir,
                                                                   dicomFilePattern,
                                                                   dicomMinSize,
                                                                   anonymize=anonymize)
+        # the header fields shared by all volumes of the run are only parsed once
+        from rtCommon.bidsCommon import DicomMetadataCache
+        self.metadataCache = DicomMetadataCache()
         self.nextVol = 0
+        self.convertedBacklog = {}
 
     def getNumVolumes(self) -> int:
         """
@@ -245,7 +357,21 @@ class DicomToBidsStream():
         """
         raise NotImplementedError('getNumVolumes not implemented for DicomBidsStream')
 
-    def getIncremental(self, volIdx=-1, timeout=5, demoStep=0) -> BidsIncremental:
+    def setRealignment(self, referenceImg=None, **realignerArgs):
+        """
+        Realign the volumes of the stream to a reference image (or to the next volume
+        if None), see realignment.IncrementalRealigner for the args
+        """
+        from rtCommon.realignment import IncrementalRealigner
+        self.realigner = IncrementalRealigner(referenceImg, **realignerArgs)
+
+    def close(self):
+        """Close the DICOM stream, removing its directory watch"""
+        if self.dicomStreamId is not None:
+            self.dataInterface.closeStream(self.dicomStreamId)
+            self.dicomStreamId = None
+
+    def getIncremental(self, volIdx=-1, timeout=5, demoStep=0) -> 'BidsIncremental':
         """
         Get the BIDS incremental for the corresponding DICOM image indicated
         by the volIdx, where volIdx is equivalent to TR id.
@@ -267,40 +393,96 @@ class DicomToBidsStream():
         else:
             # use the default next volume
             pass
-        # wait for the dicom and create a bidsIncremental
-        dcmImg = self.dataInterface.getImageData(self.dicomStreamId, self.nextVol, timeout=timeout)
-        dicomMetadata = getDicomMetadata(dcmImg)
+        from rtCommon.bidsIncremental import BidsIncremental
+        if self.nextVol in self.convertedBacklog:
+            dcmImg, niftiImage = self.convertedBacklog.pop(self.nextVol)
+        else:
+            dcmImg, niftiImage = self._convertWithBacklog(timeout)
+        # the metadata cache and realigner see the volumes in order
+        dicomMetadata = self.metadataCache.getMetadata(dcmImg)
         dicomMetadata.update(self.entities)
-        niftiImage = convertDicomImgToNifti(dcmImg)
         incremental = BidsIncremental(niftiImage, dicomMetadata)
+        if self.realigner is not None:
+            incremental = self.realigner.realign(incremental)
         self.nextVol += 1
         if demoStep is not None and demoStep > 0:
             demoDelay(demoStep)
         return incremental
 
+    def _convertWithBacklog(self, timeout):
+        """
+        Wait for the next volume's Dicom and convert it, along with the following
+        volumes already written (i.e. when the client has fallen behind), so that the
+        volumes needing dcm2niix are converted in parallel by the conversion pool.
+        The following volumes are kept for the next getIncremental() calls.
+        """
+        from rtCommon.imageHandling import convertDicomImgsToNifti
+        dcmImgs = [self.dataInterface.getImageData(self.dicomStreamId, self.nextVol,
+                                                   timeout=timeout)]
+        for volIdx in range(self.nextVol + 1, self.nextVol + self.catchUpVolumes):
+            filename = os.path.join(self.dicomDir, self.dicomFilePattern.format(TR=volIdx))
+            if not os.path.exists(filename):
+                break
+            try:
+                dcmImgs.append(self.dataInterface.getImageData(self.dicomStreamId, volIdx,
+                                                               timeout=1))
+            except RequestError:
+                # i.e. still being written, it is read when requested
+                break
+        niftiImgs = convertDicomImgsToNifti(dcmImgs)
+        # volumes converted for an earlier position of the stream are dropped
+        self.convertedBacklog = {self.nextVol + i: (dcmImg, niftiImg) for i, (dcmImg, niftiImg)
+                                 in enumerate(zip(dcmImgs[1:], niftiImgs[1:]), start=1)}
+        return dcmImgs[0], niftiImgs[0]
+
 
 class BidsStream:
     """
     A class that opens a BIDS archive and prepares to stream the data as
     BIDS incrementals.
     """
-    def __init__(self, archivePath, **entities):
+    def __init__(self, archivePath, lazy=False, prefetch=0, **entities):
         """
         Args:
             archivePath: Absolute path of the BIDS archive.
+            lazy: Read each volume from the run's image file when it is requested,
+                rather than loading the whole run into memory up front
+            prefetch: In lazy mode, the number of volumes after the last requested
+                one to read ahead in a background thread
             entities: BIDS entities (subject, session, task, run, suffix, datatype) that
                 define the particular subject/run of the data to stream
         """
+        from rtCommon.bidsArchive import BidsArchive
         self.bidsArchive = BidsArchive(archivePath)
-        self.bidsRun = self.bidsArchive.getBidsRun(**entities)
-        self.numVolumes = self.bidsRun.numIncrementals()
+        self.bidsRun = None
+        self.lazyRun = None
+        if lazy:
+            self.lazyRun = LazyBidsRun(self.bidsArchive, prefetch=prefetch, **entities)
+            self.numVolumes = self.lazyRun.numIncrementals()
+        else:
+            self.bidsRun = self.bidsArchive.getBidsRun(**entities)
+            self.numVolumes = self.bidsRun.numIncrementals()
         self.nextVol = 0
+        self.realigner = None
 
     def getNumVolumes(self) -> int:
         """Return the number of brain volumes in the run"""
         return self.numVolumes
 
-    def getIncremental(self, volIdx=-1, timeout=5, demoStep=0) -> BidsIncremental:
+    def setRealignment(self, referenceImg=None, **realignerArgs):
+        """
+        Realign the volumes of the stream to a reference image (or to the next volume
+        if None), see realignment.IncrementalRealigner for the args
+        """
+        from rtCommon.realignment import IncrementalRealigner
+        self.realigner = IncrementalRealigner(referenceImg, **realignerArgs)
+
+    def close(self):
+        """Stops the prefetching of a lazy stream"""
+        if self.lazyRun is not None:
+            self.lazyRun.close()
+
+    def getIncremental(self, volIdx=-1, timeout=5, demoStep=0) -> 'BidsIncremental':
         """
         Get a BIDS incremental for the indicated index in the current subject/run
         VolIdx acts similar to a file_seek pointer. If a volIdx >= 0 is supplied
@@ -323,8 +505,113 @@ class BidsStream:
             pass
 
         if self.nextVol < self.numVolumes:
-            incremental = self.bidsRun.getIncremental(self.nextVol)
+            if self.lazyRun is not None:
+                incremental = self.lazyRun.getIncremental(self.nextVol)
+            else:
+                incremental = self.bidsRun.getIncremental(self.nextVol)
+            if self.realigner is not None:
+                incremental = self.realigner.realign(incremental)
             self.nextVol += 1
             return incremental
         else:
             return None
+
+
+class LazyBidsRun:
+    """
+    The volumes of a run in a BIDS archive, read from the run's image file one at a
+    time as they are requested. The image is opened without reading its data, so the
+    file is memory-mapped for .nii files, and read with indexed_gzip (when installed)
+    for .nii.gz files, which allows seeking to a volume without decompressing the
+    whole file. The next volumes can be read ahead in a background thread.
+    """
+    def __init__(self, bidsArchive, prefetch=0, **entities):
+        """
+        Args:
+            bidsArchive: The BidsArchive with the run
+            prefetch: Number of volumes after the last requested one to read ahead
+            entities: BIDS entities that define the run in the archive
+        """
+        import nibabel as nib
+        imagePath = bidsArchive.getRunImagePath(**entities)
+        # keep_file_open uses indexed_gzip for gzipped images
+        self.image = nib.load(imagePath, keep_file_open=imagePath.endswith('.gz'))
+        self.metadata = bidsArchive.getSidecarMetadata(imagePath)
+        self.metadata.pop('extension')  # only used in PyBids
+        shape = self.image.header.get_data_shape()
+        self.numVolumes = shape[3] if len(shape) > 3 else 1
+        self.prefetch = prefetch
+        # volIdx -> volume data read ahead of the request
+        self.prefetched = {}
+        self.nextVol = 0
+        self.stopped = False
+        self.prefetchCondition = threading.Condition()
+        self.prefetchThread = None
+        if prefetch > 0:
+            self.prefetchThread = threading.Thread(name='prefetchThread',
+                                                   target=self._prefetchLoop)
+            self.prefetchThread.setDaemon(True)
+            self.prefetchThread.start()
+
+    def numIncrementals(self) -> int:
+        """Return the number of volumes in the run"""
+        return self.numVolumes
+
+    def _readVolume(self, volIdx):
+        if len(self.image.header.get_data_shape()) < 4:
+            import numpy as np
+            return np.asanyarray(self.image.dataobj)
+        # slicing the image's array proxy only reads that volume from the file
+        return self.image.dataobj[..., volIdx]
+
+    def _nextToPrefetch(self):
+        for volIdx in range(self.nextVol, min(self.nextVol + self.prefetch, self.numVolumes)):
+            if volIdx not in self.prefetched:
+                return volIdx
+        return None
+
+    def _prefetchLoop(self):
+        while True:
+            with self.prefetchCondition:
+                volIdx = self._nextToPrefetch()
+                while volIdx is None and not self.stopped:
+                    self.prefetchCondition.wait()
+                    volIdx = self._nextToPrefetch()
+                if self.stopped:
+                    return
+            volume = self._readVolume(volIdx)
+            with self.prefetchCondition:
+                if self.nextVol <= volIdx < self.nextVol + self.prefetch:
+                    self.prefetched[volIdx] = volume
+
+    def getIncremental(self, volIdx) -> 'BidsIncremental':
+        """
+        Returns the incremental of the volume at the provided index
+
+        Raises:
+            IndexError: If index is out of bounds for this run.
+        """
+        from rtCommon.bidsIncremental import BidsIncremental
+        if volIdx < 0 or volIdx >= self.numVolumes:
+            raise IndexError(f"Index {volIdx} out of bounds for run with "
+                             f"{self.numVolumes} incrementals")
+        with self.prefetchCondition:
+            volume = self.prefetched.pop(volIdx, None)
+            # read ahead from the following volume, dropping the volumes skipped
+            self.nextVol = volIdx + 1
+            for idx in [idx for idx in self.prefetched if idx < self.nextVol]:
+                del self.prefetched[idx]
+            self.prefetchCondition.notify()
+        if volume is None:
+            volume = self._readVolume(volIdx)
+        image = self.image.__class__(volume, self.image.affine, self.image.header)
+        return BidsIncremental(image, self.metadata)
+
+    def close(self):
+        """Stop the prefetch thread and release the prefetched volumes"""
+        with self.prefetchCondition:
+            self.stopped = True
+            self.prefetched = {}
+            self.prefetchCondition.notify()
+        if self.prefetchThread is not None:
+            self.prefetchThread.join(timeout=5)
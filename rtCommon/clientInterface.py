@@ -16,12 +16,8 @@ Client Service Interfaces provided (i.e. for the classification script client):
     subjectInterface - to send subject feedback and receive responses
     webInterface - to set browser messages, update plots, send/receive configs
 """
+import time
 import rpyc
-from rtCommon.dataInterface import DataInterface
-from rtCommon.subjectInterface import SubjectInterface
-from rtCommon.webDisplayInterface import WebDisplayInterface
-from rtCommon.bidsInterface import BidsInterface
-from rtCommon.exampleInterface import ExampleInterface
 from rtCommon.errors import RequestError
 
 
@@ -38,19 +34,9 @@ class ClientInterface:
         """
         self.rpcConn = None
         try:
-            safe_attrs = rpyc.core.protocol.DEFAULT_CONFIG.get('safe_attrs')
-            safe_attrs.add('__format__')
-            rpcConn = rpyc.connect('localhost', 12345,
-                                   config={
-                                            "allow_public_attrs": True,
-                                            "safe_attrs": safe_attrs,
-                                            "allow_pickle" : True,
-                                            "sync_request_timeout": rpyc_timeout,
-                                            # "allow_getattr": True,
-                                            # "allow_setattr": True,
-                                            # "allow_delattr": True,
-                                            # "allow_all_attrs": True,
-                                           })
+            rpcConn = popPrestartedConnection(rpyc_timeout)
+            if rpcConn is None:
+                rpcConn = connectProjectServer(rpyc_timeout)
             # Need to provide an override class of DataInstance to return data from getImage
             self.dataInterface = WrapRpycObject(rpcConn.root.DataInterface)
             self.subjInterface = WrapRpycObject(rpcConn.root.SubjectInterface)
@@ -67,6 +53,12 @@ class ClientInterface:
                 reply = input('Unable to connect to projectServer, continue using localfiles? ' + '(y/n): ')
             reply.lower().strip()
             if reply[0] == 'y':
+                # Local versions of the interfaces are only imported when needed
+                from rtCommon.dataInterface import DataInterface
+                from rtCommon.subjectInterface import SubjectInterface
+                from rtCommon.webDisplayInterface import WebDisplayInterface
+                from rtCommon.bidsInterface import BidsInterface
+                from rtCommon.exampleInterface import ExampleInterface
                 # These will be run in the same process as the experiment script
                 self.dataInterface = DataInterface(dataRemote=False, allowedDirs=['*'], allowedFileTypes=['*'])
                 self.subjInterface = SubjectInterface(subjectRemote=False)
@@ -105,6 +97,56 @@ class ClientInterface:
         return True
 
 
+# An rpyc connection opened ahead of time, i.e. by a ScriptPool worker
+#   while it waits for a script to run (see rtCommon/scriptPool.py)
+prestartedConn = None
+
+
+def connectProjectServer(rpyc_timeout=120):
+    """Open an rpyc connection to the projectServer running on the localhost."""
+    safe_attrs = rpyc.core.protocol.DEFAULT_CONFIG.get('safe_attrs')
+    safe_attrs.add('__format__')
+    rpcConn = rpyc.connect('localhost', 12345,
+                           config={
+                                    "allow_public_attrs": True,
+                                    "safe_attrs": safe_attrs,
+                                    "allow_pickle" : True,
+                                    "sync_request_timeout": rpyc_timeout,
+                                    # "allow_getattr": True,
+                                    # "allow_setattr": True,
+                                    # "allow_delattr": True,
+                                    # "allow_all_attrs": True,
+                                   })
+    return rpcConn
+
+
+def prestartConnection(retries=20, retryInterval=0.5):
+    """
+    Open a connection to the projectServer before a ClientInterface is created.
+    The next ClientInterface instantiated will use this connection instead of
+    opening a new one. Retries while the projectServer RPC port isn't up yet.
+    """
+    global prestartedConn
+    for _ in range(retries):
+        try:
+            prestartedConn = connectProjectServer()
+            return True
+        except ConnectionRefusedError:
+            time.sleep(retryInterval)
+    return False
+
+
+def popPrestartedConnection(rpyc_timeout=120):
+    """Returns the prestarted connection if it is still open, otherwise None."""
+    global prestartedConn
+    rpcConn = prestartedConn
+    prestartedConn = None
+    if rpcConn is None or rpcConn.closed:
+        return None
+    rpcConn._config['sync_request_timeout'] = rpyc_timeout
+    return rpcConn
+
+
 class WrapRpycObject(object):
     """
     Rpyc commands return a rpyc.core.netref object to as a reference to the remote object.
@@ -0,0 +1,168 @@
+"""
+A pool of workers for converting Dicom images to Nifti with dcm2niix.
+
+Most EPI volumes are converted in memory (see imageHandling.convertDicomImgToNifti),
+this pool is for the images that still need dcm2niix. dcm2niix converts one image per
+process, so each conversion still runs a dcm2niix process, but:
+    - the dcm2niix path is looked up once,
+    - the temporary Dicom and Nifti files are written to a tmpfs scratch directory
+      (/dev/shm when available) so they never touch the disk,
+    - several conversions run at the same time, one per worker thread, which matters
+      when catching up on a backlog of volumes or when several streams are active.
+
+Use the shared pool with getConversionPool(), or create a DicomConversionPool for a
+batch conversion, i.e. pool.convertFiles(dicomFilenames). A backlog of in-memory Dicom
+images is converted with imageHandling.convertDicomImgsToNifti, which DicomToBidsStream
+uses to catch up on the volumes already written when the client has fallen behind.
+"""
+import os
+import uuid
+import atexit
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, TYPE_CHECKING
+from rtCommon.errors import StateError
+if TYPE_CHECKING:
+    import concurrent.futures
+    import nibabel as nib
+
+# cached path of the dcm2niix executable
+dcm2niixPath = None
+
+
+def getDcm2niixPath() -> str:
+    """Returns the path of the dcm2niix executable, looked up on the first call"""
+    global dcm2niixPath
+    if dcm2niixPath is None:
+        path = shutil.which('dcm2niix')
+        if path is None:
+            raise StateError("dcm2niix not found in PATH")
+        dcm2niixPath = path
+    return dcm2niixPath
+
+
+def getDefaultScratchDir() -> str:
+    """Returns a tmpfs directory for temporary files if there is one, otherwise the tmp dir"""
+    shmDir = '/dev/shm'
+    if os.path.isdir(shmDir) and os.access(shmDir, os.W_OK):
+        return shmDir
+    return tempfile.gettempdir()
+
+
+def runDcm2niix(dicomFilename: str, niftiFilename: str) -> None:
+    """Converts dicomFilename to niftiFilename (which must end in .nii) with dcm2niix"""
+    outPath, outName = os.path.split(niftiFilename)
+    if outName.endswith('.nii'):
+        outName = os.path.splitext(outName)[0]  # remove extention
+    cmd = [getDcm2niixPath(), '-s', 'y', '-b', 'n', '-o', outPath, '-f', outName,
+           dicomFilename]
+    proc = subprocess.run(cmd, shell=False, stdout=subprocess.DEVNULL)
+    if proc.returncode != 0:
+        raise StateError("Failed to convert Dicom to Nifti. Dicom may be corrupted")
+
+
+class DicomConversionPool:
+    """Runs dcm2niix conversions on a set of worker threads with tmpfs scratch files."""
+    def __init__(self, numWorkers: int=None, scratchDir: str=None):
+        """
+        Args:
+            numWorkers: Number of conversions to run at the same time,
+                defaults to the number of CPUs
+            scratchDir: Directory for the temporary files, defaults to /dev/shm
+                if available
+        """
+        if numWorkers is None:
+            numWorkers = os.cpu_count() or 1
+        if scratchDir is None:
+            scratchDir = getDefaultScratchDir()
+        self.numWorkers = numWorkers
+        # each pool gets its own scratch directory, removed at shutdown
+        self.scratchDir = tempfile.mkdtemp(prefix='rtcloud_dcm2niix_', dir=scratchDir)
+        self.executor = ThreadPoolExecutor(max_workers=numWorkers,
+                                           thread_name_prefix='dcm2niixWorker')
+
+    def __del__(self):
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        """Wait for queued conversions to finish and remove the scratch directory."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        if self.scratchDir is not None:
+            shutil.rmtree(self.scratchDir, ignore_errors=True)
+            self.scratchDir = None
+
+    def submit(self, dicomImg) -> 'concurrent.futures.Future':
+        """
+        Queue an in-memory Dicom image for conversion.
+
+        Returns:
+            A Future whose result() is the in-memory nibabel Nifti1Image
+        """
+        if self.executor is None:
+            raise StateError("DicomConversionPool: pool has been shut down")
+        return self.executor.submit(self._convertImg, dicomImg)
+
+    def submitFile(self, dicomFilename: str) -> 'concurrent.futures.Future':
+        """Queue a Dicom file for conversion, returns a Future of the Nifti1Image"""
+        if self.executor is None:
+            raise StateError("DicomConversionPool: pool has been shut down")
+        return self.executor.submit(self._convertFile, dicomFilename)
+
+    def convert(self, dicomImg) -> 'nib.Nifti1Image':
+        """Convert an in-memory Dicom image, returns the Nifti1Image"""
+        return self.submit(dicomImg).result()
+
+    def convertFiles(self, dicomFilenames: List[str]) -> List['nib.Nifti1Image']:
+        """Convert a list of Dicom files in parallel, returns the Nifti images in the same order"""
+        futures = [self.submitFile(filename) for filename in dicomFilenames]
+        return [future.result() for future in futures]
+
+    def _newScratchName(self) -> str:
+        return os.path.join(self.scratchDir, 'tmp_nifti_' + uuid.uuid4().hex)
+
+    def _convertImg(self, dicomImg):
+        from rtCommon.imageHandling import writeDicomFile
+        baseName = self._newScratchName()
+        dicomFilename = baseName + '.dcm'
+        writeDicomFile(dicomImg, dicomFilename)
+        try:
+            return self._convertToMem(dicomFilename, baseName + '.nii')
+        finally:
+            os.remove(dicomFilename)
+
+    def _convertFile(self, dicomFilename: str):
+        return self._convertToMem(dicomFilename, self._newScratchName() + '.nii')
+
+    def _convertToMem(self, dicomFilename: str, niftiFilename: str):
+        import nibabel as nib
+        runDcm2niix(dicomFilename, niftiFilename)
+        try:
+            # read the file once into memory, the image isn't backed by the (removed) file
+            with open(niftiFilename, 'rb') as fp:
+                return nib.Nifti1Image.from_bytes(fp.read())
+        finally:
+            os.remove(niftiFilename)
+
+
+conversionPool = None
+conversionPoolLock = threading.Lock()
+
+
+def getConversionPool() -> DicomConversionPool:
+    """Returns the shared conversion pool, created on first use"""
+    global conversionPool
+    with conversionPoolLock:
+        if conversionPool is None:
+            conversionPool = DicomConversionPool()
+            # remove the tmpfs scratch directory when the process exits, __del__ isn't
+            #   guaranteed to run for module globals at interpreter shutdown
+            atexit.register(conversionPool.shutdown)
+            logging.debug(f"DicomConversionPool: {conversionPool.numWorkers} workers, "
+                          f"scratch dir {conversionPool.scratchDir}")
+    return conversionPool
@@ -16,14 +16,18 @@ import glob
 import threading
 import logging
 from pathlib import Path
-from typing import List, Union
-import pydicom
+from typing import List, Union, TYPE_CHECKING
 import rtCommon.utils as utils
 from rtCommon.remoteable import RemoteableExtensible
 from rtCommon.fileWatcher import FileWatcher
+from rtCommon.readAheadCache import ReadAheadCache
 from rtCommon.errors import StateError, RequestError, InvocationError, ValidationError
+from rtCommon.errors import NotImplementedError
 from rtCommon.structDict import StructDict
-from rtCommon.imageHandling import readDicomFromBuffer, anonymizeDicom
+if TYPE_CHECKING:
+    import pydicom
+# Note: pydicom and rtCommon.imageHandling (nibabel etc.) are imported on first use
+#   so that services which only need file access start quickly
 
 
 class DataInterface(RemoteableExtensible):
@@ -39,7 +43,8 @@ class DataInterface(RemoteableExtensible):
     parent class is inoperable (i.e. does nothing).
     """
     def __init__(self, dataRemote :bool=False, allowedDirs :List[str]=None, 
-                 allowedFileTypes :List[str]=None, scannerClockSkew :float=0):
+                 allowedFileTypes :List[str]=None, scannerClockSkew :float=0,
+                 readCacheSize :int=256*2**20, usePollingWatcher :bool=False):
         """
         Args:
             dataRemote (bool): whether data will be served from the local instance or requests forwarded
@@ -51,14 +56,23 @@ class DataInterface(RemoteableExtensible):
                 one on the list.
             scannerClockSkew (float): number of seconds the scanner's clock is ahead of the
                 data server clock
+            readCacheSize (int): max bytes of file data kept in the read-ahead cache, files
+                are read into the cache as soon as they arrive in a watched directory.
+                Zero disables the cache.
+            usePollingWatcher (bool): poll the watched directories instead of using file
+                system events, i.e. when the scanner directory is a network (NFS/SMB) mount.
         """
         super().__init__(isRemote=dataRemote)
+        # getImageData fetches the Dicom bytes (remotely if dataRemote) and parses them locally
+        self.addLocalAttributes('getImageData')
         if dataRemote is True:
             return
         self.initWatchSet = False
         self.watchDir = None
+        # map from streamId to the stream's StructDict (directory, file pattern and cursor)
+        self.streams = {}
         self.currentStreamId = 0
-        self.streamInfo = None
+        self.streamLock = threading.Lock()
         self.allowedDirs = allowedDirs
         self.scannerClockSkew = scannerClockSkew
         # Remove trailing slash from dir names
@@ -73,20 +87,41 @@ class DataInterface(RemoteableExtensible):
                         allowedFileTypes[i] = '.' + allowedFileTypes[i]
         self.fileWatchLock = threading.Lock()
         # instantiate local FileWatcher
-        self.fileWatcher = FileWatcher()
+        self.fileWatcher = FileWatcher(usePolling=usePollingWatcher)
+        self.readCache = ReadAheadCache(maxBytes=readCacheSize)
+        self.fileWatcher.addArrivalCallback(self.readCache.prefetch)
 
     def __del__(self):
         if hasattr(self, "fileWatcher"):
             if self.fileWatcher is not None:
                 self.fileWatcher.__del__()
                 self.fileWatcher = None
+        if hasattr(self, "readCache"):
+            self.readCache.shutdown()
+
+    def close(self) -> None:
+        """
+        Release the interface's resources: close the open streams, stop the FileWatcher
+        and the read-ahead cache. Called when the client session using it ends.
+        """
+        with self.streamLock:
+            streamIds = list(self.streams.keys())
+        for streamId in streamIds:
+            self.closeStream(streamId)
+        with self.fileWatchLock:
+            if self.fileWatcher is not None:
+                self.fileWatcher.__del__()
+                self.fileWatcher = None
+        self.readCache.shutdown()
 
     def initScannerStream(self, imgDir: str, filePattern: str, minFileSize: int,
                           anonymize: bool=True, demoStep: int=0) -> int:
         """
         Initialize a data stream context with image directory and filepattern.
         Once the stream is initialized call getImageData() to retrieve image data.
-        NOTE: currently only one stream at a time is supported.
+        Multiple streams can be open at the same time, each has its own directory
+        watch (served by the one FileWatcher) and image index. Call closeStream()
+        when done with a stream.
 
         Args:
             imgDir: the directory where the images are or will be written from the MRI scanner.
@@ -105,23 +140,77 @@ class DataInterface(RemoteableExtensible):
         # check that filePattern has {TR} in it
         if not re.match(r'.*{TR.*', filePattern):
             raise InvocationError(r"initScannerStream filePattern must have a {TR} pattern")
-        self.currentStreamId = self.currentStreamId + 1
-        self.streamInfo = StructDict({
-            'streamId': self.currentStreamId,
-            'type': 'scanner',
-            'imgDir': imgDir,
-            'filePattern': filePattern,
-            'minFileSize': minFileSize,
-            'anonymize': anonymize,
-            'demoStep': demoStep,
-            'imgIndex': 0,
-        })
         _, file_ext = os.path.splitext(filePattern)
-        self.initWatch(imgDir, '*' + file_ext, minFileSize, demoStep)
-        return self.currentStreamId
+        watchPattern = '*' + file_ext
+        with self.fileWatchLock:
+            if not self.initWatchSet:
+                # No initWatch() yet, make the stream directory the primary watch so
+                #   watchFile() works as before. The stream does its own demoStep timing.
+                self.fileWatcher.initFileNotifier(imgDir, watchPattern, minFileSize)
+                self.watchDir = imgDir
+                self.initWatchSet = True
+        self.fileWatcher.addFileNotifier(imgDir, watchPattern, minFileSize)
+        with self.streamLock:
+            self.currentStreamId = self.currentStreamId + 1
+            streamId = self.currentStreamId
+            self.streams[streamId] = StructDict({
+                'streamId': streamId,
+                'type': 'scanner',
+                'imgDir': imgDir,
+                'filePattern': filePattern,
+                'watchPattern': watchPattern,
+                'minFileSize': minFileSize,
+                'anonymize': anonymize,
+                'demoStep': demoStep,
+                'prevEventTime': 0,
+                'imgIndex': 0,
+            })
+        return streamId
+
+    def closeStream(self, streamId: int) -> None:
+        """Close a stream opened with initScannerStream and remove its directory watch."""
+        with self.streamLock:
+            streamInfo = self.streams.pop(streamId, None)
+        if streamInfo is not None and self.fileWatcher is not None:
+            self.fileWatcher.removeFileNotifier(streamInfo.imgDir, streamInfo.watchPattern)
+
+    def initSeriesWatch(self, topDir: str, filePattern: str='*.dcm', minFileSize: int=0) -> None:
+        """
+        Watch topDir and all of its subdirectories, including new subdirectories as they
+        are created. Use this when the scanner writes each series into a new directory,
+        then call waitForNewSeries() to get the directory of each new series and open a
+        stream on it with initScannerStream().
 
+        Args:
+            topDir: The directory under which the scanner creates the series directories
+            filePattern: Regex style filename pattern of the image files (i.e. \*.dcm)
+            minFileSize: Minimum size of the file to return (continue waiting if below this size)
+        """
+        self._checkAllowedDirs(topDir)
+        self._checkAllowedFileTypes(filePattern)
+        self.fileWatcher.addFileNotifier(topDir, filePattern, minFileSize, recursive=True)
+
+    def waitForNewSeries(self, topDir: str, timeout: int=5) -> str:
+        """
+        Wait for a new series directory to be created under topDir, which must first be
+        watched with initSeriesWatch(). Directories are returned in the order created.
 
-    def getImageData(self, streamId: int, imageIndex: int=None, timeout: int=5) -> pydicom.dataset.FileDataset:
+        Args:
+            topDir: The directory given to initSeriesWatch()
+            timeout: Max number of seconds to wait for a new directory
+        Returns:
+            The path of the new series directory
+        """
+        if timeout <= 0:
+            # Don't allow infinite timeout
+            raise RequestError("waitForNewSeries: timeout parameter must be > 0 secs")
+        self._checkAllowedDirs(topDir)
+        newDir = self.fileWatcher.waitForNewDir(topDir, timeout=timeout)
+        if newDir is None:
+            raise TimeoutError("waitForNewSeries: Timeout {}s: {}".format(timeout, topDir))
+        return newDir
+
+    def getImageData(self, streamId: int, imageIndex: int=None, timeout: int=5) -> 'pydicom.dataset.FileDataset':
         """
         Get data from a stream initialized with initScannerStream
 
@@ -135,12 +224,30 @@ class DataInterface(RemoteableExtensible):
             The bytes array representing the image data
             returns pydicom.dataset.FileDataset
         """
-        if self.currentStreamId == 0 or self.currentStreamId != streamId or self.streamInfo.streamId != streamId:
-            raise ValidationError(f"StreamID mismatch {self.currentStreamId} : {streamId}")
+        # This runs locally also for a remote DataInterface, the Dicom bytes are
+        #   transferred (see getImageDataBytes) and parsed here
+        from rtCommon.imageHandling import readDicomFromBuffer
+        data = self.getImageDataBytes(streamId, imageIndex, timeout)
+        return readDicomFromBuffer(data)
+
+    def getImageDataBytes(self, streamId: int, imageIndex: int=None, timeout: int=5) -> bytes:
+        """
+        Get the Dicom file data from a stream initialized with initScannerStream,
+        anonymized (if the stream was opened with anonymize=True) without parsing
+        the Dicom. Same args as getImageData.
+
+        Returns:
+            The bytes of the Dicom file
+        """
+        from rtCommon.imageHandling import (anonymizeDicomBytes, checkDicomBytesComplete,
+                                            readDicomFromBuffer, anonymizeDicom, writeDicomToBuffer)
+        streamInfo = self.streams.get(streamId)
+        if streamInfo is None:
+            raise ValidationError(f"StreamID {streamId} not found, open streams {list(self.streams.keys())}")
 
         if imageIndex is None:
-            imageIndex = self.streamInfo.imgIndex
-        filename = self.streamInfo.filePattern.format(TR=imageIndex)
+            imageIndex = streamInfo.imgIndex
+        filename = streamInfo.filePattern.format(TR=imageIndex)
 
         if timeout <= 0:
             # Don't allow infinite timeout
@@ -153,21 +260,29 @@ class DataInterface(RemoteableExtensible):
             if time_remaining < loop_timeout:
                 loop_timeout = time_remaining
             try:
-                data = self.watchFile(filename, loop_timeout)
-                dicomImg = readDicomFromBuffer(data)
-                # Convert pixel data to a numpy.ndarray internally.
-                # Note: the conversion cause error in pickle encoding
-                # dicomImg.convert_pixel_data()
-                self.streamInfo.imgIndex = imageIndex + 1
-                if self.streamInfo.anonymize is True:
-                    dicomImg = anonymizeDicom(dicomImg)
-                return dicomImg
+                data = self._watchStreamFile(streamInfo, filename, loop_timeout)
+                # The Dicom is checked for truncation (and anonymized) by scanning its
+                #   raw bytes, with a full parse only for encodings the scan doesn't handle.
+                try:
+                    if streamInfo.anonymize is True:
+                        data = anonymizeDicomBytes(data)
+                    else:
+                        checkDicomBytesComplete(data)
+                except NotImplementedError:
+                    dicomImg = readDicomFromBuffer(data)
+                    if streamInfo.anonymize is True:
+                        data = writeDicomToBuffer(anonymizeDicom(dicomImg))
+                streamInfo.imgIndex = imageIndex + 1
+                if streamInfo.demoStep is not None and streamInfo.demoStep > 0:
+                    streamInfo.prevEventTime = utils.demoDelay(streamInfo.demoStep,
+                                                               streamInfo.prevEventTime)
+                return data
             except TimeoutError as err:
                 logging.info(f"Waiting for {filename} ...")
                 pass
             except ValidationError as err:
-                # readDicomFromBuffer will raise ValidationError if Dicom seems
-                # corrupted. Retry for up to timeout.
+                # The Dicom scan or readDicomFromBuffer will raise ValidationError if
+                # the Dicom seems corrupted. Retry for up to timeout.
                 logging.info(f"Dicom not completely written, retry ...")
                 time.sleep(0.05)
                 pass
@@ -175,7 +290,58 @@ class DataInterface(RemoteableExtensible):
                 errMsg = f"getImageData Error, filename {filename} err: {err}"
                 logging.error(errMsg)
                 raise RequestError(errMsg)
-        raise RequestError(f"getImageData: Dicom file {self.streamInfo.imgDir}/{filename} not found or corrupted")
+        raise RequestError(f"getImageData: Dicom file {streamInfo.imgDir}/{filename} not found or corrupted")
+
+    def setStreamMasker(self, streamId: int, maskerSpec: dict, reduce: str='mean') -> None:
+        """
+        Set the ROI masks of a stream, so getImageRois() can extract the ROI values on
+        the data service side and only those values are returned.
+
+        Args:
+            streamId: Id of a stream opened with initScannerStream
+            maskerSpec: The masks as returned by Masker.getSpec(), in the space of the
+                stream's volumes converted to Nifti
+            reduce: How to reduce each ROI's voxels, 'mean', 'sum', 'max', 'min' or
+                None to return the voxel values
+        """
+        from rtCommon.masker import Masker, roiReductions
+        streamInfo = self.streams.get(streamId)
+        if streamInfo is None:
+            raise ValidationError(f"StreamID {streamId} not found, open streams {list(self.streams.keys())}")
+        if reduce not in roiReductions:
+            raise InvocationError(f"setStreamMasker: reduce must be one of {roiReductions}")
+        streamInfo.masker = Masker.fromSpec(maskerSpec)
+        streamInfo.maskerReduce = reduce
+
+    def getImageRois(self, streamId: int, imageIndex: int=None, timeout: int=5) -> dict:
+        """
+        Get the ROI values of the next (or imageIndex) image of a stream with masks
+        set by setStreamMasker(). The image is converted to Nifti and the ROIs
+        extracted here, so only the ROI values are returned. Same args as getImageData.
+
+        Returns:
+            A dict of ROI name to the ROI's value (or list of voxel values)
+        """
+        import numpy as np
+        from rtCommon.imageHandling import readDicomFromBuffer, convertDicomImgToNifti
+        streamInfo = self.streams.get(streamId)
+        if streamInfo is None:
+            raise ValidationError(f"StreamID {streamId} not found, open streams {list(self.streams.keys())}")
+        masker = streamInfo.get('masker')
+        if masker is None:
+            raise StateError(f"getImageRois: no masker set for stream {streamId}, call setStreamMasker()")
+        dicomImg = readDicomFromBuffer(self.getImageDataBytes(streamId, imageIndex, timeout))
+        niftiImg = convertDicomImgToNifti(dicomImg)
+        roiValues = masker.extractDict(niftiImg, reduce=streamInfo.maskerReduce)
+        return {name: np.asarray(value).tolist() for name, value in roiValues.items()}
+
+    def _watchStreamFile(self, streamInfo: StructDict, filename: str, timeout: int) -> bytes:
+        """Waits for a file in a stream's directory and returns the file data."""
+        fullFilename = os.path.join(streamInfo.imgDir, filename)
+        foundFilename = self.fileWatcher.waitForFile(fullFilename, timeout=timeout, timeCheckIncrement=0.25)
+        if foundFilename is None:
+            raise TimeoutError("WatchFile: Timeout {}s: {}".format(timeout, fullFilename))
+        return self.readCache.readFile(foundFilename)
 
     def getFile(self, filename: str) -> bytes:
         """Returns a file's data immediately or fails if the file doesn't exist."""
@@ -186,8 +352,7 @@ class DataInterface(RemoteableExtensible):
         data = None
         if not os.path.exists(filename):
             raise FileNotFoundError(f'File not found {filename}')
-        with open(filename, 'rb') as fp:
-            data = fp.read()
+        data = self.readCache.readFile(filename)
         # Consider - detect string encoding - but this could be computationally expenise on large data
         # encoding = chardet.detect(data)['encoding']
         # if encoding == 'ascii':
@@ -210,8 +375,7 @@ class DataInterface(RemoteableExtensible):
         elif not os.path.exists(filename):
             raise FileNotFoundError('File missing after match {}'.format(filePattern))
         else:
-            with open(filename, 'rb') as fp:
-                data = fp.read()
+            data = self.readCache.readFile(filename)
         return data
 
     def initWatch(self, dir: str, filePattern: str, minFileSize: int, demoStep: int=0) -> None:
@@ -230,11 +394,7 @@ class DataInterface(RemoteableExtensible):
         self._checkAllowedDirs(dir)
         self._checkAllowedFileTypes(filePattern)
         self.fileWatchLock.acquire()
-        if self.initWatchSet is True:
-            # Stop the previous watch to start a new one
-            assert self.fileWatcher is not None
-            self.fileWatcher.__del__()
-            self.fileWatcher = FileWatcher()
+        # Note: this replaces the previous initWatch directory, stream watches are not affected
         self.initWatchSet = False
         try:
             self.fileWatcher.initFileNotifier(dir, filePattern, minFileSize, demoStep)
@@ -269,16 +429,18 @@ class DataInterface(RemoteableExtensible):
             self._checkAllowedDirs(fileDir)
         self._checkAllowedFileTypes(fileCheck)
 
+        # Only hold the lock to get the current watcher, the watcher supports
+        #   multiple threads waiting on different files at the same time
         self.fileWatchLock.acquire()
         try:
-            foundFilename = self.fileWatcher.waitForFile(filename, timeout=timeout, timeCheckIncrement=0.25)
+            fileWatcher = self.fileWatcher
         finally:
             self.fileWatchLock.release()
+        foundFilename = fileWatcher.waitForFile(filename, timeout=timeout, timeCheckIncrement=0.25)
         if foundFilename is None:
             raise TimeoutError("WatchFile: Timeout {}s: {}".format(timeout, filename))
         else:
-            with open(foundFilename, 'rb') as fp:
-                data = fp.read()
+            data = self.readCache.readFile(foundFilename)
         return data
 
     def putFile(self, filename: str, data: Union[str, bytes], compress: bool=False) -> None:
@@ -305,6 +467,7 @@ class DataInterface(RemoteableExtensible):
         outputDir = os.path.dirname(filename)
         if not os.path.exists(outputDir):
             os.makedirs(outputDir)
+        self.readCache.invalidate(filename)
         with open(filename, 'wb+') as binFile:
             binFile.write(data)
         return
@@ -339,6 +502,13 @@ class DataInterface(RemoteableExtensible):
             dirList.append(item)
         return dirList
 
+    def getReadCacheStats(self) -> dict:
+        """
+        Returns the read-ahead cache statistics: hits, misses, hitRate, evictions,
+        prefetches (files read when they arrived), numEntries, numBytes and maxBytes.
+        """
+        return self.readCache.getStats()
+
     def getAllowedFileTypes(self) -> List[str]:
         """Returns the list of file extensions which are allowed for read and write"""
         return self.allowedFileTypes
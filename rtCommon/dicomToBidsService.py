@@ -8,19 +8,18 @@ A very basic DICOM to BIDS-I converter.
 
 import pydicom
 
-from rtCommon.bidsCommon import getDicomMetadata
+from rtCommon.bidsCommon import getDicomMetadata, DicomMetadataCache
 from rtCommon.bidsIncremental import BidsIncremental
 from rtCommon.imageHandling import convertDicomImgToNifti
 
 
 def dicomToBidsInc(dicomImg: pydicom.dataset.Dataset,
-                   extraMetadata: dict = {}) -> BidsIncremental:
-    # TODO(spolcyn): Do this all in memory -- dicom2nifti is promising
-    # Currently, there are 4 disk operations:
-    # 1) Read DICOM (by dcm2niix)
-    # 2) Write NIfTI
-    # 3) Read NIfTI
-    # 4) Read DICOM (for metadata)
+                   extraMetadata: dict = {},
+                   metadataCache: DicomMetadataCache = None) -> BidsIncremental:
+    # Pass the same metadataCache for each volume of a series to only read the
+    # per-volume header fields after the first volumes
+    # Mosaic and single-frame DICOMs are converted in memory, other DICOMs
+    # fall back to dcm2niix (with a temporary DICOM and NIfTI file on disk)
 
     # NOTE: This is not the final version of this method.
     # The conversion from DICOM to BIDS-I and gathering all required metadata
@@ -28,7 +27,10 @@ def dicomToBidsInc(dicomImg: pydicom.dataset.Dataset,
     # for BIDS in it by default. Thus, another component should handle the logic
     # and error handling surrounding this.
     niftiImage = convertDicomImgToNifti(dicomImg)
-    metadata = getDicomMetadata(dicomImg)
+    if metadataCache is not None:
+        metadata = metadataCache.getMetadata(dicomImg)
+    else:
+        metadata = getDicomMetadata(dicomImg)
     metadata.update(extraMetadata)
 
     return BidsIncremental(image=niftiImage, imageMetadata=metadata)
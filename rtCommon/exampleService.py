@@ -35,6 +35,8 @@ class ExampleService:
         self.exampleInterface = ExampleInterface(dataRemote=False)
         self.wsRemoteService = WsRemoteService(args, webSocketChannelName)
         self.wsRemoteService.addHandlerClass(ExampleInterface, self.exampleInterface)
+        self.wsRemoteService.addSessionHandlerClass(ExampleInterface,
+                                                    lambda: ExampleInterface(dataRemote=False))
 
     def runDetached(self):
         """Starts the receiver in its own thread."""
@@ -2,8 +2,20 @@
 FileWatcher implements a class that watches for files to be created in a directory and then
 returns the notification that the files is now available.
 
-The FileWatcher class is a virtual class of sorts with two underlying implementations, one
-for Mac and Windows (WatchdogFileWatcher) and one for Linux (InotifyFileWatcher).
+The FileWatcher class is a virtual class of sorts with three underlying implementations, one
+for Mac and Windows (WatchdogFileWatcher), one for Linux (InotifyFileWatcher) and one which
+polls the directories (PollingFileWatcher). The polling version is used when inotify isn't
+available or with FileWatcher(usePolling=True), i.e. for network mounted directories.
+
+File events are delivered by the notification thread to a FileWaiterRegistry, which wakes
+only the thread(s) waiting for that file and remembers recently arrived files. This allows
+multiple threads to wait on different files at the same time.
+
+One FileWatcher (and one notification thread) can watch several directories. The directory
+given to initFileNotifier() is the primary watch, used for filenames given without a path.
+Additional directories are watched with addFileNotifier(), for example one per scanner stream.
+A recursive watch also watches the subdirectories of a directory as they are created, and
+reports them with waitForNewDir(), for scanners that write each series to a new directory.
 """
 import os
 import sys
@@ -13,15 +25,27 @@ import logging
 import threading
 from typing import Optional
 from queue import Queue, Empty
-from watchdog.events import PatternMatchingEventHandler  # type: ignore
+from collections import OrderedDict, deque
+from rtCommon.structDict import StructDict
 from rtCommon.utils import DebugLevels, demoDelay
 from rtCommon.errors import StateError
 
 
 class FileWatcher():
     """Virtual class to watch for the arrival of new files and notify."""
-    def __new__(cls):
+    def __new__(cls, usePolling: bool=False):
+        if usePolling is True:
+            # create polling version, i.e. for network mounted directories
+            newcls = PollingFileWatcher.__new__(PollingFileWatcher)
+            newcls.__init__()
+            return newcls
         if sys.platform in ("linux", "linux2"):
+            if not inotifyAvailable():
+                # e.g., Mac M1 testing with Docker fails with inotify
+                print("Warning: Inotify not available, falling back to polling")
+                newcls = PollingFileWatcher.__new__(PollingFileWatcher)
+                newcls.__init__()
+                return newcls
             # create linux version
             newcls = InotifyFileWatcher.__new__(InotifyFileWatcher)
             newcls.__init__()
@@ -46,43 +70,135 @@ class FileWatcher():
         logging.log(logging.ERROR, "FileWatcher is abstract class. initFileNotifier not implemented")
         return None
 
+    def addFileNotifier(self, dir, filePattern, minFileSize, recursive=False):
+        logging.log(logging.ERROR, "FileWatcher is abstract class. addFileNotifier not implemented")
+        return None
+
+    def waitForNewDir(self, dir, timeout=5):
+        logging.log(logging.ERROR, "FileWatcher is abstract class. waitForNewDir not implemented")
+        return None
+
+    def removeFileNotifier(self, dir, filePattern):
+        logging.log(logging.ERROR, "FileWatcher is abstract class. removeFileNotifier not implemented")
+        return None
+
     def waitForFile(self, filename, timeout=0, timeCheckIncrement=1):
         logging.log(logging.ERROR, "FileWatcher is abstract class. waitForFile not implemented")
         return ''
 
+    def addArrivalCallback(self, callback):
+        logging.log(logging.ERROR, "FileWatcher is abstract class. addArrivalCallback not implemented")
+        return None
 
-if sys.platform in ("darwin", "win32"):
-    from watchdog.observers import Observer  # type: ignore
 
+class FileWaiterRegistry:
+    """
+    Matches file arrival events to the threads waiting for those files. Files are keyed
+    by their full path (using the same directory string the watch was created with) so
+    that each event is handled with one dictionary lookup.
+    """
+    def __init__(self, maxRecentFiles: int=1000):
+        """
+        Args:
+            maxRecentFiles: Number of recently arrived files to remember, so that a file
+                that arrived before anyone waited on it is returned immediately.
+        """
+        self.lock = threading.Lock()
+        # map from filename to StructDict(event, numWaiters)
+        self.waiters = {}
+        # map from filename to the time the arrival event was received
+        self.recentFiles = OrderedDict()
+        self.maxRecentFiles = maxRecentFiles
+        # functions called with (filename, eventTime) for each arrival
+        self.arrivalCallbacks = []
+
+    def addArrivalCallback(self, callback) -> None:
+        """
+        Register a function called as callback(filename, eventTime) for each arrival.
+        It is called on the event thread so it should only queue work, not do it.
+        """
+        with self.lock:
+            self.arrivalCallbacks.append(callback)
+
+    def fileArrived(self, filename: str, eventTime: float) -> None:
+        """Record that filename arrived and wake any threads waiting for it."""
+        with self.lock:
+            self.recentFiles[filename] = eventTime
+            self.recentFiles.move_to_end(filename)
+            if len(self.recentFiles) > self.maxRecentFiles:
+                self.recentFiles.popitem(last=False)
+            waiter = self.waiters.get(filename)
+            if waiter is not None:
+                waiter.event.set()
+            callbacks = list(self.arrivalCallbacks)
+        for callback in callbacks:
+            callback(filename, eventTime)
+
+    def getArrivalTime(self, filename: str) -> Optional[float]:
+        """Returns the event time if filename arrived recently, otherwise None."""
+        with self.lock:
+            return self.recentFiles.get(filename)
+
+    def waitForArrival(self, filename: str, timeout: float, notBefore: float=0) -> Optional[float]:
+        """
+        Wait for an arrival event for filename.
+
+        Args:
+            filename: Full path of the file to wait for
+            timeout: Max number of seconds to wait
+            notBefore: Ignore arrivals recorded before this time (i.e. stale events
+                for a file that has since been removed)
+        Returns:
+            The time of the arrival event or None if the timeout expired
+        """
+        with self.lock:
+            eventTime = self.recentFiles.get(filename)
+            if eventTime is not None and eventTime >= notBefore:
+                return eventTime
+            waiter = self.waiters.get(filename)
+            if waiter is None:
+                waiter = StructDict({'event': threading.Event(), 'numWaiters': 0})
+                self.waiters[filename] = waiter
+            waiter.numWaiters += 1
+        waiter.event.wait(timeout)
+        with self.lock:
+            waiter.numWaiters -= 1
+            if waiter.numWaiters == 0:
+                self.waiters.pop(filename, None)
+            eventTime = self.recentFiles.get(filename)
+        if eventTime is not None and eventTime >= notBefore:
+            return eventTime
+        return None
 
-# Version of FileWatcher for Mac and Windows
-class WatchdogFileWatcher():
-    """Version of FileWatcher for Mac and Windows using Watchdog toolkit."""
+
+class BaseFileWatcher():
+    """
+    Watch table and filename handling shared by the FileWatcher implementations.
+    Each watched directory (keyed by its realpath) has a set of filePatterns with a
+    reference count, so several streams can share a directory and a pattern.
+    Subclasses implement _startWatch(), _updateWatch() and _stopWatch().
+    """
     def __init__(self):
-        self.observer = None
-        self.fileNotifyHandler = None
-        self.fileNotifyQ = Queue()  # type: None
-        self.filePattern = None
         self.watchDir = None
+        self.realWatchDir = None
+        self.filePattern = None
         self.minFileSize = 0
         self.demoStep = 0
         self.prevEventTime = 0
         self.foundWithFileEvent = False
         self.waitLoopCount = 0
-
-    def __del__(self):
-        if self.observer is not None:
-            try:
-                self.observer.stop()
-                self.observer.join()
-            except Exception as err:
-                # TODO - change back to log once can figure out what the observer.stop streamRef error is
-                print("FileWatcher: oberver.stop(): %s", str(err))
+        self.fileRegistry = FileWaiterRegistry()
+        # map from realpath of the directory to StructDict(dir, filePatterns, minFileSize)
+        self.watches = {}
+        # map from directory as given by the caller to its realpath
+        self.watchDirNames = {}
+        self.watchLock = threading.Lock()
 
     def initFileNotifier(self, dir: str, filePattern: str, minFileSize: int, demoStep: int=0) -> None:
         """
         Initialize the file watcher to watch in the specified directory for the specified
-        regex-based filepattern.
+        regex-based filepattern. This replaces the previous primary watch, other watches
+        added with addFileNotifier() are not affected.
 
         Args:
             dir (str): Directory to watch in
@@ -94,28 +210,276 @@ class WatchdogFileWatcher():
                 This is used when the image files are pre-existing but we want to simulate as if
                 the arrive from the scanner every few seconds (demoStep seconds).
         """
-        self.demoStep = demoStep
-        self.minFileSize = minFileSize
-        if self.observer is not None:
-            self.observer.stop()
-            self.observer.join()
-        self.observer = Observer()
+        if dir is None:
+            raise StateError('initFileNotifier: dir is None')
         if filePattern is None or filePattern == '':
             filePattern = '*'
+        if self.watchDir is not None:
+            self.removeFileNotifier(self.watchDir, self.filePattern)
+        self.addFileNotifier(dir, filePattern, minFileSize)
         self.filePattern = filePattern
+        self.demoStep = demoStep
+        self.minFileSize = minFileSize
         self.watchDir = dir
-        self.fileNotifyHandler = FileNotifyHandler(self.fileNotifyQ, [filePattern])
-        self.observer.schedule(self.fileNotifyHandler, os.path.realpath(dir), recursive=False)
-        self.observer.start()
+        self.realWatchDir = os.path.realpath(dir)
+
+    def addFileNotifier(self, dir: str, filePattern: str, minFileSize: int,
+                        recursive: bool=False) -> None:
+        """
+        Add a watch for files matching filePattern in directory dir, in addition to the
+        directories already being watched. Files in the directory are then waited for
+        by calling waitForFile() with the full path.
+
+        Args:
+            dir (str): Directory to watch in
+            filePattern (str): Regex-based filepattern to watch for
+            minFileSize (int): Minimum file size necessary to consider the file is wholely written.
+            recursive (bool): Also watch all subdirectories of dir, including new subdirectories
+                as they are created (i.e. a new directory per scanner series). Use
+                waitForNewDir() to be notified of new subdirectories.
+        """
+        if dir is None:
+            raise StateError('addFileNotifier: dir is None')
+        if not os.path.exists(dir):
+            raise NotADirectoryError("No such directory: %s" % (dir))
+        if filePattern is None or filePattern == '':
+            filePattern = '*'
+        realDir = os.path.realpath(dir)
+        with self.watchLock:
+            self.watchDirNames[os.path.normpath(dir)] = realDir
+            watch = self.watches.get(realDir)
+            if watch is None:
+                watch = StructDict({'dir': dir, 'filePatterns': {filePattern: 1},
+                                    'minFileSize': minFileSize, 'recursive': recursive,
+                                    'topDir': None, 'newDirQ': None})
+                if recursive:
+                    watch.newDirQ = Queue()
+                self.watches[realDir] = watch
+                self._startWatch(realDir, watch)
+            else:
+                if filePattern in watch.filePatterns:
+                    watch.filePatterns[filePattern] += 1
+                else:
+                    watch.filePatterns[filePattern] = 1
+                if recursive and not watch.recursive:
+                    watch.recursive = True
+                    watch.newDirQ = Queue()
+                self._updateWatch(realDir, watch)
+            if recursive:
+                # watch the existing subdirectories
+                for root, subDirs, _ in os.walk(realDir):
+                    for subDir in subDirs:
+                        self._addSubdirWatch(os.path.join(root, subDir), realDir)
+
+    def removeFileNotifier(self, dir: str, filePattern: str) -> None:
+        """Remove a watch added with addFileNotifier()"""
+        if filePattern is None or filePattern == '':
+            filePattern = '*'
+        realDir = os.path.realpath(dir)
+        with self.watchLock:
+            watch = self.watches.get(realDir)
+            if watch is None or filePattern not in watch.filePatterns:
+                return
+            watch.filePatterns[filePattern] -= 1
+            if watch.filePatterns[filePattern] > 0:
+                return
+            del watch.filePatterns[filePattern]
+            if len(watch.filePatterns) > 0:
+                self._updateWatch(realDir, watch)
+                return
+            self._removeWatch(realDir)
+            if watch.recursive:
+                # release the subdirectory watches added for this recursive watch
+                for subRealDir, subWatch in list(self.watches.items()):
+                    if subWatch.topDir != realDir:
+                        continue
+                    for pattern in subWatch.inheritedPatterns:
+                        subWatch.filePatterns[pattern] -= 1
+                        if subWatch.filePatterns[pattern] == 0:
+                            del subWatch.filePatterns[pattern]
+                    if len(subWatch.filePatterns) == 0:
+                        self._removeWatch(subRealDir)
+
+    def waitForNewDir(self, dir: str, timeout: float=5) -> Optional[str]:
+        """
+        Wait for a new subdirectory (i.e. a new scanner series) to be created anywhere
+        below dir, which must have been added with addFileNotifier(recursive=True).
+        New directories are returned in the order they were created.
 
+        Args:
+            dir: The recursively watched directory
+            timeout: Max number of seconds to wait
+        Returns:
+            The path of the new directory (with the same prefix as dir) or None if
+            the timeout expires
+        """
+        realDir = self.watchDirNames.get(os.path.normpath(dir))
+        watch = self.watches.get(realDir)
+        if watch is None or not watch.recursive:
+            raise StateError(f"FileWatcher: {dir} is not a recursive watch directory")
+        try:
+            newRealDir = watch.newDirQ.get(block=True, timeout=timeout)
+        except Empty:
+            return None
+        return os.path.join(dir, os.path.relpath(newRealDir, realDir))
+
+    def _newDirCreated(self, realSubDir: str) -> None:
+        """Called by the notification thread when a directory is created or moved in"""
+        with self.watchLock:
+            parentWatch = self.watches.get(os.path.dirname(realSubDir))
+            if parentWatch is None or not (parentWatch.recursive or parentWatch.topDir):
+                return
+            topDir = parentWatch.topDir or os.path.dirname(realSubDir)
+            newDirs = []
+            if self._addSubdirWatch(realSubDir, topDir):
+                newDirs.append(realSubDir)
+            # subdirectories may have been created before the watch was in place,
+            #   (those created after will also have an event but are only reported once)
+            for root, subDirs, _ in os.walk(realSubDir):
+                for subDir in subDirs:
+                    if self._addSubdirWatch(os.path.join(root, subDir), topDir):
+                        newDirs.append(os.path.join(root, subDir))
+            topWatch = self.watches.get(topDir)
+        if topWatch is not None:
+            for newDir in newDirs:
+                topWatch.newDirQ.put(newDir)
+
+    def _addSubdirWatch(self, realSubDir: str, topDir: str) -> bool:
+        """
+        Add a watch for a subdirectory of recursive watch topDir, the watchLock must be held.
+        Returns False if the subdirectory was already part of the recursive watch.
+        """
+        topWatch = self.watches[topDir]
+        subDirName = os.path.join(topWatch.dir, os.path.relpath(realSubDir, topDir))
+        self.watchDirNames[os.path.normpath(subDirName)] = realSubDir
+        inheritedPatterns = list(topWatch.filePatterns.keys())
+        watch = self.watches.get(realSubDir)
+        if watch is not None and watch.topDir == topDir:
+            return False
+        if watch is not None:
+            # already watched (i.e. by a stream), add the recursive watch's patterns
+            for pattern in inheritedPatterns:
+                watch.filePatterns[pattern] = watch.filePatterns.get(pattern, 0) + 1
+            watch.topDir = topDir
+            watch.inheritedPatterns = inheritedPatterns
+            self._updateWatch(realSubDir, watch)
+            return True
+        watch = StructDict({'dir': subDirName,
+                            'filePatterns': {pattern: 1 for pattern in inheritedPatterns},
+                            'inheritedPatterns': inheritedPatterns,
+                            'minFileSize': topWatch.minFileSize, 'recursive': False,
+                            'topDir': topDir, 'newDirQ': None})
+        self.watches[realSubDir] = watch
+        self._startWatch(realSubDir, watch)
+        return True
+
+    def _removeWatch(self, realDir: str) -> None:
+        """Remove the watch on realDir, the watchLock must be held"""
+        watch = self.watches.pop(realDir)
+        for dirName in [k for k, v in self.watchDirNames.items() if v == realDir]:
+            del self.watchDirNames[dirName]
+        self._stopWatch(realDir, watch)
+
+    def _startWatch(self, realDir, watch):
+        raise NotImplementedError('_startWatch')
+
+    def _updateWatch(self, realDir, watch):
+        raise NotImplementedError('_updateWatch')
+
+    def _stopWatch(self, realDir, watch):
+        raise NotImplementedError('_stopWatch')
+
+    def addArrivalCallback(self, callback) -> None:
+        """
+        Register a function called as callback(filename, eventTime) when a file arrives
+        in any watched directory. The filename has the realpath of the directory.
+        """
+        self.fileRegistry.addArrivalCallback(callback)
+
+    def _getFileKey(self, filename: str):
+        """
+        Returns the full filename (adding the primary watch directory if there is no path)
+        and the key used for the file in the fileRegistry.
+        """
+        _filedir, _filename = os.path.split(filename)
+        if _filedir in (None, ''):
+            if self.watchDir is None:
+                raise StateError("FileWatcher: no directory is being watched")
+            return os.path.join(self.watchDir, filename), os.path.join(self.realWatchDir, _filename)
+        realDir = self.watchDirNames.get(os.path.normpath(_filedir))
+        if realDir is None:
+            watchDirs = list(self.watchDirNames.keys())
+            raise StateError(f"FileWatcher: file path doesn't match watch directory: {_filedir}, {watchDirs}")
+        return filename, os.path.join(realDir, _filename)
+
+    def _getMinFileSize(self, fileKey: str) -> int:
+        watch = self.watches.get(os.path.dirname(fileKey))
+        if watch is None:
+            return self.minFileSize
+        return watch.minFileSize
+
+    def _demoDelay(self, fileKey: str) -> None:
+        # The demoStep applies to files from the primary watch directory
+        if self.demoStep is not None and self.demoStep > 0:
+            if os.path.dirname(fileKey) == self.realWatchDir:
+                self.prevEventTime = demoDelay(self.demoStep, self.prevEventTime)
+
+
+if sys.platform in ("darwin", "win32"):
+    from watchdog.observers import Observer  # type: ignore
+    from watchdog.events import PatternMatchingEventHandler  # type: ignore
+else:
+    # watchdog is only used on Mac and Windows, don't import it on Linux
+    PatternMatchingEventHandler = object
+
+
+# Version of FileWatcher for Mac and Windows
+class WatchdogFileWatcher(BaseFileWatcher):
+    """Version of FileWatcher for Mac and Windows using Watchdog toolkit."""
+    def __init__(self):
+        super().__init__()
+        self.observer = None
+
+    def __del__(self):
+        if self.observer is not None:
+            try:
+                self.observer.stop()
+                self.observer.join()
+            except Exception as err:
+                # TODO - change back to log once can figure out what the observer.stop streamRef error is
+                print("FileWatcher: oberver.stop(): %s", str(err))
+
+    def _startWatch(self, realDir, watch):
+        if watch.topDir is not None:
+            # subdirectory of a recursive watch, already covered by the observer
+            return
+        if self.observer is None:
+            self.observer = Observer()
+            self.observer.start()
+        newDirCallback = self._newDirCreated if watch.recursive else None
+        watch.fileNotifyHandler = FileNotifyHandler(self.fileRegistry, list(watch.filePatterns.keys()),
+                                                    newDirCallback=newDirCallback)
+        watch.observedWatch = self.observer.schedule(watch.fileNotifyHandler, realDir,
+                                                     recursive=watch.recursive)
+
+    def _updateWatch(self, realDir, watch):
+        # re-schedule with the new set of file patterns
+        self._stopWatch(realDir, watch)
+        self._startWatch(realDir, watch)
+
+    def _stopWatch(self, realDir, watch):
+        if self.observer is not None and watch.observedWatch is not None:
+            self.observer.unschedule(watch.observedWatch)
+            watch.observedWatch = None
 
     def waitForFile(self, filename: str, timeout: int=0, timeCheckIncrement: int=1) -> Optional[str]:
         """
-        Wait for a specific filename to be created in the directory specified in initFileNotifier.
+        Wait for a specific filename to be created in a watched directory.
 
         Args:
-            filename: Name of File to watch for creation of. If filename includes a path it must 
-                match that specified in initFileNotifier.
+            filename: Name of File to watch for creation of. If filename has no path it is
+                looked for in the directory specified in initFileNotifier, otherwise the path
+                must match a directory being watched.
             timeout: Max number of seconds to watch for the file creation. If timeout expires
                 before the file is created then None will be returned
             timeCheckIncrement: Time interval (secs) to check if file exists in case file
@@ -123,12 +487,8 @@ class WatchdogFileWatcher():
         Returns:
             The filename of the created file (same as input arg) or None if timeout expires
         """
-        _filedir, _filename = os.path.split(filename)
-        if _filedir in (None, ''):
-            filename = os.path.join(self.watchDir, filename)
-        elif _filedir != self.watchDir:
-            raise StateError(f"FileWatcher: file path doesn't match watch directory: {_filedir}, {self.watchDir}")
-
+        filename, fileKey = self._getFileKey(filename)
+        startTime = time.time()
         fileExists = os.path.exists(filename)
         if not fileExists:
             if self.observer is None:
@@ -139,7 +499,6 @@ class WatchdogFileWatcher():
         eventLoopCount = 0
         self.foundWithFileEvent = False
         eventTimeStamp = 0
-        startTime = time.time()
         self.waitLoopCount = 0
         while not fileExists:
             self.waitLoopCount += 1
@@ -151,36 +510,24 @@ class WatchdogFileWatcher():
                     timeCheckIncrement = remainingTime
             # look for file creation event
             eventLoopCount += 1
-            timeToCheckForFile = time.time() + timeCheckIncrement
-            try:
-                event, ts = self.fileNotifyQ.get(block=True, timeout=timeCheckIncrement)
-            except Empty:
-                # The timeout occured on fileNotifyQ.get()
+            ts = self.fileRegistry.waitForArrival(fileKey, timeout=timeCheckIncrement,
+                                                  notBefore=startTime)
+            if ts is None:
+                # periodically check if file exists in case the event was missed
                 fileExists = os.path.exists(filename)
                 continue
-            if event is None:
-                raise StateError('waitForFile: event is None')
-            # We may have a stale event from a previous file if multiple events
-            #   are created per file or if the previous file eventloop
-            #   timed out and then the event arrived later.
-            if os.path.realpath(event.src_path) == os.path.realpath(filename):
-                fileExists = True
-                self.foundWithFileEvent = True
-                eventTimeStamp = ts
-                if event.event_type == 'created':
-                    # brief sleep after created event
-                    time.sleep(.05)
-                continue
-            if time.time() >= timeToCheckForFile:
-                # periodically check if file exists, can occur if we get
-                #   swamped with unrelated events
-                fileExists = os.path.exists(filename)
+            fileExists = True
+            self.foundWithFileEvent = True
+            eventTimeStamp = ts
+            # brief sleep after created event
+            time.sleep(.05)
 
         # wait for the full file to be written, wait at most 300 ms
+        minFileSize = self._getMinFileSize(fileKey)
         waitIncrement = 0.1
         totalWriteWait = 0.0
         fileSize = os.path.getsize(filename)
-        while fileSize < self.minFileSize and totalWriteWait < 0.3:
+        while fileSize < minFileSize and totalWriteWait < 0.3:
             time.sleep(waitIncrement)
             totalWriteWait += waitIncrement
             fileSize = os.path.getsize(filename)
@@ -189,30 +536,48 @@ class WatchdogFileWatcher():
                     "fileEventCaptured %s, fileName %s, eventTimeStamp %.5f",
                     eventLoopCount, totalWriteWait,
                     self.foundWithFileEvent, filename, eventTimeStamp)
-        if self.demoStep is not None and self.demoStep > 0:
-            self.prevEventTime = demoDelay(self.demoStep, self.prevEventTime)
+        self._demoDelay(fileKey)
         return filename
 
 
 class FileNotifyHandler(PatternMatchingEventHandler):  # type: ignore
     """
-    Handler class that will receive the watchdog notifications. It will queue the notifications
-    int the queue provided during to the init function.
+    Handler class that will receive the watchdog notifications. It will record the notifications
+    in the FileWaiterRegistry provided to the init function.
     """
-    def __init__(self, q, patterns):
+    def __init__(self, fileRegistry, patterns, newDirCallback=None):
         """
         Args:
-            q (queue): Queue into which file-creation notifications will be placed.
+            fileRegistry (FileWaiterRegistry): Registry in which file-creation notifications
+                will be recorded.
             patterns (List[regex]): Filename patterns to watch for.
+            newDirCallback (function): Called with the path of new directories (for
+                recursive watches)
         """
         super().__init__(patterns=patterns)
-        self.q = q
+        self.fileRegistry = fileRegistry
+        self.newDirCallback = newDirCallback
+
+    def dispatch(self, event):
+        # directory events don't match the file patterns, handle them here
+        if event.is_directory:
+            if self.newDirCallback is not None:
+                if event.event_type == 'created':
+                    self.newDirCallback(event.src_path)
+                elif event.event_type == 'moved':
+                    self.newDirCallback(event.dest_path)
+            return
+        super().dispatch(event)
 
     def on_created(self, event):
-        self.q.put((event, time.time()))
+        self.fileRegistry.fileArrived(event.src_path, time.time())
 
     def on_modified(self, event):
-        self.q.put((event, time.time()))
+        self.fileRegistry.fileArrived(event.src_path, time.time())
+
+    def on_moved(self, event):
+        # scanners that write to a temporary name and then rename
+        self.fileRegistry.fileArrived(event.dest_path, time.time())
 
 
 # import libraries for Linux version
@@ -222,20 +587,24 @@ if sys.platform in ("linux", "linux2"):
     import inotify.calls
 
 
+def inotifyAvailable() -> bool:
+    """Returns whether an inotify instance can be created"""
+    try:
+        testing_fd = inotify.calls.inotify_init()
+        os.close(testing_fd)
+        return True
+    except Exception:
+        return False
+
+
 # Version of FileWatcher for Linux
-class InotifyFileWatcher():
+class InotifyFileWatcher(BaseFileWatcher):
     """Version of FileWatcher for Linux using Inotify interface."""
     def __init__(self):
-        self.watchDir = None
-        self.filePattern = None
-        self.minFileSize = 0
+        super().__init__()
         self.shouldExit = False
-        self.demoStep = 0
-        self.prevEventTime = 0
-        self.foundWithFileEvent = False
-        self.waitLoopCount = 0
-        # create a listening thread
-        self.fileNotifyQ = Queue()  # type: None
+        self.notify_thread = None
+        # create a listening thread which dispatches file events to the registry
         try:
             # testing_fd tests whether inotify is working, if not reverts to polling.
             # e.g., Mac M1 testing with Docker fails with inotify
@@ -253,44 +622,43 @@ class InotifyFileWatcher():
         if self.notify_thread:
             self.notify_thread.join(timeout=2)
 
-    def initFileNotifier(self, dir: str, filePattern: str, minFileSize: int, demoStep: int=0) -> None:
-        """
-        Initialize the file watcher to watch for files in the specified directory.
-        Note: inotify doesn't use filepatterns
-
-        Args:
-            dir (str): Directory to watch in
-            filePattern (str): ignored by inotify implementation
-            minFileSize (int): Minimum file size necessary to consider the file is wholely written.
-                Below this size the filewatcher will assume file is paritally written and continue
-                to wait.
-            demoStep (int): If non-zero then it will space out file notifications by demoStep seconds.
-                This is used when the image files are pre-existing but we want to simulate as if
-                the arrive from the scanner every few seconds (demoStep seconds).
-        """
-        self.filePattern = filePattern
-        self.demoStep = demoStep
-        self.minFileSize = minFileSize
-        if dir is None:
-            raise StateError('initFileNotifier: dir is None')
-        if not os.path.exists(dir):
-            raise NotADirectoryError("No such directory: %s" % (dir))
-        if dir != self.watchDir:
-            if self.watchDir is not None:
-                if self.notifier is not None:
-                    self.notifier.remove_watch(self.watchDir)
-            self.watchDir = dir
-            if self.notifier is not None:
-                self.notifier.add_watch(os.path.realpath(self.watchDir), 
-                                        mask=inotify.constants.IN_CLOSE_WRITE)
+    def _startWatch(self, realDir, watch):
+        if self.notifier is not None:
+            # IN_MOVED_TO is for scanners that write to a temporary name and then rename,
+            #   IN_CREATE is for new subdirectories when watching recursively
+            watch.mask = inotify.constants.IN_CLOSE_WRITE | inotify.constants.IN_MOVED_TO
+            if watch.recursive or watch.topDir is not None:
+                watch.mask |= inotify.constants.IN_CREATE
+            self.notifier.add_watch(realDir, mask=watch.mask)
+
+    def _updateWatch(self, realDir, watch):
+        # file patterns are matched in notifyEventLoop, only a change
+        #   to recursive requires changing the inotify watch
+        if self.notifier is None:
+            return
+        mask = watch.mask
+        if watch.recursive or watch.topDir is not None:
+            mask |= inotify.constants.IN_CREATE
+        if mask != watch.mask:
+            self._stopWatch(realDir, watch)
+            self._startWatch(realDir, watch)
+
+    def _stopWatch(self, realDir, watch):
+        if self.notifier is not None:
+            try:
+                self.notifier.remove_watch(realDir)
+            except Exception as err:
+                # the directory may have been deleted, which already removed the watch
+                logging.log(DebugLevels.L6, f"FileWatcher: remove_watch {realDir}: {err}")
 
     def waitForFile(self, filename: str, timeout: int=0, timeCheckIncrement: int=1) -> Optional[str]:
         """
-        Wait for a specific filename to be created in the directory specified in initFileNotifier.
+        Wait for a specific filename to be created in a watched directory.
 
         Args:
-            filename: Name of File to watch for creation of. If filename includes a path it must 
-                match that specified in initFileNotifier.
+            filename: Name of File to watch for creation of. If filename has no path it is
+                looked for in the directory specified in initFileNotifier, otherwise the path
+                must match a directory being watched.
             timeout: Max number of seconds to watch for the file creation. If timeout expires
                 before the file is created then None will be returned
             timeCheckIncrement: Time interval (secs) to check if file exists in case file
@@ -298,23 +666,24 @@ class InotifyFileWatcher():
         Returns:
             The filename of the created file (same as input arg) or None if timeout expires
         """
-        _filedir, _filename = os.path.split(filename)
-        if _filedir in (None, ''):
-            filename = os.path.join(self.watchDir, filename)
-        elif _filedir != self.watchDir:
-            raise StateError(f"FileWatcher: file path doesn't match watch directory: {_filedir}, {self.watchDir}")
-
+        filename, fileKey = self._getFileKey(filename)
+        startTime = time.time()
+        self.foundWithFileEvent = False
+        eventTimeStamp = 0
         fileExists = os.path.exists(filename)
-        if not fileExists:
+        if fileExists:
+            # If the file-close event was already received the file is completely written
+            ts = self.fileRegistry.getArrivalTime(fileKey)
+            if ts is not None:
+                self.foundWithFileEvent = True
+                eventTimeStamp = ts
+        else:
             if (self.notifier is not None) and (self.notify_thread is None):
                 raise FileNotFoundError("FileNotifier thread not initialized and dicom file not found %s" % (filename))
             else:
                 logStr = "FileWatcher: Waiting for file {}, timeout {}s ".format(filename, timeout)
                 logging.log(DebugLevels.L6, logStr)
         eventLoopCount = 0
-        self.foundWithFileEvent = False
-        eventTimeStamp = 0
-        startTime = time.time()
         self.waitLoopCount = 0
         while not fileExists:
             self.waitLoopCount += 1
@@ -326,34 +695,23 @@ class InotifyFileWatcher():
                     timeCheckIncrement = remainingTime
             # look for file creation event
             eventLoopCount += 1
-            timeToCheckForFile = time.time() + timeCheckIncrement
-            try:
-                eventfile, ts = self.fileNotifyQ.get(block=True, timeout=timeCheckIncrement)
-            except Empty:
-                # The timeout occured on fileNotifyQ.get()
+            ts = self.fileRegistry.waitForArrival(fileKey, timeout=timeCheckIncrement,
+                                                  notBefore=startTime)
+            if ts is None:
+                # periodically check if file exists in case the event was missed
                 fileExists = os.path.exists(filename)
                 continue
-            if eventfile is None:
-                raise StateError('waitForFile: eventfile is None')
-            # We may have a stale event from a previous file if multiple events
-            #   are created per file or if the previous file eventloop
-            #   timed out and then the event arrived later.
-            if os.path.realpath(eventfile) == os.path.realpath(filename):
-                fileExists = True
-                self.foundWithFileEvent = True
-                eventTimeStamp = ts
-                continue
-            if time.time() >= timeToCheckForFile:
-                # periodically check if file exists, can occur if we get
-                #   swamped with unrelated events
-                fileExists = os.path.exists(filename)
+            fileExists = True
+            self.foundWithFileEvent = True
+            eventTimeStamp = ts
         if self.foundWithFileEvent is False:
             # We didn't get a file-close event because the file already existed.
             # Check the file size and sleep up to 300 ms waitig for full size
+            minFileSize = self._getMinFileSize(fileKey)
             waitIncrement = 0.1
             totalWriteWait = 0.0
             fileSize = os.path.getsize(filename)
-            while fileSize < self.minFileSize and totalWriteWait < 0.3:
+            while fileSize < minFileSize and totalWriteWait < 0.3:
                 time.sleep(waitIncrement)
                 totalWriteWait += waitIncrement
                 fileSize = os.path.getsize(filename)
@@ -361,26 +719,258 @@ class InotifyFileWatcher():
                     "File avail: eventLoopCount %d, fileEventCaptured %s, "
                     "fileName %s, eventTimeStamp %d", eventLoopCount,
                     self.foundWithFileEvent, filename, eventTimeStamp)
-        if self.demoStep is not None and self.demoStep > 0:
-            self.prevEventTime = demoDelay(self.demoStep, self.prevEventTime)
+        self._demoDelay(fileKey)
         return filename
 
     def notifyEventLoop(self):
         """
-        Thread function which gets notifications and queues them in the fileNotifyQ
+        Thread function which gets notifications and dispatches them to the fileRegistry
         """
         for event in self.notifier.event_gen():
             if self.shouldExit is True:
                 break
             if event is not None:
                 # print(event)      # uncomment to see all events generated
-                if 'IN_CLOSE_WRITE' in event[1]:
+                if 'IN_ISDIR' in event[1]:
+                    if 'IN_CREATE' in event[1] or 'IN_MOVED_TO' in event[1]:
+                        self._newDirCreated(os.path.join(event[2], event[3]))
+                elif 'IN_CLOSE_WRITE' in event[1] or 'IN_MOVED_TO' in event[1]:
+                    # event[2] is the watch path as given to add_watch (the realpath)
+                    watch = self.watches.get(event[2])
+                    if watch is None:
+                        continue
                     path = pathlib.Path(event[3])
-                    if path.match(self.filePattern):
-                        fullpath = os.path.join(event[2], event[3])
-                        self.fileNotifyQ.put((fullpath, time.time()))
+                    for filePattern in list(watch.filePatterns.keys()):
+                        if path.match(filePattern):
+                            fullpath = os.path.join(event[2], event[3])
+                            self.fileRegistry.fileArrived(fullpath, time.time())
+                            break
+
+# Version of FileWatcher that polls the directories, for any platform
+class PollingFileWatcher(BaseFileWatcher):
+    """
+    Version of FileWatcher that polls the watched directories with os.scandir. Used when
+    inotify isn't available (i.e. Docker on Apple silicon) or doesn't see writes made by
+    another host (NFS/SMB mounts of the scanner share).
+
+    Each poll takes a snapshot of (size, mtime) for the files in each watched directory and
+    compares it to the previous snapshot. A file is complete once its size and mtime have
+    not changed for stableTime seconds, at which point an arrival is reported, the same
+    as the inotify close-write event. New subdirectories of recursive watches are reported
+    as for the inotify create event. Files present when the watch starts and not modified
+    within stableTime are considered complete without an event.
+
+    The poll interval adapts to the stream: while a file is being written it polls at
+    minPollInterval, otherwise at a fraction of the TR estimated from the arrival times.
+    """
+    defaultPollInterval = 0.1
+    pollsPerTR = 20
+
+    def __init__(self, minPollInterval: float=0.02, maxPollInterval: float=1.0,
+                 stableTime: float=0.1):
+        """
+        Args:
+            minPollInterval: Poll interval (secs) while a file is being written
+            maxPollInterval: Longest poll interval (secs), used for long TRs
+            stableTime: Secs a file's size and mtime must be unchanged for it to be complete.
+                For NFS mounts with attribute caching this should be longer than the
+                attribute cache time (actimeo).
+        """
+        super().__init__()
+        self.minPollInterval = minPollInterval
+        self.maxPollInterval = maxPollInterval
+        self.stableTime = stableTime
+        self.pollInterval = self.defaultPollInterval
+        # map from realpath of directory to {filename: StructDict(isDir, stat, changedAt, reported)}
+        self.snapshots = {}
+        self.snapshotLock = threading.Lock()
+        # map from realpath of directory to the recent arrival times, to estimate the TR
+        self.arrivalTimes = {}
+        self.shouldExit = False
+        self.wakeEvent = threading.Event()
+        self.poll_thread = threading.Thread(name='filePoller', target=self.pollLoop)
+        self.poll_thread.setDaemon(True)
+        self.poll_thread.start()
+
+    def __del__(self):
+        self.shouldExit = True
+        self.wakeEvent.set()
+        if self.poll_thread:
+            self.poll_thread.join(timeout=2)
+
+    def _startWatch(self, realDir, watch):
+        # take the initial snapshot now, so files written after the watch starts get events
+        self._scanDir(realDir, watch, initial=True)
+
+    def _updateWatch(self, realDir, watch):
+        # file patterns and recursion are checked on each poll
+        pass
+
+    def _stopWatch(self, realDir, watch):
+        with self.snapshotLock:
+            self.snapshots.pop(realDir, None)
+            self.arrivalTimes.pop(realDir, None)
+
+    def waitForFile(self, filename: str, timeout: int=0, timeCheckIncrement: int=1) -> Optional[str]:
+        """
+        Wait for a specific filename to be completely written in a watched directory.
+
+        Args:
+            filename: Name of File to watch for creation of. If filename has no path it is
+                looked for in the directory specified in initFileNotifier, otherwise the path
+                must match a directory being watched.
+            timeout: Max number of seconds to watch for the file creation. If timeout expires
+                before the file is created then None will be returned
+            timeCheckIncrement: Max time interval (secs) between checks of the poll snapshot,
+                for files that don't match the watch pattern and so don't get an event.
+        Returns:
+            The filename of the created file (same as input arg) or None if timeout expires
+        """
+        filename, fileKey = self._getFileKey(filename)
+        startTime = time.time()
+        self.foundWithFileEvent = False
+        self.waitLoopCount = 0
+        while not self._isFileComplete(fileKey):
+            self.waitLoopCount += 1
+            waitTime = min(timeCheckIncrement, max(self.pollInterval, self.minPollInterval))
+            if timeout > 0:
+                remainingTime = (startTime + timeout) - time.time()
+                if remainingTime <= 0:
+                    return None
+                waitTime = min(waitTime, remainingTime)
+            ts = self.fileRegistry.waitForArrival(fileKey, timeout=waitTime, notBefore=startTime)
+            if ts is not None:
+                self.foundWithFileEvent = True
+                break
+        logging.log(DebugLevels.L6, "File avail: waitLoopCount %d, fileEventCaptured %s, fileName %s",
+                    self.waitLoopCount, self.foundWithFileEvent, filename)
+        self._demoDelay(fileKey)
+        return filename
+
+    def pollLoop(self):
+        """Thread function which polls the watched directories and dispatches the events"""
+        while not self.shouldExit:
+            with self.watchLock:
+                watches = list(self.watches.items())
+            inProgress = False
+            for realDir, watch in watches:
+                arrivals, newDirs, dirInProgress = self._scanDir(realDir, watch)
+                inProgress = inProgress or dirInProgress
+                for newDir in newDirs:
+                    self._newDirCreated(newDir)
+                for fullpath in arrivals:
+                    eventTime = time.time()
+                    self.fileRegistry.fileArrived(fullpath, eventTime)
+                    self._recordArrival(realDir, eventTime)
+            self.pollInterval = self._getPollInterval(inProgress)
+            self.wakeEvent.wait(self.pollInterval)
+            self.wakeEvent.clear()
+
+    def _scanDir(self, realDir: str, watch, initial: bool=False):
+        """
+        Compare a new snapshot of realDir with the previous one.
+        Returns the list of completed files matching the watch patterns, the list of
+        new subdirectories and whether any file is still being written.
+        """
+        now = time.time()
+        current = {}
+        try:
+            with os.scandir(realDir) as dirEntries:
+                for dirEntry in dirEntries:
+                    try:
+                        if dirEntry.is_dir():
+                            current[dirEntry.name] = None
+                        else:
+                            fileStat = dirEntry.stat()
+                            current[dirEntry.name] = (fileStat.st_size, fileStat.st_mtime_ns)
+                    except OSError:
+                        # removed since the directory was listed
+                        continue
+        except OSError as err:
+            logging.log(DebugLevels.L6, f"FileWatcher: scandir {realDir}: {err}")
+            return [], [], False
+        arrivals = []
+        newDirs = []
+        inProgress = False
+        with self.snapshotLock:
+            prevSnapshot = self.snapshots.get(realDir)
+            if prevSnapshot is None and not initial:
+                # the watch was removed since this poll started
+                return [], [], False
+            snapshot = {}
+            for name, fileStat in current.items():
+                prev = prevSnapshot.get(name) if prevSnapshot is not None else None
+                if fileStat is None:
+                    if not initial and (prev is None or not prev.isDir):
+                        newDirs.append(os.path.join(realDir, name))
+                    snapshot[name] = StructDict({'isDir': True})
+                    continue
+                if prev is None or prev.isDir:
+                    # created, the last write was at its mtime (if the clocks agree)
+                    entry = StructDict({'isDir': False, 'stat': fileStat,
+                                        'changedAt': min(now, fileStat[1] / 1e9), 'reported': None})
+                    if initial and now - entry.changedAt >= self.stableTime:
+                        # files already complete when the watch starts don't get an event
+                        entry.reported = fileStat
                 else:
-                    self.fileNotifyQ.put(('', time.time()))
+                    entry = prev
+                    if fileStat != entry.stat:
+                        entry.stat = fileStat
+                        entry.changedAt = now
+                if entry.reported != entry.stat:
+                    if now - entry.changedAt >= self.stableTime:
+                        entry.reported = entry.stat
+                        if self._matchesWatch(name, watch):
+                            arrivals.append(os.path.join(realDir, name))
+                    else:
+                        inProgress = True
+                snapshot[name] = entry
+            self.snapshots[realDir] = snapshot
+        return arrivals, newDirs, inProgress
+
+    def _matchesWatch(self, name: str, watch) -> bool:
+        path = pathlib.Path(name)
+        for filePattern in list(watch.filePatterns.keys()):
+            if path.match(filePattern):
+                return True
+        return False
+
+    def _isFileComplete(self, fileKey: str) -> bool:
+        realDir, name = os.path.split(fileKey)
+        with self.snapshotLock:
+            entry = self.snapshots.get(realDir, {}).get(name)
+            return entry is not None and not entry.isDir and entry.reported == entry.stat
+
+    def _recordArrival(self, realDir: str, eventTime: float) -> None:
+        with self.snapshotLock:
+            times = self.arrivalTimes.get(realDir)
+            if times is None:
+                times = deque(maxlen=9)
+                self.arrivalTimes[realDir] = times
+            times.append(eventTime)
+
+    def getEstimatedTR(self) -> Optional[float]:
+        """Returns the shortest median interval between arrivals in a watched directory"""
+        estimate = None
+        with self.snapshotLock:
+            for times in self.arrivalTimes.values():
+                if len(times) < 3:
+                    continue
+                intervals = sorted(b - a for a, b in zip(list(times)[:-1], list(times)[1:]))
+                median = intervals[len(intervals) // 2]
+                if estimate is None or median < estimate:
+                    estimate = median
+        return estimate
+
+    def _getPollInterval(self, inProgress: bool) -> float:
+        if inProgress:
+            return self.minPollInterval
+        trEstimate = self.getEstimatedTR()
+        if trEstimate is None:
+            return self.defaultPollInterval
+        interval = trEstimate / self.pollsPerTR
+        return min(max(interval, self.minPollInterval), self.maxPollInterval)
+
 
 # Uncomment to test lag time for finding files
 # if __name__ == "__main__":
@@ -6,30 +6,21 @@ nifti files, which is a file format that is better for data analyses.
 
 import os
 import time
-import copy
-import uuid
 import logging
-import subprocess
 import warnings
 import numpy as np  # type: ignore
 import nibabel as nib
 import pydicom
 from datetime import datetime
-from rtCommon.utils import getTimeToNextTR
+from rtCommon.utils import getTimeToNextTR, replayClockTimeOfDay
+from rtCommon.structDict import StructDict
 from rtCommon.errors import StateError, ValidationError
-from rtCommon.errors import InvocationError, RequestError
-from nilearn.image import new_img_like
-with warnings.catch_warnings():
-    warnings.filterwarnings("ignore", category=UserWarning)
-    from nibabel.nicom import dicomreaders
+from rtCommon.errors import InvocationError, RequestError, NotImplementedError
 try:
     import pydicom as dicom  # type: ignore
 except ModuleNotFoundError:
     import dicom  # type: ignore
 
-# binary path of the conda environment
-binPath = None
-
 ###########
 # The following functions are used to transfer dicom files back and forth from the
 # cloud. We note whether a function is used externally (e.g., not exclusively by
@@ -85,6 +76,181 @@ def anonymizeDicom(dicomImg):
 
     return dicomImg
 
+
+# Explicit VR elements with these VRs have a 2 byte reserved field and a 4 byte length
+longLengthVRs = {b'OB', b'OD', b'OF', b'OL', b'OV', b'OW', b'SQ', b'SV', b'UC',
+                 b'UN', b'UR', b'UT', b'UV'}
+undefinedLength = 0xFFFFFFFF
+# (group, element) of the item, item delimiter and sequence delimiter tags
+itemTag = (0xFFFE, 0xE000)
+itemDelimTag = (0xFFFE, 0xE00D)
+seqDelimTag = (0xFFFE, 0xE0DD)
+pixelDataTag = (0x7FE0, 0x0010)
+
+
+def getAnonymizeTags() -> set:
+    """Returns the (group, element) tags of the attributesToAnonymize"""
+    tags = set()
+    for keyword in attributesToAnonymize:
+        tag = dicom.datadict.tag_for_keyword(keyword)
+        tags.add((tag >> 16, tag & 0xFFFF))
+    return tags
+
+
+def anonymizeDicomBytes(data: bytes) -> bytes:
+    """
+    Anonymizes a Dicom file's raw bytes without parsing it into a pydicom dataset.
+    The top-level elements are scanned tag by tag and the values of the
+    attributesToAnonymize are blanked (set to zero length), the same as anonymizeDicom.
+    The scan stops at the Pixel Data element, the rest of the file is copied as is.
+
+    Used internally.
+    Args:
+        data: The Dicom file data, with preamble and file meta information
+    Returns:
+        The anonymized Dicom file data
+    Raises:
+        ValidationError: if the data is truncated
+        NotImplementedError: for Dicom encodings that aren't scanned (big endian,
+            deflated or no file meta information), use anonymizeDicom instead
+    """
+    return scanDicomBytes(data, getAnonymizeTags())
+
+
+def checkDicomBytesComplete(data: bytes) -> None:
+    """
+    Checks that a Dicom file's raw bytes are complete (not truncated) without
+    parsing them into a pydicom dataset.
+
+    Used internally.
+    Raises:
+        ValidationError: if the data is truncated
+        NotImplementedError: for Dicom encodings that aren't scanned, use
+            readDicomFromBuffer instead
+    """
+    scanDicomBytes(data, set())
+
+
+def scanDicomBytes(data: bytes, blankTags: set) -> bytes:
+    """
+    Scans the top-level elements of a Dicom file up to the Pixel Data, checking
+    for truncation, and returns the data with the values of blankTags set to zero length.
+    Used internally.
+    """
+    if len(data) < 132 or data[128:132] != b'DICM':
+        raise NotImplementedError("scanDicomBytes: no Dicom preamble")
+    # the file meta information group is always explicit VR little endian
+    metaEnd, transferSyntax = scanDicomFileMeta(data, 132)
+    if transferSyntax == dicom.uid.ImplicitVRLittleEndian:
+        explicitVR = False
+    elif transferSyntax in (dicom.uid.ExplicitVRBigEndian, dicom.uid.DeflatedExplicitVRLittleEndian):
+        raise NotImplementedError(f"scanDicomBytes: transfer syntax {transferSyntax}")
+    else:
+        explicitVR = True
+    parts = [data[:metaEnd]]
+    copyFrom = metaEnd
+    pos = metaEnd
+    while pos < len(data):
+        tag, vr, headerLen, valueLen = readElementHeader(data, pos, explicitVR)
+        if tag == pixelDataTag:
+            checkPixelDataComplete(data, pos + headerLen, valueLen, explicitVR)
+            break
+        if tag in blankTags and valueLen != undefinedLength:
+            # copy up to this element and write its header with a zero length value
+            parts.append(data[copyFrom:pos])
+            parts.append(makeElementHeader(data[pos:pos + headerLen], explicitVR, vr))
+            copyFrom = pos + headerLen + valueLen
+        pos = skipElementValue(data, pos + headerLen, valueLen, explicitVR)
+    else:
+        raise ValidationError("scanDicomBytes: Dicom has no PixelData, file may be truncated")
+    if copyFrom == metaEnd:
+        return data
+    parts.append(data[copyFrom:])
+    return b''.join(parts)
+
+
+def scanDicomFileMeta(data: bytes, pos: int):
+    """Returns the end of the file meta group and its TransferSyntaxUID. Used internally."""
+    transferSyntax = None
+    while True:
+        tag, vr, headerLen, valueLen = readElementHeader(data, pos, True)
+        if tag[0] != 0x0002:
+            break
+        if tag == (0x0002, 0x0010):
+            value = data[pos + headerLen:pos + headerLen + valueLen]
+            transferSyntax = value.rstrip(b'\x00 ').decode('ascii')
+        pos = skipElementValue(data, pos + headerLen, valueLen, True)
+    if transferSyntax is None:
+        raise NotImplementedError("scanDicomBytes: no TransferSyntaxUID")
+    return pos, transferSyntax
+
+
+def readElementHeader(data: bytes, pos: int, explicitVR: bool):
+    """
+    Returns the (group, element) tag, VR (None if implicit), header length and value
+    length of the element at pos. Used internally.
+    """
+    if pos + 8 > len(data):
+        raise ValidationError("Dicom element header is truncated")
+    group = int.from_bytes(data[pos:pos + 2], 'little')
+    element = int.from_bytes(data[pos + 2:pos + 4], 'little')
+    tag = (group, element)
+    if group == 0xFFFE or not explicitVR:
+        # items and delimiters have no VR, even in explicit VR encodings
+        return tag, None, 8, int.from_bytes(data[pos + 4:pos + 8], 'little')
+    vr = data[pos + 4:pos + 6]
+    if vr in longLengthVRs:
+        if pos + 12 > len(data):
+            raise ValidationError("Dicom element header is truncated")
+        return tag, vr, 12, int.from_bytes(data[pos + 8:pos + 12], 'little')
+    return tag, vr, 8, int.from_bytes(data[pos + 6:pos + 8], 'little')
+
+
+def makeElementHeader(header: bytes, explicitVR: bool, vr: bytes) -> bytes:
+    """Returns the element header with a zero value length. Used internally."""
+    if explicitVR and vr not in longLengthVRs:
+        return header[:6] + b'\x00\x00'
+    return header[:-4] + b'\x00\x00\x00\x00'
+
+
+def skipElementValue(data: bytes, pos: int, valueLen: int, explicitVR: bool) -> int:
+    """
+    Returns the position after an element value starting at pos, undefined length
+    sequences and items are walked to their delimiter. Used internally.
+    """
+    if valueLen != undefinedLength:
+        endPos = pos + valueLen
+        if endPos > len(data):
+            raise ValidationError("Dicom element value is truncated")
+        return endPos
+    # undefined length sequence (or item), walk the nested elements to the delimiter
+    while True:
+        tag, _, headerLen, nestedLen = readElementHeader(data, pos, explicitVR)
+        pos += headerLen
+        if tag in (seqDelimTag, itemDelimTag):
+            return pos
+        pos = skipElementValue(data, pos, nestedLen, explicitVR)
+
+
+def checkPixelDataComplete(data: bytes, pos: int, valueLen: int, explicitVR: bool) -> None:
+    """
+    Checks the Pixel Data value starting at pos isn't truncated. Encapsulated
+    (compressed) pixel data must end with its sequence delimiter. Used internally.
+    """
+    if valueLen != undefinedLength:
+        if pos + valueLen > len(data):
+            raise ValidationError("Dicom PixelData is truncated")
+        return
+    while True:
+        tag, _, headerLen, itemLen = readElementHeader(data, pos, explicitVR)
+        pos += headerLen
+        if tag == seqDelimTag:
+            return
+        if tag != itemTag or pos + itemLen > len(data):
+            raise ValidationError("Dicom compressed PixelData is truncated")
+        pos += itemLen
+
+
 def readDicomFromFile(filename):
     """
     This function takes the path/name of the dicom file of interest and reads it.
@@ -133,14 +299,82 @@ def readDicomFromBuffer(data) -> pydicom.dataset.FileDataset:
     dataBytesIO = dicom.filebase.DicomBytesIO(data)
     try:
         dicomImg = dicom.dcmread(dataBytesIO)
-        # Test if the dicom image is complete
-        dicomImgTest = copy.deepcopy(dicomImg)
-        dicomImgTest.convert_pixel_data()
+        # Test if the dicom image is complete, the pixels are decoded later when used
+        checkDicomComplete(dicomImg)
     except Exception as err:
         raise ValidationError(f"readDicomFromBuffer: Dicom may be corrupted or truncated {err}")
     return dicomImg
 
 
+# Item tag (FFFE,E000) which starts each fragment of encapsulated (compressed) pixel data
+encapsulatedItemTag = b'\xfe\xff\x00\xe0'
+
+
+def checkDicomComplete(dicomImg) -> None:
+    """
+    Checks that a Dicom image was completely written, without decoding the pixels.
+    For uncompressed transfer syntaxes the Pixel Data length must be at least
+    Rows x Columns x SamplesPerPixel x BitsAllocated x NumberOfFrames (in bytes),
+    compressed (encapsulated) Pixel Data must be a complete offset table and fragment items,
+    with a fragment at each offset in the table (or at least NumberOfFrames fragments if
+    the table is empty).
+
+    Used internally.
+    Raises:
+        ValidationError if the image is truncated or the transfer syntax is unknown
+    """
+    if 'PixelData' not in dicomImg:
+        raise ValidationError("Dicom has no PixelData, file may be truncated")
+    transferSyntax = None
+    if hasattr(dicomImg, 'file_meta'):
+        transferSyntax = dicomImg.file_meta.get('TransferSyntaxUID')
+    if transferSyntax is None:
+        # no file meta information, pydicom reads it as implicit VR little endian
+        transferSyntax = dicom.uid.ImplicitVRLittleEndian
+    transferSyntax = dicom.uid.UID(transferSyntax)
+    if transferSyntax.is_private or not transferSyntax.is_transfer_syntax:
+        raise ValidationError(f"Dicom has unknown transfer syntax {transferSyntax}")
+    pixelData = dicomImg.PixelData
+    numFrames = int(dicomImg.get('NumberOfFrames', 1) or 1)
+    if transferSyntax.is_compressed:
+        # walk the item headers, the last item must end exactly at the end of the data
+        offset = 0
+        itemOffsets = []
+        while offset < len(pixelData):
+            if pixelData[offset:offset + 4] != encapsulatedItemTag or offset + 8 > len(pixelData):
+                raise ValidationError("Dicom compressed PixelData has an invalid item")
+            itemLen = int.from_bytes(pixelData[offset + 4:offset + 8], 'little')
+            itemOffsets.append(offset)
+            offset += 8 + itemLen
+        # the basic offset table item plus at least one fragment
+        if offset != len(pixelData) or len(itemOffsets) < 2:
+            raise ValidationError("Dicom compressed PixelData is incomplete")
+        # a file truncated between fragment items still ends on an item boundary, so
+        #   also check the fragments of every frame are present
+        tableLen = itemOffsets[1] - 8
+        fragmentsStart = itemOffsets[1]
+        fragmentOffsets = {itemOffset - fragmentsStart for itemOffset in itemOffsets[1:]}
+        if tableLen > 0:
+            # the basic offset table has the offset of each frame's first fragment
+            frameOffsets = [int.from_bytes(pixelData[8 + idx:12 + idx], 'little')
+                            for idx in range(0, tableLen - tableLen % 4, 4)]
+            if len(frameOffsets) < numFrames or \
+                    not all(frameOffset in fragmentOffsets for frameOffset in frameOffsets):
+                raise ValidationError("Dicom compressed PixelData is missing frames of "
+                                      "its offset table")
+        elif len(fragmentOffsets) < numFrames:
+            # without an offset table each frame is at least one fragment
+            raise ValidationError(f"Dicom compressed PixelData has {len(fragmentOffsets)} "
+                                  f"fragments for {numFrames} frames")
+        return
+    numBits = (int(dicomImg.Rows) * int(dicomImg.Columns) * int(dicomImg.get('SamplesPerPixel', 1))
+               * int(dicomImg.BitsAllocated) * numFrames)
+    expectedLen = (numBits + 7) // 8
+    if len(pixelData) < expectedLen:
+        raise ValidationError(f"Dicom PixelData length {len(pixelData)} is less than "
+                              f"the expected {expectedLen}")
+
+
 def readRetryDicomFromDataInterface(dataInterface, filename, timeout=5):
     """
     This function is waiting and watching for a dicom file to be sent to the cloud
@@ -167,9 +401,8 @@ def readRetryDicomFromDataInterface(dataInterface, filename, timeout=5):
             loop_timeout = time_remaining
         try:
             data = dataInterface.watchFile(filename, loop_timeout)
+            # checks that the dicom is complete, pixels are decoded when first used
             dicomImg = readDicomFromBuffer(data)
-            # check that pixel array is complete
-            dicomImg.convert_pixel_data()
             # successful
             return dicomImg
         except TimeoutError as err:
@@ -181,16 +414,33 @@ def readRetryDicomFromDataInterface(dataInterface, filename, timeout=5):
     return None
 
 
-def parseDicomVolume(dicomImg, sliceDim):
+def parseDicomVolume(dicomImg, sliceDim, numSlices=None, out=None):
     """
     The raw dicom file coming from the scanner will be a 2-dimensional picture
     made of up multiple image slices that are tiled together. This function
     separates the image slices to form a single volume.
 
+    The slices are copied out of the mosaic with a reshape/transpose view of the
+    pixel array, one vectorized copy per row of tiles, and the volume keeps the
+    pixel data type (i.e. uint16 rather than float64).
+
     Used externally.
+
+    Args:
+        dicomImg: The pydicom image with the mosaic pixel data
+        sliceDim: The slice size in pixels, an int for square slices or a
+            (sliceRows, sliceColumns) tuple
+        numSlices: Number of slices in the mosaic, defaults to the Siemens
+            NumberOfImagesInMosaic if the header has it, otherwise all the tiles
+        out: Optional array of shape (sliceRows, sliceColumns, numSlices) to write
+            the volume into, i.e. a buffer reused for each TR
+    Returns:
+        The volume, of shape (sliceRows, sliceColumns, numSlices)
     """
-    sliceWidth = sliceDim
-    sliceHeight = sliceDim
+    if isinstance(sliceDim, (tuple, list)):
+        sliceHeight, sliceWidth = sliceDim
+    else:
+        sliceHeight = sliceWidth = sliceDim
 
     image = dicomImg.pixel_array
 
@@ -199,20 +449,48 @@ def parseDicomVolume(dicomImg, sliceDim):
     numSlicesPerCol = dicomHeight // sliceHeight
 
     max_slices = numSlicesPerRow * numSlicesPerCol
-    volume = np.full((sliceWidth, sliceHeight, max_slices), np.nan)
-
-    sliceNum = 0
+    if numSlices is None:
+        numSlices = getMosaicNumSlices(dicomImg)
+        if numSlices is None:
+            numSlices = max_slices
+    if numSlices > max_slices:
+        raise StateError('parseDicomVolume: numSlices {} exceeds max_slices {}'
+                         .format(numSlices, max_slices))
+    volumeShape = (sliceHeight, sliceWidth, numSlices)
+    if out is None:
+        out = np.empty(volumeShape, dtype=image.dtype)
+    elif out.shape != volumeShape:
+        raise StateError('parseDicomVolume: out shape {} should be {}'
+                         .format(out.shape, volumeShape))
+
+    # tiles[r, c, row, col] is pixel (r, c) of the slice in mosaic (row, col), a view
+    tiles = image[:numSlicesPerCol * sliceHeight, :numSlicesPerRow * sliceWidth]
+    tiles = tiles.reshape(numSlicesPerCol, sliceHeight, numSlicesPerRow, sliceWidth)
+    tiles = tiles.transpose(1, 3, 0, 2)
     for row in range(numSlicesPerCol):
-        for col in range(numSlicesPerRow):
-            if sliceNum >= max_slices:
-                raise StateError('parseDicomVolume: sliceNum {} exceeds max_slices {}'
-                                 .format(sliceNum, max_slices))
-            rpos = row * sliceHeight
-            cpos = col * sliceWidth
-            slice = image[rpos: rpos+sliceHeight, cpos: cpos+sliceWidth]
-            volume[:, :, sliceNum] = slice
-            sliceNum += 1
-    return volume
+        firstSlice = row * numSlicesPerRow
+        if firstSlice >= numSlices:
+            break
+        rowSlices = min(numSlicesPerRow, numSlices - firstSlice)
+        out[:, :, firstSlice: firstSlice + rowSlices] = tiles[:, :, row, :rowSlices]
+    return out
+
+
+def getMosaicNumSlices(dicomImg) -> int:
+    """
+    Returns the number of slices in a Siemens mosaic (NumberOfImagesInMosaic), from the
+    (0019,100a) tag or the CSA image header, or None if the header doesn't have it.
+    """
+    if (0x0019, 0x100a) in dicomImg:
+        return int(dicomImg[0x0019, 0x100a].value)
+    if not dicomImg.get('Manufacturer', '').upper().startswith('SIEMENS'):
+        return None
+    csareader = importCsaReader()
+    try:
+        return csareader.get_n_mosaic(csareader.get_csa_header(dicomImg, 'image'))
+    except Exception as err:
+        logging.debug(f"getMosaicNumSlices: no CSA header: {err}")
+        return None
 
 
 def getDicomAcquisitionTime(dicomImg) -> datetime.time:
@@ -239,7 +517,7 @@ def dicomTimeToNextTr(dicomImg, clockSkew, now=None):
     acquisitionTime = getDicomAcquisitionTime(dicomImg)
     repetitionTime = getDicomRepetitionTime(dicomImg)
     if now is None:  # now variable may be passed in for testing purposes
-        now = datetime.now().time()
+        now = replayClockTimeOfDay()
     secToNextTr = getTimeToNextTR(acquisitionTime, repetitionTime, now, clockSkew)
     return secToNextTr
 
@@ -252,7 +530,7 @@ def bidsIncrementalTimeToNextTr(bidsIncremental, clockSkew, now=None):
         acquisitionTime = dtm.time()
     repetitionTime = bidsIncremental.getMetadataField('RepetitionTime')
     if now is None:  # now variable may be passed in for testing purposes
-        now = datetime.now().time()
+        now = replayClockTimeOfDay()
     secToNextTr = getTimeToNextTR(acquisitionTime, repetitionTime, now, clockSkew)
     return secToNextTr
 
@@ -262,6 +540,16 @@ def bidsIncrementalTimeToNextTr(bidsIncremental, clockSkew, now=None):
 # used externally or internally.
 ###########
 
+def importDicomReaders():
+    """
+    Imports nibabel.nicom.dicomreaders on first use (it is slow to import and
+    emits a pydicom UserWarning). Used internally.
+    """
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", category=UserWarning)
+        from nibabel.nicom import dicomreaders
+    return dicomreaders
+
 ## ANNE - is this the correct order in which these functions would be used?
 
 def getAxesForTransform(startingDicomFile, cfg):
@@ -276,15 +564,24 @@ def getAxesForTransform(startingDicomFile, cfg):
 
     Used externally.
     """
-    #Load one example file
+    #Load one example file, only the reference header is read
     nifti_object = nib.load(cfg.ref_BOLD)
     target_orientation = nib.aff2axcodes(nifti_object.affine)
     dicom_object = readDicomFromFile(startingDicomFile)
-    dicom_object = dicomreaders.mosaic_to_nii(dicom_object)
-    dicom_orientation = nib.aff2axcodes(dicom_object.affine)
+    dicom_orientation = nib.aff2axcodes(getMosaicAffine(dicom_object))
     return target_orientation,dicom_orientation
 
 
+def getMosaicAffine(dicomImg):
+    """
+    Returns the affine of the Nifti image mosaic_to_nii would make from a mosaic
+    Dicom, computed from the header without unpacking the pixel data. Used internally.
+    """
+    dicomreaders = importDicomReaders()
+    dicomWrapper = dicomreaders.wrapper_from_data(dicomImg)
+    return np.dot(dicomreaders.DPCS_TO_TAL, dicomWrapper.affine)
+
+
 def getTransform(target_orientation, dicom_orientation):
     """
     This function calculates the right transformation needed to go from the original
@@ -299,6 +596,100 @@ def getTransform(target_orientation, dicom_orientation):
     return transform
 
 
+class NiftiOrientationPlan:
+    """
+    Per-series plan for writing mosaic Dicom volumes as Nifti images in the orientation
+    of a reference image (i.e. the fMRIPrep'd BOLD reference), as saveAsNiftiImage does.
+
+    The mosaic slice layout, the axes transform, the reference affine and header are
+    worked out once from the first Dicom of the series. Each volume is then unpacked
+    from the mosaic (parseDicomVolume) and reoriented as a flip/transpose view, in the
+    Dicom's data type, rather than converted with mosaic_to_nii to float64 and copied.
+    """
+    def __init__(self, dicomImg, reference, axesTransform=None):
+        """
+        Args:
+            dicomImg: A mosaic Dicom image of the series
+            reference: The reference Nifti image, or its filename
+            axesTransform: The orientation transform from getTransform, computed
+                from the Dicom and the reference affines if None
+        """
+        dicomreaders = importDicomReaders()
+        if isinstance(reference, (str, os.PathLike)):
+            reference = nib.load(reference)
+        dicomWrapper = dicomreaders.wrapper_from_data(dicomImg)
+        if not dicomWrapper.is_mosaic:
+            raise ValidationError("NiftiOrientationPlan: Dicom is not a mosaic")
+        sliceRows, sliceCols, numSlices = dicomWrapper.image_shape
+        self.sliceShape = (sliceRows, sliceCols)
+        self.numSlices = numSlices
+        if axesTransform is None:
+            dicomOrientation = nib.aff2axcodes(np.dot(dicomreaders.DPCS_TO_TAL, dicomWrapper.affine))
+            axesTransform = getTransform(nib.aff2axcodes(reference.affine), dicomOrientation)
+        self.axesTransform = np.asarray(axesTransform)
+        # apply_orientation as an index (for the flips) and a transpose, both views
+        self.flipIndex = tuple(slice(None, None, -1) if flip == -1 else slice(None)
+                               for flip in self.axesTransform[:, 1])
+        self.transposeOrder = tuple(np.argsort(self.axesTransform[:, 0]))
+        self.imageClass = reference.__class__
+        self.affine = reference.affine.copy()
+        self.header = reference.header.copy()
+        self.seriesKey = getSeriesKey(dicomImg)
+
+    def reorient(self, volume):
+        """Returns the volume (in Dicom mosaic order) in the reference orientation, a view"""
+        return volume[self.flipIndex].transpose(self.transposeOrder)
+
+    def getVolume(self, dicomImg, out=None):
+        """
+        Returns the Dicom volume in the reference orientation, a view of the
+        unpacked mosaic (which is written to out if provided).
+        """
+        volume = parseDicomVolume(dicomImg, self.sliceShape, numSlices=self.numSlices, out=out)
+        slope = float(dicomImg.get('RescaleSlope', 1))
+        intercept = float(dicomImg.get('RescaleIntercept', 0))
+        if slope != 1 or intercept != 0:
+            volume = volume * slope + intercept
+        return self.reorient(volume)
+
+    def makeNiftiImage(self, dicomImg):
+        """Returns the Dicom volume as a Nifti image with the reference affine and header"""
+        return self.imageClass(self.getVolume(dicomImg), self.affine, header=self.header)
+
+    def saveAsNiftiImage(self, dicomImg, fullNiftiFilename):
+        """Writes the Dicom volume as a Nifti file, returns the filename"""
+        self.makeNiftiImage(dicomImg).to_filename(fullNiftiFilename)
+        return fullNiftiFilename
+
+
+def getSeriesKey(dicomImg):
+    """Returns a key identifying the series and image size of a Dicom. Used internally."""
+    return (dicomImg.get('SeriesInstanceUID'), dicomImg.get('Rows'), dicomImg.get('Columns'))
+
+
+# Orientation plan of the series last written by saveAsNiftiImage
+orientationPlanCache = StructDict({'plan': None, 'reference': None, 'axesTransform': None})
+
+
+def getOrientationPlan(dicomImg, reference, axesTransform=None) -> NiftiOrientationPlan:
+    """
+    Returns the NiftiOrientationPlan for the Dicom's series, reusing the previous plan
+    if the series, reference and axesTransform are the same.
+
+    Used externally.
+    """
+    cache = orientationPlanCache
+    plan = cache.plan
+    if (plan is None or plan.seriesKey != getSeriesKey(dicomImg)
+            or not (cache.reference is reference
+                    or (isinstance(reference, str) and cache.reference == reference))
+            or not np.array_equal(cache.axesTransform, axesTransform)):
+        plan = NiftiOrientationPlan(dicomImg, reference, axesTransform)
+        cache.update({'plan': plan, 'reference': reference,
+                      'axesTransform': None if axesTransform is None else np.array(axesTransform)})
+    return plan
+
+
 def saveAsNiftiImage(dicomDataObject, fullNiftiFilename, cfg, reference):
     """
     This function takes in a dicom data object written in bytes, what you expect
@@ -306,33 +697,18 @@ def saveAsNiftiImage(dicomDataObject, fullNiftiFilename, cfg, reference):
     file), and the config file while will have (1) the axes transformation for the
     dicom file and (2) the header information from a reference scan.
 
+    The orientation plan is made for the first volume of a series and reused for
+    the following volumes (see NiftiOrientationPlan).
+
     Used externally.
     """
-    niftiObject = dicomreaders.mosaic_to_nii(dicomDataObject)
-    temp_data = niftiObject.get_fdata()
-    output_image_correct = nib.orientations.apply_orientation(temp_data, cfg.axesTransform)
-    correct_object = new_img_like(reference, output_image_correct, copy_header=True)
-    correct_object.to_filename(fullNiftiFilename)
-    return fullNiftiFilename
+    plan = getOrientationPlan(dicomDataObject, reference, cfg.axesTransform)
+    return plan.saveAsNiftiImage(dicomDataObject, fullNiftiFilename)
 
 
 def convertDicomFileToNifti(dicomFilename, niftiFilename):
-    global binPath
-    if binPath is None:
-        # Used to use 'which python' to find the conda env path
-        result = subprocess.run(['which', 'dcm2niix'], stdout=subprocess.PIPE)
-        binPath = result.stdout.decode('utf-8')
-        binPath = os.path.dirname(binPath)
-    dcm2niiCmd = os.path.join(binPath, 'dcm2niix')
-    outPath, outName = os.path.split(niftiFilename)
-    if outName.endswith('.nii'):
-        outName = os.path.splitext(outName)[0]  # remove extention
-    cmd = [dcm2niiCmd, '-s', 'y', '-b', 'n', '-o', outPath, '-f', outName,
-           dicomFilename]
-    proc = subprocess.run(cmd, shell=False, stdout=subprocess.DEVNULL)
-    if proc.returncode != 0:
-        raise StateError("Failed to convert Dicom to Nifti. Dicom may be corrupted")
-
+    from rtCommon.conversionPool import runDcm2niix
+    runDcm2niix(dicomFilename, niftiFilename)
 
 
 def niftiToMem(niftiImg):
@@ -354,14 +730,63 @@ def readNifti(niftiFilename, memCached=True):
     return niftiImg
 
 
-def convertDicomImgToNifti(dicomImg, dicomFilename=None):
+def convertDicomImgToNifti(dicomImg, dicomFilename=None, useDcm2niix=False, validate=False):
+    '''
+    Given an in-memory dicomImg, convert it to an in-memory niftiImg.
+    Siemens mosaic and single-frame images are converted in memory (see
+    convertDicomImgToNiftiInMemory), other images are converted with dcm2niix.
+
+    Args:
+        dicomImg: The pydicom image to convert
+        dicomFilename: Temporary filename to use when converting with dcm2niix
+        useDcm2niix: Always convert with dcm2niix
+        validate: Also convert with dcm2niix and raise a ValidationError if the
+            voxel data or affine of the in-memory conversion don't match
+    Returns:
+        The nibabel Nifti1Image
+    '''
+    if useDcm2niix is False:
+        try:
+            niftiImg = convertDicomImgToNiftiInMemory(dicomImg)
+            if validate is True:
+                dcm2niixImg = convertDicomImgToNiftiDcm2niix(dicomImg, dicomFilename)
+                compareNiftiConversions(niftiImg, dcm2niixImg)
+            return niftiImg
+        except NotImplementedError as err:
+            logging.debug(f"Converting with dcm2niix: {err}")
+    return convertDicomImgToNiftiDcm2niix(dicomImg, dicomFilename)
+
+
+def convertDicomImgsToNifti(dicomImgs):
     '''
-    Given an in-memory dicomImg, convert it to an in-memory niftiImg. 
-    Note: due to how nibabel niftiImage works, it is just a pointer to a file
-    on disk, so we can't delete the niftiFile while niftiImage is in use.
+    Convert a list of in-memory Dicom images, i.e. a backlog of volumes, to in-memory
+    Nifti images. The images that can't be converted in memory are queued together
+    on the shared conversion pool so their dcm2niix conversions run in parallel.
+
+    Returns:
+        The list of nibabel Nifti1Images, in the order of dicomImgs
+    '''
+    from concurrent.futures import Future
+    from rtCommon.conversionPool import getConversionPool
+    niftiImgs = []
+    for dicomImg in dicomImgs:
+        try:
+            niftiImgs.append(convertDicomImgToNiftiInMemory(dicomImg))
+        except NotImplementedError as err:
+            logging.debug(f"Converting with dcm2niix: {err}")
+            niftiImgs.append(getConversionPool().submit(dicomImg))
+    return [img.result() if isinstance(img, Future) else img for img in niftiImgs]
+
+
+def convertDicomImgToNiftiDcm2niix(dicomImg, dicomFilename=None):
+    '''
+    Given an in-memory dicomImg, convert it to an in-memory niftiImg using dcm2niix.
+    Unless a dicomFilename is given the conversion is run by the shared conversion
+    pool (see rtCommon.conversionPool), using tmpfs scratch files.
     '''
     if dicomFilename is None:
-        dicomFilename = os.path.join('/tmp', 'tmp_nifti_' + uuid.uuid4().hex + '.dcm')
+        from rtCommon.conversionPool import getConversionPool
+        return getConversionPool().convert(dicomImg)
     writeDicomFile(dicomImg, dicomFilename)
     # swap .dcm extension with .nii extension
     base, ext = os.path.splitext(dicomFilename)
@@ -374,3 +799,187 @@ def convertDicomImgToNifti(dicomImg, dicomFilename=None):
     os.remove(dicomFilename)
     os.remove(niftiFilename)
     return niftiImg
+
+
+def importCsaReader():
+    """Imports nibabel.nicom.csareader, which emits a pydicom UserWarning. Used internally."""
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", category=UserWarning)
+        from nibabel.nicom import csareader
+    return csareader
+
+
+def getSliceTimingCode(sliceTimes) -> int:
+    """
+    Returns the NIfTI slice_code for the slice acquisition times (i.e. from the
+    Siemens MosaicRefAcqTimes), or 0 (unknown) if the order isn't a standard one.
+    """
+    numSlices = len(sliceTimes)
+    if numSlices < 2:
+        return 0
+    order = list(np.argsort(sliceTimes, kind='stable'))
+    evens = list(range(0, numSlices, 2))
+    odds = list(range(1, numSlices, 2))
+    patterns = {
+        1: list(range(numSlices)),  # sequential increasing
+        2: list(reversed(range(numSlices))),  # sequential decreasing
+        3: evens + odds,  # alternating increasing
+        4: list(reversed(range(numSlices)))[0::2] + list(reversed(range(numSlices)))[1::2],  # alt decreasing
+        5: odds + evens,  # alternating increasing, starting at the 2nd slice
+        6: list(reversed(range(numSlices)))[1::2] + list(reversed(range(numSlices)))[0::2],  # alt decreasing 2
+    }
+    for code, pattern in patterns.items():
+        if order == pattern:
+            return code
+    return 0
+
+
+def convertDicomImgToNiftiInMemory(dicomImg) -> nib.Nifti1Image:
+    """
+    Converts a Siemens mosaic or single-frame EPI Dicom image to a Nifti image without
+    writing any files or running dcm2niix. The voxel data and affine match the dcm2niix
+    conversion: the volume is in Dicom column, flipped row, slice order and the affine
+    maps it to RAS+ scanner coordinates, computed from ImageOrientationPatient,
+    ImagePositionPatient, PixelSpacing and the slice normal.
+
+    Args:
+        dicomImg: The pydicom image to convert
+    Returns:
+        The nibabel Nifti1Image, with the TR, units, dim_info, slice code and
+        scaling set in the header
+    Raises:
+        NotImplementedError: if the image type isn't supported (i.e. multi-frame or
+            compressed pixel data)
+    """
+    for field in ('ImageOrientationPatient', 'ImagePositionPatient', 'PixelSpacing'):
+        if field not in dicomImg:
+            raise NotImplementedError(f"In-memory Nifti conversion: Dicom has no {field}")
+    # compressed pixel data is left to dcm2niix, pydicom may not have a decoder for it
+    transferSyntax = getattr(dicomImg, 'file_meta', {}).get('TransferSyntaxUID')
+    if transferSyntax is not None and transferSyntax.is_compressed:
+        raise NotImplementedError(f"In-memory Nifti conversion: compressed transfer "
+                                  f"syntax {transferSyntax.name}")
+    try:
+        pixels = dicomImg.pixel_array
+    except Exception as err:
+        raise NotImplementedError(f"In-memory Nifti conversion: can't decode the pixel "
+                                  f"data: {err}") from err
+    if pixels.ndim != 2:
+        raise NotImplementedError("In-memory Nifti conversion: multi-frame Dicom not supported")
+    iop = np.array(dicomImg.ImageOrientationPatient, dtype=np.float64)
+    rowCosine, colCosine = iop[:3], iop[3:]
+    # PixelSpacing is [spacing between rows, spacing between columns]
+    rowSpacing, colSpacing = [float(val) for val in dicomImg.PixelSpacing]
+    position = np.array(dicomImg.ImagePositionPatient, dtype=np.float64)
+    sliceSpacing = dicomImg.get('SpacingBetweenSlices', dicomImg.get('SliceThickness', 1.0))
+    sliceSpacing = float(sliceSpacing)
+    numRows, numCols = pixels.shape
+
+    csaHeader = None
+    if dicomImg.get('Manufacturer', '').upper().startswith('SIEMENS'):
+        csareader = importCsaReader()
+        try:
+            csaHeader = csareader.get_csa_header(dicomImg, 'image')
+        except Exception as err:
+            logging.debug(f"In-memory Nifti conversion: no CSA header: {err}")
+    sliceNormal = None
+    if csaHeader is not None:
+        sliceNormal = csareader.get_slice_normal(csaHeader)
+    if sliceNormal is None:
+        sliceNormal = np.cross(rowCosine, colCosine)
+    sliceNormal = np.array(sliceNormal, dtype=np.float64)
+
+    isMosaic = 'MOSAIC' in [val.upper() for val in dicomImg.get('ImageType', [])]
+    sliceTimes = None
+    if isMosaic:
+        numSlices = None
+        if csaHeader is not None:
+            numSlices = csareader.get_n_mosaic(csaHeader)
+        if numSlices is None and (0x0019, 0x100a) in dicomImg:
+            numSlices = int(dicomImg[0x0019, 0x100a].value)
+        if numSlices is None:
+            raise NotImplementedError("In-memory Nifti conversion: mosaic with unknown number of slices")
+        mosaicSize = int(np.ceil(np.sqrt(numSlices)))
+        sliceRows, sliceCols = numRows // mosaicSize, numCols // mosaicSize
+        # tiles are row-major in the mosaic, in slice order
+        tiles = pixels[:mosaicSize * sliceRows, :mosaicSize * sliceCols]
+        tiles = tiles.reshape(mosaicSize, sliceRows, mosaicSize, sliceCols)
+        tiles = tiles.transpose(0, 2, 1, 3).reshape(mosaicSize * mosaicSize, sliceRows, sliceCols)
+        tiles = tiles[:numSlices]
+        # ImagePositionPatient is for the top left of the whole mosaic, move it to the first tile
+        position = (position + colCosine * rowSpacing * (numRows - sliceRows) / 2
+                    + rowCosine * colSpacing * (numCols - sliceCols) / 2)
+        if csaHeader is not None:
+            sliceTimes = csareader.get_vector(csaHeader, 'MosaicRefAcqTimes', numSlices)
+    else:
+        sliceRows, sliceCols = numRows, numCols
+        tiles = pixels[np.newaxis, :, :]
+
+    # voxel [i, j, k] is column i of row (sliceRows - 1 - j) of slice k, as dcm2niix orders it
+    volume = np.ascontiguousarray(tiles.transpose(2, 1, 0)[:, ::-1, :])
+    if volume.dtype == np.uint16 and int(dicomImg.get('BitsStored', 16)) < 16:
+        volume = volume.astype(np.int16)
+
+    affine = np.eye(4)
+    affine[:3, 0] = rowCosine * colSpacing
+    affine[:3, 1] = -colCosine * rowSpacing
+    affine[:3, 2] = sliceNormal * sliceSpacing
+    affine[:3, 3] = position + colCosine * rowSpacing * (sliceRows - 1)
+    # Dicom patient coordinates are LPS+, Nifti are RAS+
+    affine = np.diag([-1, -1, 1, 1]) @ affine
+
+    niftiImg = nib.Nifti1Image(volume, affine)
+    header = niftiImg.header
+    header.set_qform(affine, code=1)
+    header.set_sform(affine, code=1)
+    header.set_xyzt_units(xyz='mm', t='sec')
+    pixdim = header['pixdim']
+    pixdim[1:4] = [colSpacing, rowSpacing, sliceSpacing]
+    pixdim[5:] = 0
+    repetitionTime = dicomImg.get('RepetitionTime')
+    if repetitionTime is not None:
+        pixdim[4] = float(repetitionTime) / 1000
+    header['pixdim'] = pixdim
+    if dicomImg.get('InPlanePhaseEncodingDirection', '') == 'ROW':
+        header.set_dim_info(freq=1, phase=0, slice=2)
+    else:
+        header.set_dim_info(freq=0, phase=1, slice=2)
+    if sliceTimes is not None:
+        header['slice_code'] = getSliceTimingCode(sliceTimes)
+    slope = dicomImg.get('RescaleSlope')
+    intercept = dicomImg.get('RescaleIntercept')
+    if slope is not None or intercept is not None:
+        slope = 1.0 if slope is None else float(slope)
+        intercept = 0.0 if intercept is None else float(intercept)
+        if slope != 1.0 or intercept != 0.0:
+            header.set_slope_inter(slope, intercept)
+    descrip = []
+    if 'EchoTime' in dicomImg:
+        descrip.append(f'TE={float(dicomImg.EchoTime):g}')
+    if 'AcquisitionTime' in dicomImg:
+        descrip.append(f'Time={float(dicomImg.AcquisitionTime):.3f}')
+    if csaHeader is not None:
+        phasePositive = csareader.get_scalar(csaHeader, 'PhaseEncodingDirectionPositive')
+        if phasePositive is not None:
+            descrip.append(f'phase={int(phasePositive)}')
+    header['descrip'] = ';'.join(descrip)
+    header['regular'] = b'r'
+    return niftiImg
+
+
+def compareNiftiConversions(niftiImg, referenceImg, atol=1e-4) -> None:
+    """
+    Checks that an in-memory Nifti conversion matches the dcm2niix conversion of the
+    same Dicom: the voxel data must be equal and the affines equal within atol mm.
+    Raises ValidationError if they don't match.
+    """
+    data = np.asanyarray(niftiImg.dataobj)
+    refData = np.asanyarray(referenceImg.dataobj)
+    if data.shape != refData.shape:
+        raise ValidationError(f"Nifti conversion shape {data.shape} doesn't match "
+                              f"dcm2niix shape {refData.shape}")
+    if not np.array_equal(data, refData):
+        raise ValidationError("Nifti conversion voxel data doesn't match dcm2niix")
+    if not np.allclose(niftiImg.affine, referenceImg.affine, rtol=0, atol=atol):
+        raise ValidationError("Nifti conversion affine doesn't match dcm2niix\n"
+                              f"{niftiImg.affine}\n{referenceImg.affine}")
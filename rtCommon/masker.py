@@ -0,0 +1,171 @@
+"""
+Masker extracts region of interest (ROI) values from brain volumes.
+
+The masks are loaded once and stored as flat voxel indices (and optionally weights),
+so the ROIs of each new volume are extracted with a single vectorized gather over the
+voxels of all the masks, then reduced per ROI (mean, sum, max, min):
+
+    masker = Masker({'ffa': 'ffa_mask.nii', 'ppa': 'ppa_mask.nii'})
+    roiMeans = masker.extract(volumeData)           # array of one value per ROI
+    roiValues = masker.extractDict(volumeData)      # {'ffa': value, 'ppa': value}
+
+A masker can also be given to the scanner-side DataInterface (setStreamMasker with
+masker.getSpec()), so only the ROI values rather than the whole volumes are sent over
+the network (see DataInterface.getImageRois).
+"""
+import numpy as np
+import nibabel as nib
+from typing import Union
+from rtCommon.errors import ValidationError, InvocationError
+
+# Reductions supported by extract(), computed per ROI with ufunc.reduceat
+roiReductions = ('mean', 'sum', 'max', 'min', None)
+
+
+class Masker:
+    """Extracts the values of one or more ROIs from volumes with precomputed indices."""
+    def __init__(self, masks: Union[dict, list, 'np.ndarray', 'nib.Nifti1Image', str],
+                 weighted: bool=False, threshold: float=0):
+        """
+        Args:
+            masks: A dict of ROI name to mask, a list of masks (named 'roi0', 'roi1' ...)
+                or a single mask. Each mask is a Nifti image, a Nifti filename or a 3D array,
+                all masks must have the same shape.
+            weighted: Use the mask values as voxel weights (i.e. probabilistic masks),
+                the 'mean' is then the weighted mean. Otherwise voxels with a mask
+                value above threshold are in the ROI.
+            threshold: Mask values above this are part of the ROI
+        """
+        if not isinstance(masks, (dict, list, tuple)):
+            masks = [masks]
+        if not isinstance(masks, dict):
+            masks = {f'roi{i}': mask for i, mask in enumerate(masks)}
+        if len(masks) == 0:
+            raise InvocationError("Masker: no masks given")
+        self.roiNames = list(masks.keys())
+        self.volumeShape = None
+        self.affine = None
+        roiIndices = []
+        roiWeights = []
+        for name, mask in masks.items():
+            maskData, affine = self._loadMask(mask)
+            if self.volumeShape is None:
+                self.volumeShape = maskData.shape
+                self.affine = affine
+            elif maskData.shape != self.volumeShape:
+                raise ValidationError(f"Masker: mask {name} shape {maskData.shape} doesn't "
+                                      f"match {self.volumeShape}")
+            # flat indices in C order of the volume
+            flatMask = maskData.ravel()
+            indices = np.flatnonzero(flatMask > threshold)
+            if len(indices) == 0:
+                raise ValidationError(f"Masker: mask {name} has no voxels")
+            roiIndices.append(indices)
+            if weighted:
+                roiWeights.append(flatMask[indices])
+        self._setIndices(roiIndices, roiWeights if weighted else None)
+
+    def _setIndices(self, roiIndices, roiWeights):
+        self.roiSizes = np.array([len(indices) for indices in roiIndices])
+        # the voxels of all ROIs concatenated, with the start offset of each ROI
+        self.flatIndices = np.concatenate(roiIndices).astype(np.int32)
+        self.roiOffsets = np.concatenate(([0], np.cumsum(self.roiSizes)[:-1]))
+        self.weights = None
+        self.weightSums = None
+        if roiWeights is not None:
+            self.weights = np.concatenate(roiWeights).astype(np.float32)
+            self.weightSums = np.add.reduceat(self.weights, self.roiOffsets)
+        # index tuple for gathering from a volume in any memory order
+        self.voxelCoords = np.unravel_index(self.flatIndices, self.volumeShape)
+
+    @staticmethod
+    def _loadMask(mask):
+        if isinstance(mask, str):
+            mask = nib.load(mask)
+        if isinstance(mask, (nib.Nifti1Image, nib.Nifti2Image)):
+            return np.asanyarray(mask.dataobj), mask.affine
+        return np.asanyarray(mask), None
+
+    @property
+    def numRois(self) -> int:
+        return len(self.roiNames)
+
+    def getSpec(self) -> dict:
+        """
+        Returns the masker as a dict of python types (json serializable), for
+        creating the same masker elsewhere with Masker.fromSpec()
+        """
+        spec = {
+            'roiNames': self.roiNames,
+            'volumeShape': list(self.volumeShape),
+            'roiIndices': [indices.tolist() for indices in self._splitRois(self.flatIndices)],
+            'roiWeights': None,
+            'affine': None if self.affine is None else self.affine.tolist(),
+        }
+        if self.weights is not None:
+            spec['roiWeights'] = [weights.tolist() for weights in self._splitRois(self.weights)]
+        return spec
+
+    @classmethod
+    def fromSpec(cls, spec: dict) -> 'Masker':
+        """Creates a masker from a getSpec() dict"""
+        masker = cls.__new__(cls)
+        masker.roiNames = list(spec['roiNames'])
+        masker.volumeShape = tuple(spec['volumeShape'])
+        masker.affine = None if spec.get('affine') is None else np.array(spec['affine'])
+        roiIndices = [np.array(indices, dtype=np.int64) for indices in spec['roiIndices']]
+        roiWeights = spec.get('roiWeights')
+        if roiWeights is not None:
+            roiWeights = [np.array(weights, dtype=np.float32) for weights in roiWeights]
+        masker._setIndices(roiIndices, roiWeights)
+        return masker
+
+    def _splitRois(self, values):
+        return np.split(values, self.roiOffsets[1:])
+
+    def extract(self, volume, reduce: str='mean', out=None):
+        """
+        Extracts the ROI values of a volume, or of a 4D array of volumes.
+
+        Args:
+            volume: A 3D volume of the mask shape, a Nifti image or a 4D array with
+                the volume index last
+            reduce: 'mean', 'sum', 'max', 'min' of each ROI's voxels, or None
+                for the voxel values
+            out: Optional array for the reduced values
+        Returns:
+            For a reduction, an array of shape (numRois,), or (numRois, numVolumes)
+            for 4D data. For reduce=None, a list with each ROI's voxel values.
+        """
+        if reduce not in roiReductions:
+            raise InvocationError(f"Masker: reduce must be one of {roiReductions}: {reduce}")
+        if isinstance(volume, (nib.Nifti1Image, nib.Nifti2Image)):
+            if self.affine is not None and not np.allclose(volume.affine, self.affine, atol=1e-3):
+                raise ValidationError("Masker: the image affine doesn't match the mask affine")
+            volume = np.asanyarray(volume.dataobj)
+        if volume.shape[:3] != tuple(self.volumeShape):
+            raise ValidationError(f"Masker: volume shape {volume.shape} doesn't match the "
+                                  f"mask shape {self.volumeShape}")
+        # one gather for the voxels of all ROIs
+        voxels = volume[self.voxelCoords]
+        if reduce is None:
+            return self._splitRois(voxels)
+        if reduce in ('max', 'min'):
+            ufunc = np.maximum if reduce == 'max' else np.minimum
+            return ufunc.reduceat(voxels, self.roiOffsets, axis=0, out=out)
+        if self.weights is not None:
+            weights = self.weights.reshape((-1,) + (1,) * (voxels.ndim - 1))
+            voxels = voxels * weights
+        elif voxels.dtype.kind in 'iub':
+            # sum integer data in float64 to avoid overflow
+            voxels = voxels.astype(np.float64)
+        sums = np.add.reduceat(voxels, self.roiOffsets, axis=0, out=out)
+        if reduce == 'mean':
+            counts = self.weightSums if self.weights is not None else self.roiSizes
+            sums /= counts.reshape((-1,) + (1,) * (sums.ndim - 1))
+        return sums
+
+    def extractDict(self, volume, reduce: str='mean') -> dict:
+        """Same as extract() but returns a dict of ROI name to the ROI's value(s)"""
+        values = self.extract(volume, reduce=reduce)
+        return {name: value for name, value in zip(self.roiNames, values)}
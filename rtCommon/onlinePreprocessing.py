@@ -0,0 +1,167 @@
+"""
+Online (per-TR) preprocessing of streamed brain volumes.
+
+Real-time analyses usually z-score and detrend each voxel's time series over the run so
+far. Recomputing those over all previous volumes on each TR costs O(TRs) per TR. The
+stages here keep running per-voxel state instead, so each new volume is processed in
+O(voxels) time:
+
+    RunningStats         - per-voxel mean and variance with Welford updates, z-scoring
+    IncrementalDetrend   - least squares linear or polynomial trend fit, updated per volume
+    ExponentialBaseline  - exponential moving average baseline subtraction
+
+OnlinePreprocessor chains the enabled stages. It can be attached to a BidsInterface
+stream (BidsInterface.setStreamPreprocessing), then getPreprocessedIncremental()
+returns the processed arrays with each BidsIncremental.
+"""
+import numpy as np
+from rtCommon.errors import InvocationError, ValidationError
+
+
+class RunningStats:
+    """Per-voxel running mean and variance, updated with Welford's algorithm."""
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        # sum of squared differences from the mean
+        self.m2 = None
+
+    def update(self, volume) -> None:
+        """Add a volume to the statistics"""
+        volume = np.asarray(volume, dtype=np.float64)
+        if self.mean is None:
+            self.mean = np.zeros(volume.shape)
+            self.m2 = np.zeros(volume.shape)
+        elif volume.shape != self.mean.shape:
+            raise ValidationError(f"RunningStats: volume shape {volume.shape} doesn't "
+                                  f"match {self.mean.shape}")
+        self.count += 1
+        delta = volume - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (volume - self.mean)
+
+    def getVariance(self, ddof: int=1):
+        """Returns the per-voxel variance (sample variance with ddof=1)"""
+        if self.count <= ddof:
+            return np.zeros_like(self.mean)
+        return self.m2 / (self.count - ddof)
+
+    def getStd(self, ddof: int=1):
+        """Returns the per-voxel standard deviation"""
+        return np.sqrt(self.getVariance(ddof))
+
+    def zscore(self, volume, ddof: int=1):
+        """Returns the volume z-scored with the current statistics, 0 where the std is 0"""
+        std = self.getStd(ddof)
+        zscored = np.zeros(std.shape)
+        np.divide(np.asarray(volume, dtype=np.float64) - self.mean, std, out=zscored,
+                  where=std > 0)
+        return zscored
+
+
+class IncrementalDetrend:
+    """
+    Removes a per-voxel polynomial trend (linear for order=1) fit by least squares to
+    the volumes so far. The normal equations are updated with each new volume, the
+    (order+1) x (order+1) system is shared by all voxels and solved once per volume.
+    """
+    def __init__(self, order: int=1, timeScale: float=100):
+        """
+        Args:
+            order: Polynomial order of the trend, 0 removes the mean, 1 a linear trend
+            timeScale: Number of volumes that is one time unit in the polynomial,
+                keeps the normal equations well conditioned for higher orders
+        """
+        if order < 0:
+            raise InvocationError(f"IncrementalDetrend: order must be >= 0: {order}")
+        self.order = order
+        self.timeScale = timeScale
+        self.count = 0
+        self.xtx = np.zeros((order + 1, order + 1))
+        # per-voxel X'y, of shape (order + 1, numVoxels)
+        self.xty = None
+        self.volumeShape = None
+
+    def _regressors(self, volIdx):
+        return (volIdx / self.timeScale) ** np.arange(self.order + 1)
+
+    def update(self, volume):
+        """Add a volume to the trend fit and return it detrended"""
+        volume = np.asarray(volume, dtype=np.float64)
+        if self.xty is None:
+            self.volumeShape = volume.shape
+            self.xty = np.zeros((self.order + 1, volume.size))
+        elif volume.shape != self.volumeShape:
+            raise ValidationError(f"IncrementalDetrend: volume shape {volume.shape} doesn't "
+                                  f"match {self.volumeShape}")
+        x = self._regressors(self.count)
+        self.count += 1
+        flatVolume = volume.reshape(-1)
+        self.xtx += np.outer(x, x)
+        self.xty += x[:, np.newaxis] * flatVolume
+        # until there are enough volumes for the full polynomial fit a lower order
+        numTerms = min(self.count, self.order + 1)
+        betas = np.linalg.solve(self.xtx[:numTerms, :numTerms], self.xty[:numTerms])
+        trend = x[:numTerms] @ betas
+        return (flatVolume - trend).reshape(self.volumeShape)
+
+
+class ExponentialBaseline:
+    """Subtracts an exponential moving average baseline, updated with each volume."""
+    def __init__(self, alpha: float=0.1):
+        """
+        Args:
+            alpha: Weight of the newest volume in the moving average, between 0 and 1
+        """
+        if not 0 < alpha <= 1:
+            raise InvocationError(f"ExponentialBaseline: alpha must be in (0, 1]: {alpha}")
+        self.alpha = alpha
+        self.baseline = None
+
+    def update(self, volume):
+        """Returns the volume minus the baseline of the previous volumes, then updates it"""
+        volume = np.asarray(volume, dtype=np.float64)
+        if self.baseline is None:
+            self.baseline = volume.copy()
+        result = volume - self.baseline
+        self.baseline += self.alpha * result
+        return result
+
+
+class OnlinePreprocessor:
+    """
+    Chains the online preprocessing stages: detrending, then exponential baseline
+    subtraction, then z-scoring with the running statistics (including this volume).
+    """
+    def __init__(self, detrendOrder: int=None, emaAlpha: float=None, zscore: bool=False):
+        """
+        Args:
+            detrendOrder: Polynomial order for IncrementalDetrend, None for no detrending
+            emaAlpha: Alpha of the ExponentialBaseline, None for no baseline subtraction
+            zscore: Whether to z-score each voxel with its running mean and std
+        """
+        self.detrend = None if detrendOrder is None else IncrementalDetrend(detrendOrder)
+        self.baseline = None if emaAlpha is None else ExponentialBaseline(emaAlpha)
+        self.stats = RunningStats() if zscore else None
+        self.numVolumes = 0
+
+    def process(self, volume) -> dict:
+        """
+        Process the next volume of the run.
+
+        Returns:
+            A dict with the output of each enabled stage ('detrended', 'baselined',
+            'zscored') and 'processed', the output of the last stage
+        """
+        results = {}
+        processed = np.asarray(volume, dtype=np.float64)
+        if self.detrend is not None:
+            processed = results['detrended'] = self.detrend.update(processed)
+        if self.baseline is not None:
+            processed = results['baselined'] = self.baseline.update(processed)
+        if self.stats is not None:
+            self.stats.update(processed)
+            processed = results['zscored'] = self.stats.zscore(processed)
+        results['processed'] = processed
+        self.numVolumes += 1
+        return results
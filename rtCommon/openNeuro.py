@@ -4,12 +4,17 @@ and cache OpenNeuro data for playback.
 """
 import os
 import json
-import boto3
-from botocore.config import Config
-from botocore import UNSIGNED
 import rtCommon.utils as utils
 
 
+def newS3Client():
+    """Returns an unsigned s3 client, boto3 is imported on first use as it is slow to load"""
+    import boto3
+    from botocore.config import Config
+    from botocore import UNSIGNED
+    return boto3.client("s3", config=Config(signature_version=UNSIGNED))
+
+
 class OpenNeuroCache():
     def __init__(self, cachePath="/tmp/openneuro/"):
         self.cachePath = cachePath
@@ -26,7 +31,7 @@ class OpenNeuroCache():
         always creating a new one. Not thread safe currently.
         """
         if self.s3Client is None:
-            self.s3Client = boto3.client("s3", config=Config(signature_version=UNSIGNED))
+            self.s3Client = newS3Client()
         return self.s3Client
 
     def getDatasetList(self, refresh=False):
@@ -37,7 +42,7 @@ class OpenNeuroCache():
         [aws s3 --no-sign-request ls s3://openneuro.org/]
         """
         if self.datasetList is None or len(self.datasetList)==0 or refresh is True:
-            s3Client = boto3.client("s3", config=Config(signature_version=UNSIGNED))
+            s3Client = newS3Client()
             all_datasets = s3Client.list_objects(Bucket='openneuro.org', Delimiter="/")
             self.datasetList = []
             for dataset in all_datasets.get('CommonPrefixes'):
@@ -65,7 +70,7 @@ class OpenNeuroCache():
         """
         if not self.isValidAccessionNumber(dsAccessionNum):
             return None
-        s3 = boto3.client("s3", config=Config(signature_version=UNSIGNED))
+        s3 = newS3Client()
         prefix = dsAccessionNum + '/sub-'
         dsSubjDirs = s3.list_objects(Bucket='openneuro.org', Delimiter="/", Prefix=prefix)
         subjects = []
@@ -33,12 +33,17 @@ class ProjectServer:
             args.subjectRemote = False
         if not hasattr(args, 'port') or args.port is None:
             args.port = 8888
+        if not hasattr(args, 'warmPool') or args.warmPool is None:
+            args.warmPool = 0
+        if not hasattr(args, 'sessionInstances') or args.sessionInstances is None:
+            args.sessionInstances = False
         self.args = args
         self.params = StructDict(
             {'mainScript': args.mainScript,
              'initScript': args.initScript,
              'finalizeScript': args.finalizeScript,
              'port' : args.port,
+             'warmPoolSize': args.warmPool,
             })
         self.web = None
         print(f'## Settings: dataRemote:{self.args.dataRemote}, subjectRemote:{self.args.subjectRemote}')
@@ -84,7 +89,8 @@ class ProjectServer:
         # Start the rpyc RPC server that the client script connects to
         rpcService = ProjectRPCService(dataRemote=self.args.dataRemote,
                                        subjectRemote=self.args.subjectRemote,
-                                       webUI=Web.webDisplayInterface)
+                                       webUI=Web.webDisplayInterface,
+                                       sessionInstances=self.args.sessionInstances)
         if self.args.dataRemote:
             rpcService.registerDataCommFunction(rpcHandlers.dataRequest)
         if self.args.subjectRemote:
@@ -119,6 +125,12 @@ if __name__ == "__main__":
                            help='user remote services for both data and subject interface')
     argParser.add_argument('--port', default=8888, type=int,
                            help='Network port that the projectServer will listen for requests on')
+    argParser.add_argument('--warmPool', default=0, type=int,
+                           help='Number of pre-started python interpreters to keep ready '
+                                'for running the project scripts (0 to disable)')
+    argParser.add_argument('--sessionInstances', default=False, action='store_true',
+                           help='give each connected script its own data interfaces so that '
+                                'multiple scripts can stream data concurrently')
     argParser.add_argument('--test', '-t', default=False, action='store_true',
                            help='start webServer in test mode, unsecure')
     args = argParser.parse_args()
@@ -5,6 +5,7 @@ When using remote services RPC calls traverse two links, client --> rpyc server
 """
 import rpyc
 import json
+import uuid
 import pickle
 import logging
 from rpyc.utils.server import ThreadedServer
@@ -29,30 +30,34 @@ class ProjectRPCService(rpyc.Service):
     exposed_BidsInterface = None
     exposed_WebDisplayInterface = None
     exposed_ExampleInterface = None
+    dataCommFunction = None
 
-    def __init__(self, dataRemote=False, subjectRemote=False, webUI=None):
+    def __init__(self, dataRemote=False, subjectRemote=False, webUI=None, sessionInstances=False):
         """
         Args:
             dataRemote: whether file read/write requests will be handled directly by the projectServer
                 or forwarded over websocket RPC to a remote service.
             subjectRemote: whether subject send/receive feedback will be handled locally within projectServer
                 or forwarded over websocket RPC to a remote service.
+            sessionInstances: whether each client connection gets its own data interfaces
+                (see ProjectRPCSession) rather than all clients sharing one set.
         """
         self.dataRemote = dataRemote
         self.subjectRemote = subjectRemote
-        allowedDirs = None
-        allowedFileTypes = None
+        self.sessionInstances = sessionInstances
+        self.allowedDirs = None
+        self.allowedFileTypes = None
         if dataRemote is False:
             # Allow all file types and directories for local filesystem access
-            allowedDirs=['*']
-            allowedFileTypes=['*']
+            self.allowedDirs=['*']
+            self.allowedFileTypes=['*']
 
         # Instantiate the client service instances
         ProjectRPCService.exposed_DataInterface = DataInterface(dataRemote=dataRemote,
-                                                                allowedDirs=allowedDirs,
-                                                                allowedFileTypes=allowedFileTypes)
+                                                                allowedDirs=self.allowedDirs,
+                                                                allowedFileTypes=self.allowedFileTypes)
         ProjectRPCService.exposed_BidsInterface = BidsInterface(dataRemote=dataRemote,
-                                                                allowedDirs=allowedDirs)
+                                                                allowedDirs=self.allowedDirs)
         ProjectRPCService.exposed_SubjectInterface = SubjectInterface(subjectRemote=subjectRemote)
         ProjectRPCService.exposed_WebDisplayInterface = webUI
         ProjectRPCService.exposed_ExampleInterface = ExampleInterface(dataRemote=dataRemote)
@@ -72,6 +77,7 @@ class ProjectRPCService(rpyc.Service):
         if (ProjectRPCService.exposed_DataInterface is None and
             ProjectRPCService.exposed_BidsInterface is None):
             raise StateError("ServerRPC no dataInterface instatiated yet")
+        ProjectRPCService.dataCommFunction = commFunction
         if ProjectRPCService.exposed_DataInterface is not None:
             ProjectRPCService.exposed_DataInterface.registerCommFunction(commFunction)
         if ProjectRPCService.exposed_BidsInterface is not None:
@@ -96,6 +102,60 @@ class ProjectRPCService(rpyc.Service):
         pass
 
 
+class ProjectRPCSession(rpyc.Service):
+    """
+    Per-connection RPC service, used when the ProjectRPCService has sessionInstances set.
+    Each experimenter script connection gets its own DataInterface, BidsInterface and
+    ExampleInterface so that concurrent scripts (i.e. a live analysis and a QA monitor)
+    don't overwrite each other's stream state. For remote data the requests are tagged
+    with the session's id so the remote service also uses a separate instance per session.
+    The SubjectInterface and WebDisplayInterface are shared by all sessions.
+    """
+    def __init__(self, projectService):
+        self.projectService = projectService
+        self.sessionId = uuid.uuid4().hex
+        dataRemote = projectService.dataRemote
+        self.exposed_DataInterface = DataInterface(dataRemote=dataRemote,
+                                                   allowedDirs=projectService.allowedDirs,
+                                                   allowedFileTypes=projectService.allowedFileTypes)
+        self.exposed_BidsInterface = BidsInterface(dataRemote=dataRemote,
+                                                   allowedDirs=projectService.allowedDirs)
+        self.exposed_ExampleInterface = ExampleInterface(dataRemote=dataRemote)
+        self.exposed_SubjectInterface = ProjectRPCService.exposed_SubjectInterface
+        self.exposed_WebDisplayInterface = ProjectRPCService.exposed_WebDisplayInterface
+        if dataRemote is True:
+            for interface in (self.exposed_DataInterface, self.exposed_BidsInterface,
+                              self.exposed_ExampleInterface):
+                interface.registerCommFunction(ProjectRPCService.dataCommFunction)
+                interface.setSessionId(self.sessionId)
+
+    def exposed_isDataRemote(self):
+        return self.projectService.dataRemote
+
+    def exposed_isSubjectRemote(self):
+        return self.projectService.subjectRemote
+
+    def on_connect(self, conn):
+        logging.info(f'ProjectRPCSession: started session {self.sessionId}')
+
+    def on_disconnect(self, conn):
+        # Let the remote service release the instances it created for this session
+        commFunction = ProjectRPCService.dataCommFunction
+        if self.projectService.dataRemote is True and commFunction is not None:
+            try:
+                commFunction({'cmd': 'closeSession', 'sessionId': self.sessionId}, timeout=5)
+            except Exception as err:
+                logging.info(f'ProjectRPCSession: closeSession {self.sessionId}: {err}')
+        elif self.projectService.dataRemote is False:
+            # The session's interfaces serve the data locally, release their streams
+            for interface in (self.exposed_DataInterface, self.exposed_BidsInterface):
+                if interface is not None:
+                    interface.close()
+        self.exposed_DataInterface = None
+        self.exposed_BidsInterface = None
+        self.exposed_ExampleInterface = None
+
+
 def startRPCThread(rpcService, hostname=None, port=12345):
     """
     This function starts the Project RPC server for communication between
@@ -111,8 +171,12 @@ def startRPCThread(rpcService, hostname=None, port=12345):
     # For non-shared case
     #   serviceWithArgs = classpartial(ProjectRPCService, dataRemote=dataRemote)
     #   rpcService = ProjectRPCService(dataRemote, dataCommFunc)
-    # Note: Currently we use a shared instance
-    threadId = ThreadedServer(rpcService, hostname=hostname, port=port,
+    # Note: We use a shared instance unless sessionInstances is set, then each client
+    #   connection gets a ProjectRPCSession with its own data interfaces.
+    service = rpcService
+    if getattr(rpcService, 'sessionInstances', False) is True:
+        service = classpartial(ProjectRPCSession, rpcService)
+    threadId = ThreadedServer(service, hostname=hostname, port=port,
                               protocol_config={
                                   "allow_public_attrs": True,
                                   "safe_attrs": safe_attrs,
@@ -184,16 +248,26 @@ class RPCHandlers:
             self.setError('SubjectRequest: ' + format(err))
             raise err;
 
-    def close_pending_requests(self, channelName):
+    def close_pending_requests(self, channelName, conn):
         """Close out all pending RPC requests when a connection is disconnected"""
         handler = self.handlers.get(channelName)
         if handler is None:
             raise StateError(f'RPC Handler {channelName} not registered')
         try:
-            handler.close_pending_requests()
+            handler.close_pending_requests(conn)
         except Exception as err:
             self.setError('close_pending_requests: ' + format(err))
 
+    def resume_pending_requests(self, channelName, conn):
+        """Re-send pending RPC requests when a remote service reconnects with its sessionId"""
+        handler = self.handlers.get(channelName)
+        if handler is None:
+            raise StateError(f'RPC Handler {channelName} not registered')
+        try:
+            handler.resume_pending_requests(conn)
+        except Exception as err:
+            self.setError('resume_pending_requests: ' + format(err))
+
     def setError(self, errStr):
         """Set an error messsage in the user's browser window"""
         errStr = 'RPC Handler: ' + errStr
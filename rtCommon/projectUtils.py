@@ -11,9 +11,7 @@ import requests
 import threading
 from pathlib import Path
 import rtCommon.utils as utils
-from rtCommon.imageHandling import readDicomFromBuffer
 from rtCommon.certsUtils import getSslCertFilePath, certsDir
-from requests.packages.urllib3.contrib import pyopenssl
 
 
 def watchForExit():
@@ -53,6 +51,7 @@ def formatFileData(filename, data):
         result = utils.loadMatFileFromBuffer(data)
     elif fileExtension == '.dcm':
         # Dicom file format
+        from rtCommon.imageHandling import readDicomFromBuffer
         result = readDicomFromBuffer(data)
     else:
         result = data
@@ -96,6 +95,7 @@ def checkSSLCertAltName(certFilename, altName):
     """
     Check if altName is list as an alternate server name in the ssl certificate
     """
+    from requests.packages.urllib3.contrib import pyopenssl
     with open(certFilename, 'r') as fh:
         certData = fh.read()
     x509 = pyopenssl.OpenSSL.crypto.load_certificate(pyopenssl.OpenSSL.crypto.FILETYPE_PEM, certData)
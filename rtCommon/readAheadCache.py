@@ -0,0 +1,164 @@
+"""
+ReadAheadCache holds the contents of recently arrived files in memory.
+
+When the FileWatcher gets the close-write event for a new file, the file is queued to be
+read by a background thread, so by the time the experiment script asks for the volume
+(watchFile, getImageData, getFile) its data is usually already in memory. Entries are
+keyed by the file's realpath and are only returned if the file's mtime and size still
+match what was read, so a file that is rewritten (i.e. a Dicom that was still being
+written on the first read) is read again from disk.
+
+The cache is bounded by total bytes held, least recently used entries are evicted first.
+"""
+import os
+import threading
+import logging
+from queue import Queue
+from collections import OrderedDict
+from rtCommon.structDict import StructDict
+from rtCommon.utils import DebugLevels
+
+
+class ReadAheadCache:
+    """In-memory LRU cache of file data validated against the file's mtime and size."""
+    def __init__(self, maxBytes: int=256*2**20):
+        """
+        Args:
+            maxBytes: Max total size of the file data held in the cache,
+                zero disables caching (reads always go to disk).
+        """
+        self.maxBytes = maxBytes
+        self.numBytes = 0
+        self.lock = threading.Lock()
+        # map from realpath to StructDict(data, mtime, size)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.prefetches = 0
+        self.prefetchQueue = Queue()
+        # files queued but not yet read, so repeated events for a file are only read once
+        self.pendingPrefetch = set()
+        self.shouldExit = False
+        self.prefetchThread = None
+        if self.maxBytes > 0:
+            self.prefetchThread = threading.Thread(name='readAhead', target=self._prefetchLoop,
+                                                   daemon=True)
+            self.prefetchThread.start()
+
+    def __del__(self):
+        self.shutdown()
+
+    def shutdown(self):
+        """Stop the read-ahead thread and release the cached data."""
+        self.shouldExit = True
+        if self.prefetchThread is not None:
+            self.prefetchQueue.put(None)
+            self.prefetchThread = None
+        with self.lock:
+            self.entries.clear()
+            self.numBytes = 0
+
+    def readFile(self, filename: str) -> bytes:
+        """
+        Returns the file's data, from the cache if the cached copy is still current,
+        otherwise read from disk (and cached for later reads).
+
+        Args:
+            filename: Path of the file to read
+        Returns:
+            The file data
+        """
+        key = os.path.realpath(filename)
+        fileStat = os.stat(key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self._isCurrent(entry, fileStat):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry.data
+            self.misses += 1
+        return self._readAndStore(key)
+
+    def prefetch(self, filename: str, eventTime: float=None) -> None:
+        """
+        Queue a file to be read into the cache in the background. The signature matches
+        the FileWatcher arrival callback so it can be registered directly.
+        """
+        if self.maxBytes <= 0 or self.shouldExit:
+            return
+        key = os.path.realpath(filename)
+        with self.lock:
+            if key in self.pendingPrefetch:
+                return
+            self.pendingPrefetch.add(key)
+        self.prefetchQueue.put(key)
+
+    def invalidate(self, filename: str) -> None:
+        """Remove a file from the cache, i.e. when it is written through this service."""
+        key = os.path.realpath(filename)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.numBytes -= len(entry.data)
+
+    def getStats(self) -> dict:
+        """
+        Returns a dict with the cache hits, misses, hitRate, evictions, prefetches
+        (files read ahead), number of entries and bytes held.
+        """
+        with self.lock:
+            numReads = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': self.hits / numReads if numReads > 0 else 0.0,
+                'evictions': self.evictions,
+                'prefetches': self.prefetches,
+                'numEntries': len(self.entries),
+                'numBytes': self.numBytes,
+                'maxBytes': self.maxBytes,
+            }
+
+    def _isCurrent(self, entry, fileStat) -> bool:
+        return entry.mtime == fileStat.st_mtime_ns and entry.size == fileStat.st_size
+
+    def _readAndStore(self, key: str) -> bytes:
+        with open(key, 'rb') as fp:
+            fileStat = os.fstat(fp.fileno())
+            data = fp.read()
+        # Only cache data that is the complete file as of the stat, a file still being
+        #   written will fail the size check (or mismatch on the next read) and not be kept
+        if len(data) == fileStat.st_size:
+            self._store(key, StructDict({'data': data, 'mtime': fileStat.st_mtime_ns,
+                                         'size': fileStat.st_size}))
+        return data
+
+    def _store(self, key: str, entry) -> None:
+        if self.maxBytes <= 0 or len(entry.data) > self.maxBytes:
+            return
+        with self.lock:
+            prevEntry = self.entries.pop(key, None)
+            if prevEntry is not None:
+                self.numBytes -= len(prevEntry.data)
+            self.entries[key] = entry
+            self.numBytes += len(entry.data)
+            while self.numBytes > self.maxBytes:
+                _, oldEntry = self.entries.popitem(last=False)
+                self.numBytes -= len(oldEntry.data)
+                self.evictions += 1
+
+    def _prefetchLoop(self):
+        while not self.shouldExit:
+            key = self.prefetchQueue.get()
+            if key is None:
+                break
+            with self.lock:
+                self.pendingPrefetch.discard(key)
+            try:
+                self._readAndStore(key)
+                with self.lock:
+                    self.prefetches += 1
+            except OSError as err:
+                # the file may have been removed or renamed since the event
+                logging.log(DebugLevels.L6, f"ReadAheadCache: prefetch {key}: {err}")
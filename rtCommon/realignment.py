@@ -0,0 +1,248 @@
+"""
+Rigid-body (6 degrees of freedom) realignment of brain volumes to a reference volume.
+
+Realigning each incoming volume with an external tool costs seconds per TR. A
+RigidRealigner precomputes, once per run, a resolution pyramid of the reference
+volume along with its gradients and the Gauss-Newton Hessian at each level. Each new
+volume is then aligned with a few inverse compositional Gauss-Newton iterations per
+level (coarse to fine), each of which is one vectorized trilinear interpolation of
+the new volume at the reference voxels:
+
+    realigner = RigidRealigner(referenceImg)
+    realignedImg, motionParams = realigner.realignImage(niftiImg)
+
+The motion parameters are [transX, transY, transZ, rotX, rotY, rotZ], translations
+in mm and rotations in radians about the volume center, along the voxel axes of the
+volume. The rotation is applied as rotZ @ rotY @ rotX.
+"""
+import numpy as np
+import nibabel as nib
+from typing import TYPE_CHECKING
+from rtCommon.errors import ValidationError, InvocationError
+if TYPE_CHECKING:
+    from rtCommon.bidsIncremental import BidsIncremental
+
+# the BidsIncremental metadata field for the motion parameters
+motionParamsField = 'RealignmentParameters'
+
+
+def rigidMatrix(params) -> np.ndarray:
+    """Returns the 4x4 rigid transform of the [tx, ty, tz, rx, ry, rz] motion params"""
+    tx, ty, tz, rx, ry, rz = params
+    cx, sx = np.cos(rx), np.sin(rx)
+    cy, sy = np.cos(ry), np.sin(ry)
+    cz, sz = np.cos(rz), np.sin(rz)
+    rotX = np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+    rotY = np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+    rotZ = np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]])
+    matrix = np.eye(4)
+    matrix[:3, :3] = rotZ @ rotY @ rotX
+    matrix[:3, 3] = [tx, ty, tz]
+    return matrix
+
+
+def rigidParams(matrix) -> np.ndarray:
+    """Returns the [tx, ty, tz, rx, ry, rz] motion params of a 4x4 rigid transform"""
+    rotation = matrix[:3, :3]
+    ry = -np.arcsin(np.clip(rotation[2, 0], -1, 1))
+    rx = np.arctan2(rotation[2, 1], rotation[2, 2])
+    rz = np.arctan2(rotation[1, 0], rotation[0, 0])
+    return np.array([*matrix[:3, 3], rx, ry, rz])
+
+
+def downsample(volume):
+    """Halves the resolution of a volume by averaging 2x2x2 blocks"""
+    shape = [dim // 2 for dim in volume.shape]
+    cropped = volume[:shape[0] * 2, :shape[1] * 2, :shape[2] * 2]
+    blocks = cropped.reshape(shape[0], 2, shape[1], 2, shape[2], 2)
+    return blocks.mean(axis=(1, 3, 5))
+
+
+class _PyramidLevel:
+    """The reference volume at one resolution, with its precomputed Jacobian and Hessian"""
+    def __init__(self, reference, voxelSize, center, maskFraction, maxPoints):
+        self.shape = reference.shape
+        self.voxelSize = np.asarray(voxelSize, dtype=np.float64)
+        # the full resolution volume center in this level's voxel coordinates
+        self.center = center
+        # only the voxels inside the brain (roughly) carry the alignment signal
+        mask = reference > maskFraction * reference.mean()
+        voxels = np.array(np.nonzero(mask), dtype=np.float64)
+        if voxels.shape[1] > maxPoints:
+            step = int(np.ceil(voxels.shape[1] / maxPoints))
+            voxels = voxels[:, ::step]
+        if voxels.shape[1] < 6:
+            raise ValidationError("RigidRealigner: too few reference voxels to align")
+        self.voxels = voxels
+        self.values = reference[tuple(voxels.astype(np.int64))]
+        # the voxel positions in mm relative to the volume center
+        points = (voxels - self.center[:, np.newaxis]) * self.voxelSize[:, np.newaxis]
+        # reference gradients in intensity per mm
+        gradients = np.gradient(reference)
+        grad = np.array([gradients[axis][tuple(voxels.astype(np.int64))] / self.voxelSize[axis]
+                         for axis in range(3)])
+        x, y, z = points
+        gx, gy, gz = grad
+        # derivative of the reference w.r.t. each motion param at the identity
+        self.jacobian = np.stack([gx, gy, gz,
+                                  gz * y - gy * z,
+                                  gx * z - gz * x,
+                                  gy * x - gx * y], axis=1)
+        self.hessian = self.jacobian.T @ self.jacobian
+        self.points = points
+
+    def warpPoints(self, matrix):
+        """Voxel coordinates in the moving volume of the reference points"""
+        moved = matrix[:3, :3] @ self.points + matrix[:3, 3:4]
+        return moved / self.voxelSize[:, np.newaxis] + self.center[:, np.newaxis]
+
+
+class RigidRealigner:
+    """
+    Aligns volumes to a reference volume with 6 DOF (rigid body) motion, using
+    inverse compositional Gauss-Newton over a resolution pyramid.
+    """
+    def __init__(self, reference, voxelSize=None, numLevels: int=2, maxIterations: int=5,
+                 tolerance: float=1e-3, maskFraction: float=0.5, maxPoints: int=50000):
+        """
+        Args:
+            reference: The reference volume, a 3D (or single volume 4D) Nifti image or array
+            voxelSize: The voxel size in mm, taken from the Nifti header by default
+            numLevels: Number of pyramid levels, each level halves the resolution
+            maxIterations: Max Gauss-Newton iterations per level
+            tolerance: Stop iterating when the update is below this (in mm, or radians)
+            maskFraction: Reference voxels brighter than this fraction of the mean
+                intensity are used for the alignment
+            maxPoints: Max number of voxels used per level, subsampled evenly above this
+        """
+        if isinstance(reference, (nib.Nifti1Image, nib.Nifti2Image)):
+            if voxelSize is None:
+                voxelSize = reference.header.get_zooms()[:3]
+            reference = np.asanyarray(reference.dataobj)
+        reference = np.asarray(reference, dtype=np.float64)
+        if reference.ndim == 4 and reference.shape[3] == 1:
+            reference = reference[..., 0]
+        if reference.ndim != 3:
+            raise InvocationError(f"RigidRealigner: reference must be a 3D volume: {reference.shape}")
+        if voxelSize is None:
+            voxelSize = (1, 1, 1)
+        self.shape = reference.shape
+        self.voxelSize = np.array(voxelSize, dtype=np.float64)
+        self.maxIterations = maxIterations
+        self.tolerance = tolerance
+        self.numLevels = numLevels
+        # the pyramid from coarse to fine
+        self.levels = []
+        volume = reference
+        levelVoxelSize = self.voxelSize
+        levelCenter = (np.array(self.shape) - 1) / 2
+        for level in range(numLevels):
+            self.levels.insert(0, _PyramidLevel(volume, levelVoxelSize, levelCenter,
+                                                maskFraction, maxPoints))
+            if min(volume.shape) < 8:
+                break
+            volume = downsample(volume)
+            levelVoxelSize = levelVoxelSize * 2
+            # voxel i of the downsampled volume is centered at 2i + 0.5
+            levelCenter = (levelCenter - 0.5) / 2
+        # start each volume from the previous one's motion
+        self.lastMatrix = np.eye(4)
+
+    def estimate(self, volume) -> np.ndarray:
+        """
+        Estimate the motion of a volume relative to the reference.
+
+        Returns:
+            The 4x4 transform from reference positions to volume positions in
+            centered mm coordinates
+        """
+        from scipy.ndimage import map_coordinates
+        volume = np.asarray(volume, dtype=np.float64)
+        if volume.ndim == 4 and volume.shape[3] == 1:
+            volume = volume[..., 0]
+        if volume.shape != self.shape:
+            raise ValidationError(f"RigidRealigner: volume shape {volume.shape} doesn't match "
+                                  f"the reference {self.shape}")
+        pyramid = [volume]
+        for _ in range(len(self.levels) - 1):
+            pyramid.insert(0, downsample(pyramid[0]))
+        matrix = self.lastMatrix.copy()
+        for level, levelVolume in zip(self.levels, pyramid):
+            for _ in range(self.maxIterations):
+                warped = map_coordinates(levelVolume, level.warpPoints(matrix),
+                                         order=1, mode='nearest')
+                error = warped - level.values
+                delta = np.linalg.solve(level.hessian, level.jacobian.T @ error)
+                # compose with the inverse of the incremental warp
+                matrix = matrix @ np.linalg.inv(rigidMatrix(delta))
+                if np.max(np.abs(delta)) < self.tolerance:
+                    break
+        self.lastMatrix = matrix
+        return matrix
+
+    def resample(self, volume, matrix):
+        """Resample a volume onto the reference grid with the estimated transform"""
+        from scipy.ndimage import affine_transform
+        volume = np.asarray(volume)
+        # reference voxel -> volume voxel
+        scale = np.diag(np.append(self.voxelSize, 1))
+        center = np.eye(4)
+        center[:3, 3] = -(np.array(self.shape) - 1) / 2
+        voxelMatrix = np.linalg.inv(center) @ np.linalg.inv(scale) @ matrix @ scale @ center
+        squeeze = volume.ndim == 4
+        data = volume[..., 0] if squeeze else volume
+        realigned = affine_transform(data.astype(np.float32), voxelMatrix, order=1,
+                                     mode='nearest')
+        if volume.dtype.kind in 'iu':
+            realigned = np.round(realigned).astype(volume.dtype)
+        return realigned[..., np.newaxis] if squeeze else realigned
+
+    def realign(self, volume):
+        """
+        Realign a volume to the reference.
+
+        Returns:
+            A tuple of the realigned volume and its motion params
+            [tx, ty, tz, rx, ry, rz]
+        """
+        matrix = self.estimate(volume)
+        return self.resample(volume, matrix), rigidParams(matrix)
+
+    def realignImage(self, niftiImg):
+        """Realign a Nifti image, returns the realigned image and the motion params"""
+        data = np.asanyarray(niftiImg.dataobj)
+        realigned, params = self.realign(data)
+        imageClass = type(niftiImg)
+        realignedImg = imageClass(realigned, niftiImg.affine, header=niftiImg.header)
+        return realignedImg, params
+
+
+class IncrementalRealigner:
+    """
+    Realigns the BidsIncrementals of a stream, the motion params are added to each
+    incremental's metadata (as RealignmentParameters). Without a reference image the
+    first incremental realigned is the reference.
+    """
+    def __init__(self, referenceImg=None, **realignerArgs):
+        """
+        Args:
+            referenceImg: The reference Nifti image (or filename), None to use the
+                first volume of the stream
+            realignerArgs: Args for the RigidRealigner (numLevels, maxIterations ...)
+        """
+        if isinstance(referenceImg, str):
+            referenceImg = nib.load(referenceImg)
+        self.realignerArgs = realignerArgs
+        self.realigner = None
+        if referenceImg is not None:
+            self.realigner = RigidRealigner(referenceImg, **realignerArgs)
+
+    def realign(self, incremental) -> 'BidsIncremental':
+        """Returns a new BidsIncremental with the realigned image and motion params"""
+        from rtCommon.bidsIncremental import BidsIncremental
+        if self.realigner is None:
+            self.realigner = RigidRealigner(incremental.image, **self.realignerArgs)
+        realignedImg, params = self.realigner.realignImage(incremental.image)
+        metadata = incremental.getImageMetadata().copy()
+        metadata[motionParamsField] = params.tolist()
+        return BidsIncremental(realignedImg, metadata, incremental.datasetDescription)
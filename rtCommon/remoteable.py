@@ -7,7 +7,10 @@ the networking crossbar to send the request to the remote.
 On the remote side we will have a RemoteHandler instance and when messages are received
 will dispatch them to the handler.
 """
+import time
+import logging
 import inspect
+import threading
 import rpyc
 from rtCommon.errors import RequestError, StateError
 
@@ -46,6 +49,7 @@ class RemoteStub(object):
         self.classname = classType.__name__
         self.commFunction = None
         self.timeout = defaultRpcTimeout
+        self.sessionId = None
 
     def setRPCTimeout(self, timeout):
         self.timeout = timeout
@@ -54,12 +58,17 @@ class RemoteStub(object):
         # TODO - perhaps we register a channel instead which goes directly to one end point
         self.commFunction = commFunction
 
+    def setSessionId(self, sessionId):
+        self.sessionId = sessionId
+
     def remoteCall(self, attribute, *args, **kwargs) -> any:
         # args and kwargs may be of type rpyc.core.netref.type if rpyc was used to
         #   send this request from the client script to the projectServer; pull the actual object
         args = rpyc.classic.obtain(args)
         kwargs = rpyc.classic.obtain(kwargs)
         callStruct = {'cmd': 'rpc', 'class': self.classname, 'attribute': attribute, 'args': args, 'kwargs': kwargs}
+        if self.sessionId is not None:
+            callStruct['sessionId'] = self.sessionId
         # print(f'remoteCall: {callStruct}}')
         timeout = self.timeout
         if 'rpc_timeout' in kwargs:
@@ -94,10 +103,12 @@ class RemoteableExtensible(object):
         self.isRemote = isRemote
         self.commFunction = None
         self.timeout = defaultRpcTimeout
+        self.sessionId = None
         self.localAttributes = [
             'localAttributes', 'commFunction', 'timeout',
             'addLocalAttributes', 'registerCommFunction',
-            'setRPCTimeout', 'isRunningRemote', 'isRemote'
+            'setRPCTimeout', 'isRunningRemote', 'isRemote',
+            'sessionId', 'setSessionId'
             ]
 
     def isRunningRemote(self):
@@ -110,12 +121,21 @@ class RemoteableExtensible(object):
         # TODO - perhaps we register a channel instead which goes directly to one end point
         self.commFunction = commFunction
 
+    def setSessionId(self, sessionId):
+        """
+        Requests from this instance will be handled by the remote's instance for sessionId,
+        rather than the instance shared by all clients (see RemoteHandler)
+        """
+        self.sessionId = sessionId
+
     def remoteCall(self, attribute, *args, **kwargs) -> any:
         # args and kwargs may be of type rpyc.core.netref.type if rpyc was used to
         #   send this request to the projectServer from the client script, pull the actual object
         args = rpyc.classic.obtain(args)
         kwargs = rpyc.classic.obtain(kwargs)
         callStruct = {'cmd': 'rpc', 'class': type(self).__name__, 'attribute': attribute, 'args': args, 'kwargs': kwargs}
+        if self.sessionId is not None:
+            callStruct['sessionId'] = self.sessionId
         # print(f'### remoteCall callStruct: {callStruct}')
         timeout = self.timeout
         if 'rpc_timeout' in kwargs:
@@ -154,16 +174,27 @@ class RemoteableExtensible(object):
         return object.__getattribute__(self, name)
 
 
-# TODO - support per client remote instances, either by having a per-client classInstanceDict
-#  or by supporting a 'new' function call, or by returning handles of the instances (although
-#  that might be more complext than needed)
 class RemoteHandler:
     """
     Class that runs at the remote and as message requests are received they are dispatched
     to this class for processing.
+
+    By default one instance per class handles the requests from all clients. Classes
+    registered with a session factory instead get a separate instance per client session,
+    created by the factory on the first request carrying that 'sessionId'. This lets
+    concurrent clients (i.e. two experiment scripts) each keep their own state, such as
+    the open data streams, in the remote service.
     """
+    # Maximum number of concurrent sessions, the least recently used is closed beyond this
+    maxSessions = 16
+
     def __init__(self):
         self.classInstanceDict = {}
+        self.sessionFactories = {}
+        # map from sessionId to a dict of {className: classInstance}
+        self.sessionInstances = {}
+        self.sessionLastUsed = {}
+        self.sessionLock = threading.Lock()
 
     def registerClassInstance(self, classType, classInstance):
         self.classInstanceDict[classType.__name__] = classInstance
@@ -171,14 +202,65 @@ class RemoteHandler:
     def registerClassNameInstance(self, className, classInstance):
         self.classInstanceDict[className] = classInstance
 
+    def registerSessionFactory(self, classType, factory):
+        """
+        Register a function that returns a new instance of classType. Requests with
+        a 'sessionId' field are handled by the instance created for that session.
+        """
+        self.sessionFactories[classType.__name__] = factory
+
+    def getClassInstance(self, className, sessionId=None):
+        """Returns the instance that handles calls to className for sessionId"""
+        if sessionId is None or className not in self.sessionFactories:
+            return self.classInstanceDict.get(className)
+        with self.sessionLock:
+            instances = self.sessionInstances.get(sessionId)
+            if instances is None:
+                instances = {}
+                self.sessionInstances[sessionId] = instances
+            self.sessionLastUsed[sessionId] = time.time()
+            classInstance = instances.get(className)
+            if classInstance is None:
+                classInstance = self.sessionFactories[className]()
+                instances[className] = classInstance
+            # close the least recently used sessions if over the limit
+            while len(self.sessionInstances) > self.maxSessions:
+                oldestId = min(self.sessionLastUsed, key=self.sessionLastUsed.get)
+                self._closeSession(oldestId)
+        return classInstance
+
+    def closeSession(self, sessionId):
+        """Release the instances created for sessionId"""
+        with self.sessionLock:
+            self._closeSession(sessionId)
+
+    def _closeSession(self, sessionId):
+        instances = self.sessionInstances.pop(sessionId, None)
+        self.sessionLastUsed.pop(sessionId, None)
+        if instances is None:
+            return
+        # release the streams, file watchers etc. held by the session's instances
+        for className, classInstance in instances.items():
+            close = getattr(classInstance, 'close', None)
+            if callable(close):
+                try:
+                    close()
+                except Exception as err:
+                    logging.warning(f'RemoteHandler: closing {className} of session '
+                                    f'{sessionId}: {err}')
+
     def runRemoteCall(self, callDict):
         # print(f'remoteCall {callDict}')
+        sessionId = callDict.get('sessionId')
+        if callDict.get('cmd') == 'closeSession':
+            self.closeSession(sessionId)
+            return None
         className = callDict.get('class')
         attributeName = callDict.get('attribute')
         if None in (className, attributeName):
             raise RequestError(f'Malformed remote call struct: missing one of '
                                f'class {className}, attribute {attributeName}')
-        classInstance = self.classInstanceDict.get(className)
+        classInstance = self.getClassInstance(className, sessionId)
         if classInstance is None:
             raise StateError(f'RemoteHandler: class {className} not registered')
         attributeInstance = getattr(classInstance, attributeName)
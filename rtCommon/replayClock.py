@@ -0,0 +1,111 @@
+"""
+Clocks used to pace the replay of previously acquired data.
+
+Replays (demoStep in initScannerStream/initWatch, the DicomToBidsStream and the
+time-to-next-TR calculations) get the time and sleep through the current replay clock
+rather than calling time.time() and time.sleep() directly. Swapping the clock lets a
+whole session be replayed faster while the relative timing between volumes is the same:
+
+    WallClock   - real time (the default)
+    ScaledClock - time runs N times faster, sleeps are N times shorter
+    StepClock   - sleeps return immediately and advance the clock instead
+
+The clock is chosen with setReplayClock(), or for all processes of a session (the
+projectServer, data service and the scripts they start) with the RTCLOUD_REPLAY_CLOCK
+environment variable, e.g. RTCLOUD_REPLAY_CLOCK=scaled:10 or RTCLOUD_REPLAY_CLOCK=step.
+"""
+import os
+import time
+import threading
+from rtCommon.errors import InvocationError
+
+
+class WallClock:
+    """Real time."""
+    def now(self) -> float:
+        """Returns the clock time in seconds since the epoch"""
+        return time.time()
+
+    def sleep(self, secs: float) -> None:
+        """Waits until the clock has advanced by secs"""
+        if secs > 0:
+            time.sleep(secs)
+
+
+class ScaledClock(WallClock):
+    """Time that runs 'speed' times faster than real time, starting from the current time."""
+    def __init__(self, speed: float):
+        if speed <= 0:
+            raise InvocationError(f"ScaledClock speed must be > 0: {speed}")
+        self.speed = speed
+        self.startTime = time.time()
+
+    def now(self) -> float:
+        return self.startTime + (time.time() - self.startTime) * self.speed
+
+    def sleep(self, secs: float) -> None:
+        if secs > 0:
+            time.sleep(secs / self.speed)
+
+
+class StepClock(WallClock):
+    """
+    Time that runs at real speed except that sleeps return immediately and move the
+    clock forward instead, so a replay runs as fast as the processing allows.
+    """
+    def __init__(self):
+        self.offset = 0.0
+        self.lock = threading.Lock()
+
+    def now(self) -> float:
+        return time.time() + self.offset
+
+    def sleep(self, secs: float) -> None:
+        # Note: the clock is shared, so sleeps in different threads each advance it
+        if secs <= 0:
+            return
+        with self.lock:
+            self.offset += secs
+
+
+def createReplayClock(clockSpec: str) -> WallClock:
+    """
+    Returns a clock from a string description: 'wall', 'scaled:<speed>' or 'step'
+    """
+    if clockSpec in (None, '', 'wall'):
+        return WallClock()
+    if clockSpec == 'step':
+        return StepClock()
+    if clockSpec.startswith('scaled:'):
+        try:
+            speed = float(clockSpec[len('scaled:'):])
+        except ValueError:
+            raise InvocationError(f"Invalid replay clock speed: {clockSpec}")
+        return ScaledClock(speed)
+    raise InvocationError(f"Unknown replay clock '{clockSpec}', use 'wall', 'scaled:<speed>' or 'step'")
+
+
+replayClock = createReplayClock(os.environ.get('RTCLOUD_REPLAY_CLOCK'))
+
+
+def getReplayClock() -> WallClock:
+    """Returns the clock currently used for replay timing"""
+    return replayClock
+
+
+def setReplayClock(clock) -> WallClock:
+    """
+    Sets the clock used for replay timing.
+
+    Args:
+        clock: A clock instance (WallClock, ScaledClock, StepClock) or a string
+            description of one, i.e. 'wall', 'scaled:10' or 'step'
+    Returns:
+        The previous clock, so it can be restored
+    """
+    global replayClock
+    if clock is None or isinstance(clock, str):
+        clock = createReplayClock(clock)
+    prevClock = replayClock
+    replayClock = clock
+    return prevClock
@@ -1,32 +1,229 @@
 # purpose: resample images in quick function
 
-import numpy as numpy
-import nibabel
-import nilearn
-from nilearn.image import resample_to_img
-import matplotlib.pyplot as pyplot
-from nilearn import plotting
-from nilearn.plotting import show
-from nilearn.plotting import plot_roi
-from nilearn import image
-from nilearn.image import load_img
+"""
+Resampling of images from a source voxel grid to a target grid (i.e. a reference or
+mask image).
+
+nilearn's resample_to_img solves the affine and sets up map_coordinates for every
+image it resamples. When each incoming volume is resampled between the same two grids,
+a ResamplePlan works out once which source voxels (and weights) make up each target
+voxel, and then each volume (or a batch of volumes) is resampled with a vectorized
+gather:
+
+    plan = ResamplePlan.fromImages(sourceImg, referenceImg, interpolation='linear')
+    resampled = plan.apply(volumeData)
+    plan.save(planDir)
+    plan = ResamplePlan.load(planDir, mmap=True)
+
+Run as a script to resample an image file with nilearn:
+    python resample.py <image_to_resample> <image_reference>
+"""
+import os
 import sys
+import json
+import numpy as np
+import nibabel as nib
+# add the repo root to the path when run as a script
+currPath = os.path.dirname(os.path.realpath(__file__))
+rootPath = os.path.dirname(currPath)
+sys.path.append(rootPath)
+from rtCommon.errors import ValidationError, InvocationError
+
+
+class ResamplePlan:
+    """
+    Precomputed source indices and weights for resampling from a source grid to a
+    target grid, with nearest neighbour or trilinear interpolation.
+    """
+    # number of source voxels contributing to each target voxel
+    numNeighbors = {'nearest': 1, 'linear': 8}
+
+    def __init__(self, sourceShape, sourceAffine, targetShape, targetAffine,
+                 interpolation: str='nearest', fillValue: float=0):
+        """
+        Args:
+            sourceShape: The 3D shape of the volumes to resample
+            sourceAffine: The voxel to world affine of the source volumes
+            targetShape: The 3D shape of the resampled volumes
+            targetAffine: The voxel to world affine of the target grid
+            interpolation: 'nearest' or 'linear' (trilinear)
+            fillValue: Value of target voxels that are outside the source volume
+        """
+        if interpolation not in self.numNeighbors:
+            raise InvocationError(f"ResamplePlan: interpolation must be 'nearest' or "
+                                  f"'linear': {interpolation}")
+        self.sourceShape = tuple(int(dim) for dim in sourceShape[:3])
+        self.targetShape = tuple(int(dim) for dim in targetShape[:3])
+        self.sourceAffine = np.array(sourceAffine, dtype=np.float64)
+        self.targetAffine = np.array(targetAffine, dtype=np.float64)
+        self.interpolation = interpolation
+        self.fillValue = fillValue
+        # target voxel (flat index) -> source voxels (flat indices) and weights,
+        #   only for the target voxels that are inside the source volume
+        self.targetIndices = None
+        self.sourceIndices = None
+        self.weights = None
+        self._computePlan()
+
+    @classmethod
+    def fromImages(cls, sourceImg, targetImg, interpolation: str='nearest',
+                   fillValue: float=0) -> 'ResamplePlan':
+        """Make a plan from a source image (or filename) to a target image's grid"""
+        if isinstance(sourceImg, str):
+            sourceImg = nib.load(sourceImg)
+        if isinstance(targetImg, str):
+            targetImg = nib.load(targetImg)
+        return cls(sourceImg.shape, sourceImg.affine, targetImg.shape, targetImg.affine,
+                   interpolation=interpolation, fillValue=fillValue)
+
+    def _computePlan(self):
+        # source voxel coordinates of each target voxel center
+        targetVoxels = np.indices(self.targetShape, dtype=np.float64).reshape(3, -1)
+        transform = np.linalg.inv(self.sourceAffine) @ self.targetAffine
+        coords = transform[:3, :3] @ targetVoxels + transform[:3, 3:4]
+        shape = np.array(self.sourceShape).reshape(3, 1)
+        if self.interpolation == 'nearest':
+            # round half up, as scipy's map_coordinates does
+            nearest = np.floor(coords + 0.5).astype(np.int64)
+            inside = np.all((nearest >= 0) & (nearest < shape), axis=0)
+            self.targetIndices = np.flatnonzero(inside).astype(np.int32)
+            sourceIndices = np.ravel_multi_index(tuple(nearest[:, inside]), self.sourceShape)
+            self.sourceIndices = sourceIndices.astype(np.int32).reshape(-1, 1)
+            self.weights = None
+            return
+        # trilinear, the 8 corners around each coordinate, corners outside of the
+        #   source volume get weight zero (and contribute the fill value)
+        inside = np.all((coords > -1) & (coords < shape), axis=0)
+        coords = coords[:, inside]
+        lower = np.floor(coords).astype(np.int64)
+        frac = coords - lower
+        sourceIndices = np.zeros((coords.shape[1], 8), dtype=np.int32)
+        weights = np.zeros((coords.shape[1], 8), dtype=np.float32)
+        for corner in range(8):
+            offset = np.array([(corner >> 2) & 1, (corner >> 1) & 1, corner & 1]).reshape(3, 1)
+            cornerVoxels = lower + offset
+            weight = np.prod(np.where(offset == 1, frac, 1 - frac), axis=0)
+            valid = np.all((cornerVoxels >= 0) & (cornerVoxels < shape), axis=0)
+            sourceIndices[valid, corner] = np.ravel_multi_index(
+                tuple(cornerVoxels[:, valid]), self.sourceShape)
+            weights[valid, corner] = weight[valid]
+        self.targetIndices = np.flatnonzero(inside).astype(np.int32)
+        self.sourceIndices = sourceIndices
+        self.weights = weights
+
+    def apply(self, data, out=None):
+        """
+        Resample a volume, or a batch of volumes, to the target grid.
+
+        Args:
+            data: Source volume of the sourceShape, or a 4D array of volumes
+                with the volume index last (as in a 4D Nifti)
+            out: Optional array of the target shape (plus the number of volumes
+                for a batch) to write the resampled data into
+        Returns:
+            The resampled volume(s). Nearest neighbour keeps the data type, linear
+            interpolation returns float32 (float64 for float64 data)
+        """
+        data = np.asanyarray(data)
+        if data.shape[:3] != self.sourceShape:
+            raise ValidationError(f"ResamplePlan: data shape {data.shape} doesn't match "
+                                  f"the source shape {self.sourceShape}")
+        batchShape = data.shape[3:]
+        sourceData = data.reshape(-1, int(np.prod(batchShape, dtype=np.int64)))
+        if self.weights is None:
+            values = sourceData[self.sourceIndices[:, 0]]
+            outType = data.dtype
+        else:
+            outType = np.float64 if data.dtype == np.float64 else np.float32
+            values = np.zeros((len(self.targetIndices), sourceData.shape[1]), dtype=outType)
+            for corner in range(self.weights.shape[1]):
+                values += self.weights[:, corner, np.newaxis] * sourceData[self.sourceIndices[:, corner]]
+            if self.fillValue != 0:
+                values += (1 - self.weights.sum(axis=1))[:, np.newaxis] * self.fillValue
+        targetShape = self.targetShape + batchShape
+        if out is None:
+            out = np.empty(targetShape, dtype=outType)
+        elif out.shape != targetShape:
+            raise ValidationError(f"ResamplePlan: out shape {out.shape} should be {targetShape}")
+        if out.flags.c_contiguous:
+            outFlat = out.reshape(-1, sourceData.shape[1])
+        else:
+            outFlat = np.empty((int(np.prod(self.targetShape)), sourceData.shape[1]), dtype=out.dtype)
+        if len(self.targetIndices) < outFlat.shape[0]:
+            outFlat[...] = self.fillValue
+        outFlat[self.targetIndices] = values
+        if not out.flags.c_contiguous:
+            out[...] = outFlat.reshape(targetShape)
+        return out
+
+    def applyToImage(self, img) -> nib.Nifti1Image:
+        """Resample a (3D or 4D) Nifti image, returns an image with the target affine"""
+        resampled = self.apply(np.asanyarray(img.dataobj))
+        return nib.Nifti1Image(resampled, self.targetAffine)
+
+    def save(self, planDir: str) -> None:
+        """Write the plan to a directory, the index and weight arrays as .npy files"""
+        os.makedirs(planDir, exist_ok=True)
+        np.save(os.path.join(planDir, 'targetIndices.npy'), self.targetIndices)
+        np.save(os.path.join(planDir, 'sourceIndices.npy'), self.sourceIndices)
+        if self.weights is not None:
+            np.save(os.path.join(planDir, 'weights.npy'), self.weights)
+        info = {'sourceShape': self.sourceShape, 'targetShape': self.targetShape,
+                'sourceAffine': self.sourceAffine.tolist(),
+                'targetAffine': self.targetAffine.tolist(),
+                'interpolation': self.interpolation, 'fillValue': self.fillValue}
+        with open(os.path.join(planDir, 'plan.json'), 'w') as fp:
+            json.dump(info, fp)
+
+    @classmethod
+    def load(cls, planDir: str, mmap: bool=False) -> 'ResamplePlan':
+        """
+        Read a plan written by save().
+
+        Args:
+            planDir: The directory the plan was saved to
+            mmap: Memory-map the index and weight arrays rather than reading them
+        """
+        with open(os.path.join(planDir, 'plan.json')) as fp:
+            info = json.load(fp)
+        plan = cls.__new__(cls)
+        plan.sourceShape = tuple(info['sourceShape'])
+        plan.targetShape = tuple(info['targetShape'])
+        plan.sourceAffine = np.array(info['sourceAffine'])
+        plan.targetAffine = np.array(info['targetAffine'])
+        plan.interpolation = info['interpolation']
+        plan.fillValue = info['fillValue']
+        mmapMode = 'r' if mmap else None
+        plan.targetIndices = np.load(os.path.join(planDir, 'targetIndices.npy'), mmap_mode=mmapMode)
+        plan.sourceIndices = np.load(os.path.join(planDir, 'sourceIndices.npy'), mmap_mode=mmapMode)
+        plan.weights = None
+        if plan.interpolation != 'nearest':
+            plan.weights = np.load(os.path.join(planDir, 'weights.npy'), mmap_mode=mmapMode)
+        return plan
+
+
+def main(argv):
+    from nilearn.image import resample_to_img
+
+    # purpose of functions - take in image to resize, reference image
+    # resave as resampled image
+
+    image_to_resample=argv[1]
+    image_reference=argv[2]
+
+    # first resample - change interpolation strategy if you would like
+    resampled_image = resample_to_img(image_to_resample,image_reference,interpolation='nearest')
+    # save as resampled
+    if 'gz' in image_to_resample:
+        # go back that many characters
+        base_name = image_to_resample[0:-7]
+        save_name = base_name + '_resampled' + '.nii.gz'
+    else: # gzipped nifti
+        base_name = image_to_resample[0:-4]
+        save_name = base_name + '_resampled' + '.nii'
+    # now save
+    resampled_image.to_filename(save_name)
+
 
-# purpose of functions - take in image to resize, reference image
-# resave as resampled image
-
-image_to_resample=sys.argv[1]
-image_reference=sys.argv[2]
-
-# first resample - change interpolation strategy if you would like
-resampled_image = resample_to_img(image_to_resample,image_reference,interpolation='nearest')
-# save as resampled
-if 'gz' in image_to_resample:
-    # go back that many characters
-    base_name = image_to_resample[0:-7]
-    save_name = base_name + '_resampled' + '.nii.gz'
-else: # gzipped nifti
-    base_name = image_to_resample[0:-4]
-    save_name = base_name + '_resampled' + '.nii'
-# now save
-resampled_image.to_filename(save_name)
\ No newline at end of file
+if __name__ == "__main__":
+    main(sys.argv)
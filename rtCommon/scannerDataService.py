@@ -39,18 +39,31 @@ class ScannerDataService:
         """
         if args.scannerClockSkew is None:
             args.scannerClockSkew = 0
+        if args.readCacheMB is None:
+            args.readCacheMB = 256
 
-        self.dataInterface = DataInterface(dataRemote=False,
-                                           allowedDirs=args.allowedDirs,
-                                           allowedFileTypes=args.allowedFileTypes,
-                                           scannerClockSkew=args.scannerClockSkew)
-        self.bidsInterface = BidsInterface(dataRemote=False,
-                                           allowedDirs=args.allowedDirs,
-                                           scannerClockSkew=args.scannerClockSkew)
+        def newDataInterface():
+            return DataInterface(dataRemote=False,
+                                 allowedDirs=args.allowedDirs,
+                                 allowedFileTypes=args.allowedFileTypes,
+                                 scannerClockSkew=args.scannerClockSkew,
+                                 readCacheSize=int(args.readCacheMB * 2**20),
+                                 usePollingWatcher=args.pollFiles is True)
+
+        def newBidsInterface():
+            return BidsInterface(dataRemote=False,
+                                 allowedDirs=args.allowedDirs,
+                                 scannerClockSkew=args.scannerClockSkew)
+
+        self.dataInterface = newDataInterface()
+        self.bidsInterface = newBidsInterface()
 
         self.wsRemoteService = WsRemoteService(args, webSocketChannelName)
         self.wsRemoteService.addHandlerClass(DataInterface, self.dataInterface)
         self.wsRemoteService.addHandlerClass(BidsInterface, self.bidsInterface)
+        # Each client session of the projectServer gets its own stream state
+        self.wsRemoteService.addSessionHandlerClass(DataInterface, newDataInterface)
+        self.wsRemoteService.addSessionHandlerClass(BidsInterface, newBidsInterface)
 
 
 if __name__ == "__main__":
@@ -69,6 +82,11 @@ if __name__ == "__main__":
                         help="Allowed file types - comma separated list")
     parser.add_argument('--scannerClockSkew', default=0.0, type=float,
                         help="Seconds (float) that the scanner clock is ahead of the data server clock")
+    parser.add_argument('--readCacheMB', default=256, type=float,
+                        help="Size (MB) of each DataInterface's read-ahead file cache, 0 to disable")
+    parser.add_argument('--pollFiles', default=False, action='store_true',
+                        help="Poll for new files instead of using file system events, "
+                             "use when the scanner directory is a network (NFS/SMB) mount")
     args, _ = parser.parse_known_args(namespace=connectionArgs)
 
     if type(args.allowedDirs) is str:
@@ -0,0 +1,217 @@
+"""
+A pool of pre-started python interpreters for running the experimenter's scripts.
+
+Each "Run", "Initialize" or "Finalize" request from the web page runs a project script
+in a separate process. Starting a fresh interpreter for each request means paying the
+import cost of numpy, nibabel, pydicom, nilearn, pybids, pandas etc. and then opening
+a new rpyc connection to the projectServer before the script can do any work.
+
+The ScriptPool keeps a number of worker processes running that have already imported
+the rtCommon dependencies and connected to the projectServer RPC port. When a script
+is launched, a waiting worker is handed the script path and arguments over its stdin
+and immediately runs the script as __main__. The worker's stdout/stderr and stdin are
+the same pipes a normally launched script would have, so output forwarding and the
+stop semantics (closing stdin, terminate) are unchanged.
+
+The worker side of the pool is run by invoking this module as a script:
+    python -u rtCommon/scriptPool.py
+"""
+import os
+import sys
+import json
+import logging
+import threading
+import subprocess
+
+currPath = os.path.dirname(os.path.realpath(__file__))
+rootPath = os.path.dirname(currPath)
+sys.path.append(rootPath)
+from rtCommon.utils import DebugLevels
+from rtCommon.structDict import StructDict
+
+# Modules imported by each worker before it reports that it is ready
+defaultPreloadModules = [
+    'numpy', 'scipy.io', 'nibabel', 'pydicom', 'pandas', 'nilearn.image', 'bids',
+    'rpyc', 'rtCommon.clientInterface', 'rtCommon.imageHandling',
+    'rtCommon.bidsIncremental', 'rtCommon.bidsArchive',
+]
+
+# Line written by the worker to stdout when it is ready to accept a script
+workerReadyTag = '##ScriptPoolWorkerReady##'
+
+# Max seconds a worker waits for its projectServer connection before running a script
+connectionWaitTimeout = 5
+
+
+class ScriptPool:
+    """
+    Maintains a set of warm interpreter processes and hands them out to run scripts.
+    If no warm worker is available a new process is started in the normal way, so
+    launch() always returns a running process.
+    """
+    def __init__(self, size: int=1, cwd: str=rootPath, env: dict=None,
+                 preloadModules: list=None):
+        """
+        Args:
+            size: Number of warm workers to keep available
+            cwd: Working directory the workers (and scripts) run in
+            env: Environment variables for the worker processes
+            preloadModules: List of module names each worker imports before it
+                is considered ready, defaults to the rtCommon dependencies
+        """
+        self.size = size
+        self.cwd = cwd
+        self.env = env
+        self.preloadModules = preloadModules
+        if self.preloadModules is None:
+            self.preloadModules = defaultPreloadModules
+        self.workers = []
+        self.poolLock = threading.Lock()
+        self.shouldExit = False
+        self.replenish()
+
+    def __del__(self):
+        self.shutdown()
+
+    def launch(self, pyScript: str, scriptArgs: list=None) -> subprocess.Popen:
+        """
+        Run pyScript with scriptArgs in a warm worker if one is available.
+
+        Args:
+            pyScript: Path of the python script to run
+            scriptArgs: List of command line arguments for the script
+        Returns:
+            The subprocess.Popen instance running the script. Its stdout and stdin
+            are pipes, the same as for a script started with subprocess.Popen().
+        """
+        if scriptArgs is None:
+            scriptArgs = []
+        proc = self._getReadyWorker()
+        if proc is None:
+            logging.info('ScriptPool: no warm worker available, starting new process')
+            cmd = ['python', '-u', pyScript] + list(scriptArgs)
+            proc = subprocess.Popen(cmd, cwd=self.cwd, env=self.env, stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT, stdin=subprocess.PIPE, shell=False)
+        else:
+            request = {'script': pyScript, 'args': list(scriptArgs)}
+            proc.stdin.write((json.dumps(request) + '\n').encode())
+            proc.stdin.flush()
+        # start a replacement worker in the background
+        replenishThread = threading.Thread(name='scriptPoolReplenish', target=self.replenish)
+        replenishThread.setDaemon(True)
+        replenishThread.start()
+        return proc
+
+    def replenish(self):
+        """Start new workers until the pool has 'size' live workers."""
+        with self.poolLock:
+            self.workers = [worker for worker in self.workers if worker.proc.poll() is None]
+            while len(self.workers) < self.size and not self.shouldExit:
+                self.workers.append(self._startWorker())
+
+    def shutdown(self):
+        """Stop all workers that are waiting for a script."""
+        self.shouldExit = True
+        with self.poolLock:
+            for worker in self.workers:
+                try:
+                    worker.proc.stdin.close()
+                    worker.proc.terminate()
+                except Exception:
+                    pass
+            self.workers = []
+
+    def _startWorker(self) -> StructDict:
+        cmd = ['python', '-u', os.path.join(currPath, 'scriptPool.py'),
+               '--preload', ','.join(self.preloadModules)]
+        proc = subprocess.Popen(cmd, cwd=self.cwd, env=self.env, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, stdin=subprocess.PIPE, shell=False)
+        worker = StructDict({'proc': proc, 'ready': threading.Event(), 'exited': False})
+        readyThread = threading.Thread(name='scriptPoolWorkerReady',
+                                       target=self._waitForReady, args=(worker,))
+        readyThread.setDaemon(True)
+        readyThread.start()
+        return worker
+
+    @staticmethod
+    def _waitForReady(worker):
+        """Reads the worker's output until it reports ready, then sets worker.ready"""
+        # The worker writes workerReadyTag once its imports are done, any
+        #   output before that (i.e. import warnings) is not part of the script.
+        #   Nothing after the tag is read here, that output belongs to the script.
+        for bline in iter(worker.proc.stdout.readline, b''):
+            line = bline.decode('utf-8').rstrip()
+            if line == workerReadyTag:
+                worker.ready.set()
+                return
+            logging.log(DebugLevels.L3, f'ScriptPool worker: {line}')
+        logging.warning('ScriptPool: worker exited before becoming ready')
+        worker.exited = True
+        worker.ready.set()
+
+    def _getReadyWorker(self):
+        """Returns a worker that has finished its imports, or None if none are ready."""
+        with self.poolLock:
+            self.workers = [worker for worker in self.workers
+                            if not worker.exited and worker.proc.poll() is None]
+            if len(self.workers) == 0:
+                return None
+            # prefer a worker that is already ready, otherwise the one started first
+            readyWorkers = [worker for worker in self.workers if worker.ready.is_set()]
+            worker = readyWorkers[0] if len(readyWorkers) > 0 else self.workers[0]
+            self.workers.remove(worker)
+        # If the worker is still importing this waits for it to finish, which is
+        #   never longer than starting a new process would take. The pool lock isn't
+        #   held so replenish and other launches aren't blocked meanwhile.
+        worker.ready.wait()
+        if worker.exited:
+            return None
+        return worker.proc
+
+
+def runWorker(preloadModules):
+    """
+    Worker side of the ScriptPool. Imports the preload modules, connects to the
+    projectServer and then waits on stdin for the script to run.
+    """
+    import runpy
+    import importlib
+    for moduleName in preloadModules:
+        try:
+            importlib.import_module(moduleName)
+        except Exception as err:
+            logging.info(f'ScriptPool worker: unable to preload {moduleName}: {err}')
+    # Open the projectServer rpc connection in the background while waiting for a script
+    connThread = None
+    if 'rtCommon.clientInterface' in sys.modules:
+        from rtCommon.clientInterface import prestartConnection
+        connThread = threading.Thread(name='warmConnection', target=prestartConnection)
+        connThread.setDaemon(True)
+        connThread.start()
+    print(workerReadyTag, flush=True)
+    requestLine = sys.stdin.readline()
+    if requestLine == '':
+        # stdin closed, the pool is shutting down
+        return
+    if connThread is not None:
+        # let the connection finish so the script's ClientInterface uses it rather
+        #   than racing it with a second connection
+        connThread.join(timeout=connectionWaitTimeout)
+    request = json.loads(requestLine)
+    pyScript = request['script']
+    sys.argv = [pyScript] + request.get('args', [])
+    # match the sys.path a script run directly by the interpreter would have
+    sys.path[0] = os.path.dirname(os.path.realpath(pyScript))
+    runpy.run_path(pyScript, run_name='__main__')
+
+
+if __name__ == "__main__":
+    import argparse
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument('--preload', default=None, type=str,
+                           help='comma separated list of modules to import before running the script')
+    args = argParser.parse_args()
+    modules = defaultPreloadModules
+    if args.preload is not None:
+        modules = [name for name in args.preload.split(',') if name != '']
+    runWorker(modules)
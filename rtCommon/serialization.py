@@ -160,7 +160,7 @@ def decodeMessageData(message):
     return data
 
 
-def generateDataParts(data, msg, compress):
+def generateDataParts(data, msg, compress, skipParts=None):
     """
     A python "generator" that, for data > 10 MB, will create multi-part
     messages of 10MB each to send the data incrementally
@@ -168,6 +168,8 @@ def generateDataParts(data, msg, compress):
         data (bytes): data to send
         msg (dict): message header for the request
         compress (bool): whether to compress the data befor sending
+        skipParts (list): partIds already received by the other end (i.e. when
+            resuming a transfer after a reconnect), these parts are not generated
     Returns:
         Repeated calls return the next partial message to be sent until
             None is returned
@@ -192,6 +194,9 @@ def generateDataParts(data, msg, compress):
         sendSize = dataSize - i
         if sendSize > dataPartSize:
             sendSize = dataPartSize
+        if skipParts is not None and partId in skipParts:
+            i += sendSize
+            continue
         dataPart = data[i:i+sendSize]
         msgPart['partId'] = partId
         try:
@@ -17,9 +17,9 @@ import hashlib
 from datetime import datetime, date
 from datetime import time as dtime
 import numpy as np  # type: ignore
-import scipy.io as sio  # type: ignore
 from .structDict import MatlabStructDict, isStructuredArray, recurseCreateStructDict
 from .errors import InvocationError, StateError, ValidationError
+from .replayClock import getReplayClock
 
 
 def parseMatlabStruct(top_struct) -> MatlabStructDict:
@@ -41,11 +41,13 @@ def parseMatlabStruct(top_struct) -> MatlabStructDict:
 def loadMatFile(filename: str) -> MatlabStructDict:
     if not os.path.isfile(filename):
         raise FileNotFoundError("File \'{}\' not found".format(filename))
+    import scipy.io as sio  # type: ignore
     top_struct = sio.loadmat(filename)
     return parseMatlabStruct(top_struct)
 
 
 def loadMatFileFromBuffer(data) -> MatlabStructDict:
+    import scipy.io as sio  # type: ignore
     dataBytesIO = io.BytesIO(data)
     top_struct = sio.loadmat(dataBytesIO)
     return parseMatlabStruct(top_struct)
@@ -205,10 +207,13 @@ def demoDelay(demoStep, prevEventTime=None):
        Then sleep that amount of time.
        If prevEventTime is specified and we are more than 1 demo step since the
        prevEvent then don't sleep.
+       Times are from the replay clock (see rtCommon.replayClock), so a replay
+       can be run faster than real time.
     """
-    now = time.time()
+    clock = getReplayClock()
+    now = clock.now()
     if prevEventTime is None:
-        prevEventTime = time.time()
+        prevEventTime = now
     if (now > prevEventTime + demoStep) or (demoStep == 0):
         return now
     # Calculate and sleep until next even demoStep
@@ -218,7 +223,7 @@ def demoDelay(demoStep, prevEventTime=None):
     sleep_ms = step_ms - (now_ms % step_ms)
     sleep_sec = sleep_ms / 1000
     nextEventTime = now + sleep_sec
-    time.sleep(sleep_sec)
+    clock.sleep(sleep_sec)
     return nextEventTime
 
 
@@ -303,6 +308,11 @@ def trimDictBytes(msg, trimSize=64):
                 msg.pop(key, None)
 
 
+def replayClockTimeOfDay() -> dtime:
+    """Returns the current time of day (datetime.time) according to the replay clock"""
+    return datetime.fromtimestamp(getReplayClock().now()).time()
+
+
 def getTimeToNextTR(lastTrTime, trRepSec, nowTime, clockSkew) -> float:
     """
     Returns seconds to next TR start time
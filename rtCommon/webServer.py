@@ -11,6 +11,7 @@ import re
 import toml
 import shlex
 import uuid
+import atexit
 import asyncio
 import threading
 import subprocess
@@ -23,6 +24,7 @@ from rtCommon.webHttpHandlers import HttpHandler, LoginHandler, LogoutHandler
 from rtCommon.webSocketHandlers import BaseWebSocketHandler
 from rtCommon.webDisplayInterface import WebDisplayInterface
 from rtCommon.projectServerRPC import ProjectRPCService
+from rtCommon.scriptPool import ScriptPool
 from rtCommon.dataInterface import uploadFilesFromList
 
 CommonOutputDir = '/rtfmriData/'
@@ -48,6 +50,7 @@ class Web():
     ioLoopInst = None
     testMode = False
     webDisplayInterface = None
+    browserRequestHandler = None
 
     @staticmethod
     def start(params, cfg, testMode=False):
@@ -134,6 +137,8 @@ class Web():
         """Stop the web server."""
         Web.ioLoopInst.add_callback(Web.ioLoopInst.stop)
         Web.app = None
+        if Web.browserRequestHandler is not None:
+            Web.browserRequestHandler.close()
 
     # Possibly use raise exception to stop a thread
     # def raise_exception(self): i.e. for stop()
@@ -169,6 +174,18 @@ class WsBrowserRequestHandler:
         self._addScript('initScript', params.initScript, 'init')
         self._addScript('finalizeScript', params.finalizeScript, 'finalize')
         self.runStatus = "waiting ..."
+        # Optional pool of pre-started interpreters to launch the scripts in
+        self.scriptPool = None
+        if params.warmPoolSize is not None and params.warmPoolSize > 0:
+            self.scriptPool = ScriptPool(size=params.warmPoolSize, cwd=rootDir,
+                                         env=getScriptEnv())
+            # stop the warm workers if the server exits without stop() being called
+            atexit.register(self.scriptPool.shutdown)
+
+    def close(self):
+        """Stop the warm script workers, called when the web server stops"""
+        if self.scriptPool is not None:
+            self.scriptPool.shutdown()
 
     def _addScript(self, name, path, type):
         """Add the experiment script to be connected to the various run button of the
@@ -305,17 +322,16 @@ class WsBrowserRequestHandler:
         with open(configFileName, 'w+') as fd:
             toml.dump(cfg, fd)
 
-        # To handle spaces in pyScript or rootDir, use quoted rootDir
-        #  in env and use shell=False in the subprocess.Popen() command.
-        # add to the rtCommon dir to the PYTHONPATH env variable
-        env = os.environ.copy()
-        env['PYTHONPATH'] = f'\"{rootDir}:' + env.get('PYTHONPATH', '') + '\"'
         # specify -u python option to disable buffering print commands
         # command w/ shell=True: cmdStr = f'python -u {pyScript} -c {configFileName}'
         cmd = ['python', '-u', pyScript, '-c', configFileName] # shlex.split(cmdStr)
         print('###RUN: ' + ' '.join(cmd))
-        proc = subprocess.Popen(cmd, cwd=rootDir, env=env, stdout=subprocess.PIPE,
-                                stderr=subprocess.STDOUT, stdin=subprocess.PIPE, shell=False)
+        if self.scriptPool is not None:
+            # run in an already started interpreter with dependencies imported
+            proc = self.scriptPool.launch(pyScript, ['-c', configFileName])
+        else:
+            proc = subprocess.Popen(cmd, cwd=rootDir, env=getScriptEnv(), stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT, stdin=subprocess.PIPE, shell=False)
         # send running status to user web page
         self.runStatus = tag + ' running'
         self.webUI.sendRunStatus(self.runStatus)
@@ -393,6 +409,16 @@ class WsBrowserRequestHandler:
         self.webUI.setUserError(errStr)
 
 
+def getScriptEnv():
+    """Returns the environment variables for running the experimenter's scripts."""
+    # To handle spaces in pyScript or rootDir, use quoted rootDir
+    #  in env and use shell=False in the subprocess.Popen() command.
+    # add to the rtCommon dir to the PYTHONPATH env variable
+    env = os.environ.copy()
+    env['PYTHONPATH'] = f'\"{rootDir}:' + env.get('PYTHONPATH', '') + '\"'
+    return env
+
+
 def procOutputReader(proc, lineQueue):
     """Read output from runSession process and queue into lineQueue for logging"""
     for bline in iter(proc.stdout.readline, b''):
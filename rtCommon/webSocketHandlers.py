@@ -36,6 +36,7 @@ class BaseWebSocketHandler(tornado.websocket.WebSocketHandler):
         """
         self.name = name
         self.connNotify = connNotify
+        self.sessionId = None
         if websocketState.wsConnectionLists.get(name) is None:
             websocketState.wsConnectionLists[name] = []
         if callback is not None:
@@ -54,6 +55,8 @@ class BaseWebSocketHandler(tornado.websocket.WebSocketHandler):
             return
         logging.log(DebugLevels.L1, f"{self.name} WebSocket opened")
         self.set_nodelay(True)
+        # A remote service reconnecting with the same sessionId can resume its requests
+        self.sessionId = self.get_argument('sessionId', None)
         websocketState.wsConnLock.acquire()
         try:
             wsConnections = websocketState.wsConnectionLists.get(self.name)
@@ -92,13 +95,24 @@ class BaseWebSocketHandler(tornado.websocket.WebSocketHandler):
 
 
 class DataWebSocketHandler(BaseWebSocketHandler):
-    """Sub-class the base handler in order to clean up any outstanding requests on close."""
+    """
+    Sub-class the base handler in order to clean up any outstanding requests on close,
+    or to resume them when the remote service reconnects with the same sessionId.
+    """
+    def open(self):
+        super().open()
+        if self.sessionId is None or self not in websocketState.wsConnectionLists.get(self.name, []):
+            return
+        callback_func = websocketState.wsCallbacks.get(self.name)
+        requestHandler = callback_func.__self__
+        requestHandler.resume_pending_requests(self.name, self)
+
     def on_close(self):
         super().on_close()
         # get the corresponding RequestHandler object so we can clear any waiting threads
         callback_func = websocketState.wsCallbacks.get(self.name)
         requestHandler = callback_func.__self__
-        requestHandler.close_pending_requests(self.name)
+        requestHandler.close_pending_requests(self.name, self)
 
 
 class RejectWebSocketHandler(tornado.websocket.WebSocketHandler):
@@ -169,7 +183,14 @@ class RequestHandler:
     Class for handling remote requests (such with a remote DataInterface). Each data requests is
     given a unique ID and callbacks from the client are matched to the original request and results
     returned to the corresponding caller.
+
+    If the remote service connected with a sessionId, its pending requests are kept for
+    resumeTimeout seconds after the connection closes. When the service reconnects with
+    the same sessionId the requests are re-sent on the new connection along with the list
+    of multipart parts already received, so only the missing parts are transferred.
     """
+    resumeTimeout = 30
+
     def __init__(self, name, ioLoopInst):
         self.dataCallbacks = {}
         self.dataSequenceNum = 0
@@ -216,8 +237,11 @@ class RequestHandler:
         if not callId:
             callbackStruct = StructDict()
             callbackStruct.dataConn = reqConn
+            callbackStruct.sessionId = getattr(reqConn, 'sessionId', None)
+            callbackStruct.detached = False
             callbackStruct.numResponses = 0
             callbackStruct.responses = []
+            callbackStruct.partsReceived = set()
             callbackStruct.semaphore = threading.Semaphore(value=0)
             callbackStruct.timeStamp = time.time()
             callbackStruct.msg = msg.copy()
@@ -228,6 +252,7 @@ class RequestHandler:
                 self.dataSequenceNum += 1
                 callId = self.dataSequenceNum
                 callbackStruct.callId = callId
+                callbackStruct.msg['callId'] = callId
                 msg['callId'] = callId
                 self.dataCallbacks[callId] = callbackStruct
             finally:
@@ -265,6 +290,12 @@ class RequestHandler:
             if callbackStruct.callId != callId:
                 # This should never happen
                 raise StateError('callId mismtach {} {}'.format(callbackStruct.callId, callId))
+            partId = response.get('partId')
+            if partId is not None:
+                if partId in callbackStruct.partsReceived:
+                    # duplicate part re-sent after a reconnect
+                    return
+                callbackStruct.partsReceived.add(partId)
             callbackStruct.responses.append(response)
             callbackStruct.numResponses += 1
             callbackStruct.semaphore.release()
@@ -321,25 +352,98 @@ class RequestHandler:
         response['callId'] = callbackStruct.callId
         return response
 
-    def close_pending_requests(self):
-        """Close requests and signal any threads waiting for responses."""
+    def close_pending_requests(self, conn, allowResume=True):
+        """
+        Close requests sent on connection conn and signal any threads waiting for responses.
+        Requests from a connection with a sessionId are instead held for resumeTimeout
+        seconds in case the remote service reconnects. If the service has already
+        reconnected with the same sessionId (the old connection's close can be handled
+        after the new connection opened), the requests are re-sent on the new connection.
+        """
+        resumeMsgs = []
+        liveConn = None
         self.callbackLock.acquire()
         try:
+            # Look for the new connection while holding callbackLock, a connection
+            #   opened after this resumes the detached requests itself
+            if allowResume and getattr(conn, 'sessionId', None) is not None:
+                liveConn = self._getSessionConnection(conn.sessionId, exclude=conn)
             # signal the close to anyone waiting for replies
             callIdsToRemove = []
+            numDetached = 0
             for callId, cb in self.dataCallbacks.items():
-                if cb.dataConn == self:
-                    callIdsToRemove.append(callId)
-                    cb.status = 499
-                    cb.error = 'Client closed connection'
-                    # TODO - check this logic
-                    cb.responses.append({'cmd': 'unknown', 'status': cb.status, 'error': cb.error})
-                    for _ in range(len(cb.responses)):
-                        cb.semaphore.release()
+                if cb.dataConn != conn:
+                    continue
+                if allowResume and cb.sessionId is not None:
+                    if liveConn is not None:
+                        resumeMsgs.append(self._prepareResume(cb, liveConn))
+                        continue
+                    cb.detached = True
+                    numDetached += 1
+                    continue
+                callIdsToRemove.append(callId)
+                cb.status = 499
+                cb.error = 'Client closed connection'
+                # TODO - check this logic
+                cb.responses.append({'cmd': 'unknown', 'status': cb.status, 'error': cb.error})
+                for _ in range(len(cb.responses)):
+                    cb.semaphore.release()
             for callId in callIdsToRemove:
                 self.dataCallbacks.pop(callId, None)
         finally:
             self.callbackLock.release()
+        self._sendResumeMsgs(resumeMsgs, liveConn)
+        if numDetached > 0:
+            logging.info(f'RequestHandler {self.name}: holding {numDetached} requests '
+                         f'{self.resumeTimeout}s for reconnect')
+            # fail the requests if the service hasn't reconnected by then
+            expireTimer = threading.Timer(self.resumeTimeout, self.close_pending_requests,
+                                          args=(conn,), kwargs={'allowResume': False})
+            expireTimer.setDaemon(True)
+            expireTimer.start()
+
+    def resume_pending_requests(self, conn):
+        """
+        Re-send the detached requests belonging to conn's sessionId on the new connection.
+        Multipart parts already received are listed in the request so they aren't re-sent.
+        """
+        resumeMsgs = []
+        self.callbackLock.acquire()
+        try:
+            for cb in self.dataCallbacks.values():
+                if cb.detached is not True or cb.sessionId != conn.sessionId:
+                    continue
+                resumeMsgs.append(self._prepareResume(cb, conn))
+        finally:
+            self.callbackLock.release()
+        self._sendResumeMsgs(resumeMsgs, conn)
+
+    def _getSessionConnection(self, sessionId, exclude=None):
+        """Returns the most recent open connection with sessionId, other than exclude"""
+        websocketState.wsConnLock.acquire()
+        try:
+            for wsConn in reversed(websocketState.wsConnectionLists.get(self.name, [])):
+                if wsConn is not exclude and getattr(wsConn, 'sessionId', None) == sessionId:
+                    return wsConn
+        finally:
+            websocketState.wsConnLock.release()
+        return None
+
+    def _prepareResume(self, cb, conn):
+        """Moves a request to conn and returns the message to re-send. Call with callbackLock held."""
+        cb.dataConn = conn
+        cb.detached = False
+        msg = cb.msg.copy()
+        msg['resume'] = True
+        msg['partsReceived'] = sorted(cb.partsReceived)
+        return msg
+
+    def _sendResumeMsgs(self, resumeMsgs, conn):
+        if len(resumeMsgs) > 0:
+            logging.info(f'RequestHandler {self.name}: resuming {len(resumeMsgs)} requests')
+        for msg in resumeMsgs:
+            self.ioLoopInst.add_callback(sendWebSocketMessage, wsName=self.name,
+                                         msg=json.dumps(msg), conn=conn)
 
     def pruneCallbacks(self):
         """Remove any orphaned callback structures that never got a response back."""
@@ -8,11 +8,14 @@ import sys
 import re
 import time
 import json
+import uuid
 import pickle
 import logging
 import argparse
 import threading
 import websocket
+from collections import OrderedDict
+from rtCommon.structDict import StructDict
 from rtCommon.remoteable import RemoteHandler
 from rtCommon.utils import DebugLevels, trimDictBytes, md5SumFile
 from rtCommon.errors import StateError
@@ -24,6 +27,12 @@ class WsRemoteService:
     remoteHandler = RemoteHandler()
     commLock = threading.Lock()
     shouldExit = False
+    # Results of recent requests by callId, used to resume a reply after a reconnect
+    #   without re-running the request. Bounded by number of results and total bytes.
+    resultCache = OrderedDict()
+    resultCacheSize = 4
+    resultCacheMaxBytes = 256 * 2**20
+    resultCacheLock = threading.Lock()
 
     def __init__(self, args, channelName):
         """
@@ -36,6 +45,9 @@ class WsRemoteService:
         self.sessionCookie = None
         self.needLogin = True
         self.started = False
+        # Identifies this service across reconnects so the projectServer can
+        #   resume requests that were in-flight when the connection dropped
+        self.sessionId = uuid.uuid4().hex
 
         # # Starts the receiver in it's own thread
         # self.recvThread = threading.Thread(name='recvThread', target=self.wsReceiver)
@@ -50,6 +62,13 @@ class WsRemoteService:
         """Register the class that will handle the received requests via the class name"""
         WsRemoteService.remoteHandler.registerClassNameInstance(className, classInstance)
 
+    def addSessionHandlerClass(self, classType, factory):
+        """
+        Register a function that creates a new classType instance. Requests from each
+        projectServer client session are then handled by that session's own instance.
+        """
+        WsRemoteService.remoteHandler.registerSessionFactory(classType, factory)
+
     def runForever(self):
         """Run the receiver loop. This function doesn't return."""
         # go into loop trying to do webSocket connection periodically
@@ -67,6 +86,7 @@ class WsRemoteService:
                     sslopts = None
                 else:
                     sslopts = {"ca_certs": getSslCertFilePath()}
+                wsAddr += f'?sessionId={self.sessionId}'
                 logging.log(DebugLevels.L6, "Trying connection: %s", wsAddr)
                 ws = websocket.WebSocketApp(wsAddr,
                                             on_message=WsRemoteService.on_message,
@@ -108,37 +128,46 @@ class WsRemoteService:
             request = decodeByteTypeArgs(request)
             # print(f'on_message: message {request} type: {type(request)}')
             # create the response message but without data objects
-            response = {k: v for k, v in request.items() if k not in {'data', 'args', 'kwargs'}}
+            response = {k: v for k, v in request.items()
+                        if k not in {'data', 'args', 'kwargs', 'resume', 'partsReceived'}}
             trimDictBytes(response)
             cmd = request.get('cmd')
-            # decode any encoded byte args
-            callResult = WsRemoteService.remoteHandler.runRemoteCall(request)
-            # serialize and return the callResult data
-            # print(f'callresult type: {type(callResult)}')
-            # TODO - move all this encoding code to a function such as
-            #   encodeResultMessage() or similar
-
-            if isNativeType(callResult):
-                if type(callResult) == bytes:
-                    data = callResult
-                    response['dataSerialization'] = 'bytes'
-                else:
-                    # encode to json and then as a byte array
-                    data = json.dumps(callResult).encode()
-                    response['dataSerialization'] = 'json'
+            callId = request.get('callId')
+            # Parts of the reply the projectServer received before a reconnect
+            partsReceived = request.get('partsReceived')
+            cached = None
+            if request.get('resume') is True:
+                # Request re-sent after a reconnect, reuse the result if we have it
+                cached = WsRemoteService.getCachedResult(callId)
+            if cached is not None:
+                data, serialization = cached
+            elif partsReceived:
+                # The received parts are from a result that is no longer cached, a
+                #   re-run could return different data so the parts can't be completed
+                raise StateError(f"result of resumed request {callId} is no longer "
+                                 "available, the request must be retried")
             else:
-                # note pickle produces a byte array also
-                data = pickle.dumps(callResult)
-                response['dataSerialization'] = 'pickle'
-            if type(data) != bytes:
-                raise StateError(f"WsRemoteService: on_message: expecting callResult type " \
-                                 f"bytes: got {type(data)}")
+                cacheEntry = WsRemoteService.startCachedResult(callId)
+                try:
+                    callResult = WsRemoteService.remoteHandler.runRemoteCall(request)
+                    # serialize and return the callResult data
+                    data, serialization = encodeCallResult(callResult)
+                    WsRemoteService.setCachedResult(cacheEntry, (data, serialization))
+                finally:
+                    cacheEntry.event.set()
+            response['dataSerialization'] = serialization
             response['status'] = 200
             compress = False
             if len(data) > 1024 * 1024:
                 compress = True
-            for msgPart in generateDataParts(data, response, compress=compress):
+            # Only send the parts the projectServer hasn't received yet
+            for msgPart in generateDataParts(data, response, compress=compress,
+                                             skipParts=partsReceived):
                 WsRemoteService.send_response(client, msgPart)
+        except websocket.WebSocketConnectionClosedException:
+            # The projectServer will re-send the request when we reconnect
+            logging.info(f"RPC {cmd}: connection closed before reply was sent")
+            return
         except Exception as err:
             errStr = "RPC Exception: {}: {}".format(cmd, err)
             print(errStr)
@@ -148,6 +177,43 @@ class WsRemoteService:
                 sys.exit()
             return
 
+    @staticmethod
+    def startCachedResult(callId):
+        """Add a result cache entry for a request that is starting to run"""
+        cacheEntry = StructDict({'event': threading.Event(), 'result': None, 'numBytes': 0})
+        with WsRemoteService.resultCacheLock:
+            WsRemoteService.resultCache[callId] = cacheEntry
+            while len(WsRemoteService.resultCache) > WsRemoteService.resultCacheSize:
+                WsRemoteService.resultCache.popitem(last=False)
+        return cacheEntry
+
+    @staticmethod
+    def setCachedResult(cacheEntry, result):
+        """
+        Set the (data, serialization) result of a cache entry, evicting the oldest
+        results while the cached data exceeds resultCacheMaxBytes
+        """
+        with WsRemoteService.resultCacheLock:
+            cacheEntry.result = result
+            cacheEntry.numBytes = len(result[0])
+            cacheBytes = sum(entry.numBytes for entry in WsRemoteService.resultCache.values())
+            while cacheBytes > WsRemoteService.resultCacheMaxBytes:
+                _, evicted = WsRemoteService.resultCache.popitem(last=False)
+                cacheBytes -= evicted.numBytes
+
+    @staticmethod
+    def getCachedResult(callId, timeout=60):
+        """
+        Returns the (data, serialization) result of a previous request with callId,
+        waiting for it if the request is still running, or None if not available.
+        """
+        with WsRemoteService.resultCacheLock:
+            cacheEntry = WsRemoteService.resultCache.get(callId)
+        if cacheEntry is None:
+            return None
+        cacheEntry.event.wait(timeout)
+        return cacheEntry.result
+
     @staticmethod
     def on_message(client, message):
         """
@@ -178,6 +244,26 @@ class WsRemoteService:
         logging.info(f'Connection closed {code} {reason}')
 
 
+def encodeCallResult(callResult):
+    """Serialize a call result to bytes, returns the bytes and the serialization type"""
+    if isNativeType(callResult):
+        if type(callResult) == bytes:
+            data = callResult
+            serialization = 'bytes'
+        else:
+            # encode to json and then as a byte array
+            data = json.dumps(callResult).encode()
+            serialization = 'json'
+    else:
+        # note pickle produces a byte array also
+        data = pickle.dumps(callResult)
+        serialization = 'pickle'
+    if type(data) != bytes:
+        raise StateError(f"WsRemoteService: on_message: expecting callResult type " \
+                         f"bytes: got {type(data)}")
+    return data, serialization
+
+
 def isNativeType(var):
     nativeTypes = (int, float, str, bytes, list, dict, set, tuple, bytearray, memoryview, range, complex)
     if type(var) in nativeTypes:
@@ -538,6 +538,78 @@ def testSequenceAppend(bidsArchive4D, validBidsI, imageMetadata):
     assert isValidBidsArchive(bidsArchive4D.rootPath)
 
 
+# Test appends to an uncompressed image are written in place at the end of the
+# file, with the same result as re-writing the whole image
+def testInPlaceAppend(bidsArchive4D, validBidsI, imageMetadata):
+    entities = filterEntities(imageMetadata)
+    imagePath = bidsArchive4D.getImages(**entities)[0].path
+    assert imagePath.endswith('.nii')
+    originalData = np.array(getNiftiData(nib.load(imagePath)))
+    appendedData = [originalData]
+    NUM_APPENDS = 3
+    for i in range(NUM_APPENDS):
+        incrementAcquisitionValues(validBidsI)
+        assert bidsArchive4D._appendIncremental(validBidsI)
+        appendedData.append(validBidsI.getImageData())
+        assert imagePath in bidsArchive4D.inPlaceAppends
+
+    image = nib.load(imagePath, mmap=False)
+    expectedData = np.concatenate(appendedData, axis=3)
+    assert image.header.get_data_shape() == expectedData.shape
+    assert np.array_equal(getNiftiData(image), expectedData)
+    assert os.path.getsize(imagePath) == \
+        image.dataobj.offset + expectedData.nbytes
+
+    # Appending still validates the incrementals against the archive image
+    validBidsI.image.header['datatype'] = 32
+    with pytest.raises(MetadataMismatchError):
+        bidsArchive4D._appendIncremental(validBidsI)
+
+    # A change to the file by something else falls back to a full re-write
+    nib.save(nib.Nifti1Image(originalData, image.affine, image.header),
+             imagePath)
+    validBidsI.image.header['datatype'] = image.header['datatype']
+    assert bidsArchive4D._appendIncremental(validBidsI)
+    image = nib.load(imagePath, mmap=False)
+    assert image.header.get_data_shape()[3] == \
+        originalData.shape[3] + validBidsI.getImageDimensions()[3]
+
+
+# Test appends update the archive's index rather than re-building the PyBids
+# layout, which is re-built when it's next used
+def testAppendNoLayoutRebuild(tmpdir, validBidsI, imageMetadata, monkeypatch):
+    import rtCommon.bidsArchive as bidsArchiveModule
+    layoutBuilds = []
+
+    def countingLayout(*args, **kwargs):
+        layoutBuilds.append(args)
+        return bids_layout(*args, **kwargs)
+
+    bids_layout = bidsArchiveModule.BIDSLayout
+    monkeypatch.setattr(bidsArchiveModule, 'BIDSLayout', countingLayout)
+
+    archive = BidsArchive(Path(tmpdir, 'noRebuild'))
+    assert archive.isEmpty()
+    for i in range(3):
+        assert archive._appendIncremental(validBidsI)
+    validBidsI.setMetadataField('run', 2)
+    assert archive._appendIncremental(validBidsI)
+    assert len(layoutBuilds) == 0
+
+    assert not archive.isEmpty()
+    assert archive.index.hasFile(validBidsI.getImageFilePath())
+    images = archive.getImages(**filterEntities(imageMetadata))
+    assert len(layoutBuilds) == 1
+    assert len(images) == 1
+    assert images[0].get_image().shape[3] == \
+        3 * validBidsI.getImageDimensions()[3]
+    assert len(archive.getImages(run=2)) == 1
+
+    # The layout is only re-built after the archive changes
+    archive.getImages()
+    assert len(layoutBuilds) == 1
+
+
 # Test appending a new subject (and thus creating a new directory) to a
 # non-empty BIDS Archive
 def testAppendNewSubject(bidsArchive4D, validBidsI):
@@ -1,15 +1,22 @@
 import logging
+import os
 
 import numpy as np
 import pytest
 
 from rtCommon.bidsCommon import (
     adjustTimeUnits,
+    DicomMetadataCache,
     getDicomMetadata,
     getNiftiData,
     loadBidsEntities,
     metadataFromProtocolName,
 )
+from rtCommon.imageHandling import readDicomFromFile, anonymizeDicom
+from tests.common import rtCloudPath
+
+test_sampleProjectDicomPath = os.path.join(rtCloudPath, 'projects', 'sample',
+    'dicomDir', '20190219.0219191_faceMatching.0219191_faceMatching')
 
 logger = logging.getLogger(__name__)
 
@@ -80,6 +87,68 @@ def testMetadataExtraction(dicomImage, dicomMetadataSample):
         assert metadata.get(field) == str(value)
 
 
+# Test the per-series metadata template gives the same metadata as a full parse
+#   of each volume, including the fields that change from volume to volume
+@pytest.mark.parametrize("kind", ['all', 'public'])
+def testDicomMetadataCache(kind):
+    cache = DicomMetadataCache(kind=kind)
+    for volIdx in range(1, 8):
+        dicomFile = os.path.join(test_sampleProjectDicomPath,
+                                 f'001_000013_{volIdx:06d}.dcm')
+        dicomImg = anonymizeDicom(readDicomFromFile(dicomFile))
+        metadata = cache.getMetadata(dicomImg)
+        assert metadata == getDicomMetadata(dicomImg, kind=kind)
+        # the returned dict is a copy, changing it doesn't change the template
+        metadata['subject'] = 'test'
+    assert cache.numVolumes == 7
+    assert cache.volumeTags
+    for field in ['InstanceNumber', 'AcquisitionTime', 'SOPInstanceUID']:
+        assert field in cache.volumeTags.values()
+    # a volume from another series starts a new template
+    dicomImg = readDicomFromFile(dicomFile)
+    dicomImg.SeriesInstanceUID = dicomImg.SeriesInstanceUID + '.1'
+    metadata = cache.getMetadata(dicomImg)
+    assert metadata == getDicomMetadata(dicomImg, kind=kind)
+    assert cache.numVolumes == 1
+
+
+# Test fields that start changing after the first two volumes are picked up
+def testDicomMetadataCacheNewFields():
+    def readVolume(volIdx):
+        dicomFile = os.path.join(test_sampleProjectDicomPath,
+                                 f'001_000013_{volIdx:06d}.dcm')
+        return readDicomFromFile(dicomFile)
+
+    cache = DicomMetadataCache(kind='public')
+    for volIdx in range(1, 4):
+        cache.getMetadata(readVolume(volIdx))
+    # a field added later in the series changes the volume's set of tags
+    dicomImg = readVolume(4)
+    dicomImg.PatientComments = 'moved'
+    metadata = cache.getMetadata(dicomImg)
+    assert metadata == getDicomMetadata(dicomImg, kind='public')
+    assert metadata['PatientComments'] == 'moved'
+    dicomImg = readVolume(5)
+    dicomImg.PatientComments = 'moved again'
+    assert cache.getMetadata(dicomImg) == getDicomMetadata(dicomImg, kind='public')
+    # and is dropped again for a volume that doesn't have it
+    dicomImg = readVolume(6)
+    assert cache.getMetadata(dicomImg) == getDicomMetadata(dicomImg, kind='public')
+
+    # a field whose value changes with the same set of tags needs relearnInterval
+    cache = DicomMetadataCache(kind='public', relearnInterval=2)
+    for volIdx in range(1, 4):
+        cache.getMetadata(readVolume(volIdx))
+    dicomImg = readVolume(4)
+    dicomImg.PatientName = 'changed'
+    metadata = cache.getMetadata(dicomImg)
+    assert metadata == getDicomMetadata(dicomImg, kind='public')
+    assert metadata['PatientsName'] == 'changed'
+    dicomImg = readVolume(5)
+    dicomImg.PatientName = 'changed again'
+    assert cache.getMetadata(dicomImg)['PatientsName'] == 'changed again'
+
+
 # Ensure entitity dictionary is loaded and parsed properly
 # Expected dictionary format:
 #   key: Full entity name, all lowercase
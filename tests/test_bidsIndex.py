@@ -0,0 +1,109 @@
+from pathlib import Path
+import json
+import os
+
+from rtCommon.bidsIndex import BidsIndex, parseBidsPath
+
+
+# Test entities are parsed from paths the same way PyBids does
+def testParseBidsPath(bidsArchive4D):
+    for image in bidsArchive4D.getImages():
+        relPath = os.path.relpath(image.path, bidsArchive4D.rootPath)
+        assert parseBidsPath(relPath) == image.get_entities(metadata=False)
+
+    entities = parseBidsPath('sub-02/ses-03/func/'
+                             'sub-02_ses-03_task-story_run-02_events.tsv')
+    assert entities == {'subject': '02', 'session': '03', 'task': 'story',
+                        'run': 2, 'suffix': 'events', 'datatype': 'func',
+                        'extension': '.tsv'}
+    assert str(entities['run']) == '02'
+
+
+# Test the index is built from the archive's files and updated one at a time
+def testBidsIndex(tmpdir, bidsArchive4D, validBidsI):
+    index = BidsIndex(bidsArchive4D.rootPath)
+    archiveFiles = bidsArchive4D.data.get(return_type='filename')
+    assert len(index) == len(archiveFiles)
+    for path in archiveFiles:
+        assert index.hasFile(path)
+    assert not index.hasFile('sub-99/func/sub-99_task-faces_bold.nii')
+
+    images = index.getFiles(subject='01', suffix='bold', extension='.nii')
+    assert len(images) == 1
+    assert index.getEntities(images[0])['task'] == 'faces'
+
+    validBidsI.setMetadataField('subject', '02')
+    newFiles = validBidsI.writeToDisk(bidsArchive4D.rootPath, onlyData=True)
+    assert len(index.getFiles(subject='02')) == 0
+    for path in newFiles:
+        index.addFile(path)
+    assert len(index.getFiles(subject='02')) == len(newFiles)
+
+    index.removeFile(newFiles[0])
+    assert not index.hasFile(newFiles[0])
+    index.rescan()
+    assert index.hasFile(newFiles[0])
+
+    # Directories that aren't part of the raw dataset aren't indexed
+    derivativesDir = Path(bidsArchive4D.rootPath, 'derivatives')
+    os.makedirs(derivativesDir)
+    Path(derivativesDir, 'sub-01_task-faces_bold.nii').touch()
+    index.rescan()
+    assert len(index.getFiles(subject='01', suffix='bold',
+                              extension='.nii')) == 1
+
+    emptyIndex = BidsIndex(Path(tmpdir, 'doesNotExist'))
+    assert len(emptyIndex) == 0
+
+
+# Test exact lookups, and that entity values are matched like PyBids does
+def testGetFilesExact(bidsArchive4D, sampleBidsEntities):
+    index = BidsIndex(bidsArchive4D.rootPath)
+    entities = sampleBidsEntities.copy()
+    entities['suffix'] = 'bold'
+    assert len(index.getFiles(matchExact=True, **entities)) == 2
+    assert len(index.getFiles(matchExact=True, extension='.nii',
+                              **entities)) == 1
+
+    del entities['run']
+    assert len(index.getFiles(matchExact=True, **entities)) == 0
+    assert len(index.getFiles(**entities)) == 2
+
+    # Run numbers match as ints or zero-padded strings
+    assert index.getFiles(run=1) == index.getFiles(run='01')
+    assert len(index.getFiles(suffix=['bold', 'events'],
+                              extension=['.nii', '.tsv'])) == 2
+
+
+# Test metadata and events are inherited from higher level files
+def testInheritanceChain(bidsArchive4D, sampleBidsEntities):
+    index = BidsIndex(bidsArchive4D.rootPath)
+    imagePath = index.getFiles(extension='.nii', **sampleBidsEntities)[0]
+    image = bidsArchive4D.data.get_file(
+        os.path.join(bidsArchive4D.rootPath, imagePath))
+    assert index.getMetadata(imagePath) == image.get_entities(metadata=True)
+
+    sidecars = index.getInheritanceChain(imagePath)
+    assert len(sidecars) == 1
+
+    # A top-level sidecar is less specific than the run's sidecar
+    taskSidecar = Path(bidsArchive4D.rootPath, 'task-faces_bold.json')
+    taskSidecar.write_text(json.dumps({'TaskDescription': 'faces',
+                                       'RepetitionTime': 100}))
+    index.addFile(str(taskSidecar))
+    assert index.getInheritanceChain(imagePath) == \
+        ['task-faces_bold.json'] + sidecars
+    metadata = index.getMetadata(imagePath)
+    assert metadata['TaskDescription'] == 'faces'
+    assert metadata['RepetitionTime'] != 100
+
+    # Sidecars of other tasks aren't inherited
+    otherSidecar = Path(bidsArchive4D.rootPath, 'task-other_bold.json')
+    otherSidecar.write_text(json.dumps({'TaskDescription': 'other'}))
+    index.addFile(str(otherSidecar))
+    assert 'task-other_bold.json' not in index.getInheritanceChain(imagePath)
+
+    events = index.getInheritanceChain(imagePath, suffix='events',
+                                       extensions=('.tsv', '.tsv.gz'))
+    assert len(events) == 1
+    assert index.getEntities(events[0])['suffix'] == 'events'
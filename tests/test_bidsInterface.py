@@ -123,6 +123,15 @@ def dicomStreamTest(bidsInterface, anonymize=True):
     print(f"Dicom stream check: image {idx}")
     assert streamIncremental == localIncremental
 
+    # Open a second stream on the same directory, it has its own position
+    streamId2 = bidsInterface.initDicomBidsStream(test_sampleProjectDicomPath,
+                                                  "001_000013_{TR:06d}.dcm",
+                                                  300*1024, anonymize=anonymize,
+                                                  **entities)
+    assert streamId2 != streamId
+    streamIncremental = bidsInterface.getIncremental(streamId2)
+    assert streamIncremental == readLocalDicomIncremental(0, anonymize=anonymize, **entities)
+
     # Resume without specifying volumes
     for idx in [*range(8, 10)]:
         # get the incremental from the stream
@@ -130,6 +139,8 @@ def dicomStreamTest(bidsInterface, anonymize=True):
         localIncremental = readLocalDicomIncremental(idx, anonymize=anonymize, **entities)
         print(f"Dicom stream check: image {idx}")
         assert streamIncremental == localIncremental
+    bidsInterface.closeStream(streamId2)
+    bidsInterface.closeStream(streamId)
 
     # check clock skew function
     rtt = utils.calcAvgRoundTripTime(bidsInterface.ping)
@@ -190,3 +201,52 @@ def openNeuroStreamTest(bidsInterface):
         localIncremental = localBidsRun.getIncremental(idx)
         print(f"OpenNeuro bidsRun check: image {idx}")
         assert streamIncremental == localIncremental
+
+
+# Test a lazy stream reads the same volumes as a stream of the loaded run
+def test_lazyBidsStream(bidsArchive4D, sampleBidsEntities):
+    import numpy as np
+    from rtCommon.bidsInterface import BidsStream
+    bidsStream = BidsStream(bidsArchive4D.rootPath, **sampleBidsEntities)
+    for prefetch in [0, 2]:
+        lazyStream = BidsStream(bidsArchive4D.rootPath, lazy=True,
+                                prefetch=prefetch, **sampleBidsEntities)
+        assert lazyStream.bidsRun is None
+        numVolumes = bidsStream.getNumVolumes()
+        assert lazyStream.getNumVolumes() == numVolumes
+        for volIdx in [*range(numVolumes), 0]:
+            incremental = bidsStream.getIncremental(volIdx)
+            lazyIncremental = lazyStream.getIncremental(volIdx)
+            assert lazyIncremental.getEntities() == incremental.getEntities()
+            assert lazyIncremental.getImageMetadata() == \
+                incremental.getImageMetadata()
+            assert np.array_equal(lazyIncremental.getImageData(),
+                                  incremental.getImageData())
+        assert lazyStream.getIncremental(-1) is not None
+        lazyStream.getIncremental(numVolumes - 1)
+        assert lazyStream.getIncremental() is None
+        lazyStream.close()
+        if prefetch > 0:
+            assert not lazyStream.lazyRun.prefetchThread.is_alive()
+
+
+# Test a DICOM stream that has fallen behind converts the written volumes together
+def test_dicomStreamCatchUp():
+    from rtCommon.bidsInterface import DicomToBidsStream
+    entities = {'subject': '01', 'task': 'test', 'run': 1, 'suffix': 'bold', 'datatype': 'func'}
+    dicomStream = DicomToBidsStream(allowedDirs=allowedDirs, catchUpVolumes=4)
+    dicomStream.initStream(test_sampleProjectDicomPath, "001_000013_{TR:06d}.dcm",
+                           300*1024, anonymize=False, **entities)
+    streamIncremental = dicomStream.getIncremental()
+    assert sorted(dicomStream.convertedBacklog.keys()) == [1, 2, 3]
+    assert streamIncremental == readLocalDicomIncremental(0, anonymize=False, **entities)
+    for volIdx in [1, 2, 3, 4]:
+        streamIncremental = dicomStream.getIncremental()
+        assert streamIncremental == readLocalDicomIncremental(volIdx, anonymize=False,
+                                                              **entities)
+    assert sorted(dicomStream.convertedBacklog.keys()) == [5, 6, 7]
+    # seeking drops the volumes converted ahead
+    streamIncremental = dicomStream.getIncremental(volIdx=8)
+    assert streamIncremental == readLocalDicomIncremental(8, anonymize=False, **entities)
+    assert 6 not in dicomStream.convertedBacklog
+    dicomStream.close()
@@ -50,6 +50,24 @@ class TestDataInterface:
         runReadWriteFileTest(dataInterface, bigTestFile, isUsingProjectServer=False)
         return
 
+    def test_watchFileAfterScannerStream(self):
+        """initScannerStream without a prior initWatch sets the watch used by watchFile"""
+        dataInterface = DataInterface(dataRemote=False,
+                                      allowedDirs=allowedDirs,
+                                      allowedFileTypes=allowedFileTypes)
+        streamId = dataInterface.initScannerStream(sampleProjectDicomDir,
+                                                   "001_000013_{TR:06d}.dcm",
+                                                   300*1024, anonymize=False)
+        filename = "001_000013_000003.dcm"
+        data = dataInterface.watchFile(filename, timeout=5)
+        directData = dataInterface.getFile(os.path.join(sampleProjectDicomDir, filename))
+        assert data == directData
+        # closing the stream keeps the primary watch
+        dataInterface.closeStream(streamId)
+        data = dataInterface.watchFile(os.path.join(sampleProjectDicomDir, filename), timeout=5)
+        assert data == directData
+        dataInterface.close()
+
     # Remote dataInterface test
     def test_rpyclocalDataInterface(self, dicomTestFilename, bigTestFile, mediumTestFile):
         # Use a remote (RPC) client to the dataInterface
@@ -233,6 +251,49 @@ def runDataInterfaceMethodTests(dataInterface, dicomTestFilename):
     assert regImage != anonImage
     assert countUnanonymizedSensitiveAttrs(regImage) >= 1
     assert countUnanonymizedSensitiveAttrs(anonImage) == 0
+    # the anonymized Dicom bytes are the same Dicom as anonymizing the parsed image
+    anonBytes = dataInterface.getImageDataBytes(streamId, 2)
+    assert type(anonBytes) is bytes
+    assert readDicomFromBuffer(anonBytes) == anonImage
+    assert len(anonBytes) < os.path.getsize(directPath)
+
+    # Test two streams open at the same time keep their own position
+    streamA = dataInterface.initScannerStream(sampleProjectDicomDir,
+                                              "001_000013_{TR:06d}.dcm",
+                                              300*1024, anonymize=False)
+    streamB = dataInterface.initScannerStream(sampleProjectDicomDir,
+                                              "001_000013_{TR:06d}.dcm",
+                                              300*1024, anonymize=False)
+    assert streamA != streamB
+    imageA0 = dataInterface.getImageData(streamA)
+    imageB5 = dataInterface.getImageData(streamB, 5)
+    imageA1 = dataInterface.getImageData(streamA)
+    imageB6 = dataInterface.getImageData(streamB)
+    assert imageA1 != imageA0
+    for image, idx in [(imageA0, 0), (imageA1, 1), (imageB5, 5), (imageB6, 6)]:
+        directPath = os.path.join(sampleProjectDicomDir, "001_000013_{TR:06d}.dcm".format(TR=idx))
+        assert image == readDicomFromFile(directPath)
+    dataInterface.closeStream(streamA)
+    with pytest.raises((ValidationError, Exception)):
+        dataInterface.getImageData(streamA)
+    dataInterface.closeStream(streamB)
+
+    # Test discovering a new series directory and streaming from it
+    seriesTopDir = os.path.join(tmpDir, 'seriesWatch')
+    shutil.rmtree(seriesTopDir, ignore_errors=True)
+    os.makedirs(seriesTopDir)
+    dataInterface.initSeriesWatch(seriesTopDir, '*.dcm', 300*1024)
+    with pytest.raises((TimeoutError, Exception)):
+        dataInterface.waitForNewSeries(seriesTopDir, timeout=1)
+    seriesDir = os.path.join(seriesTopDir, 'series_013')
+    os.makedirs(seriesDir)
+    assert dataInterface.waitForNewSeries(seriesTopDir, timeout=5) == seriesDir
+    streamId = dataInterface.initScannerStream(seriesDir, "001_000013_{TR:06d}.dcm",
+                                               300*1024, anonymize=False)
+    shutil.copy(os.path.join(sampleProjectDicomDir, "001_000013_000000.dcm"), seriesDir)
+    seriesImage = dataInterface.getImageData(streamId, 0)
+    assert seriesImage == readDicomFromFile(os.path.join(sampleProjectDicomDir, "001_000013_000000.dcm"))
+    dataInterface.closeStream(streamId)
 
     # Test timeouts of getImageData
     # set a directory and image pattern that won't exist so will timeout
@@ -3,6 +3,7 @@ import threading
 import random
 import time
 import pytest
+from collections import deque
 import rtCommon.fileWatcher as fileWatcher
 from rtCommon.errors import StateError
 from tests.common import tmpDir, rtCloudPath
@@ -47,13 +48,19 @@ def startCopyThread(numFiles=10):
     return copyThread
 
 
-def test_waitForFile():
+@pytest.fixture(params=[False, True], ids=['events', 'polling'])
+def usePolling(request):
+    """Run the watcher tests with the platform's event based FileWatcher and the polling one"""
+    return request.param
+
+
+def test_waitForFile(usePolling):
     """Test to make sure file events are being triggered"""
     global exitThread, watchTmpPath, rndTimeouts
 
     clearWatchDir()
 
-    watcher = fileWatcher.FileWatcher()
+    watcher = fileWatcher.FileWatcher(usePolling=usePolling)
     watcher.initFileNotifier(watchTmpPath, '*.dcm', 300000)
 
     copyThread = startCopyThread()
@@ -77,7 +84,7 @@ def test_waitForFile():
         copyThread.join()
 
 
-def test_waitForFile_noEvents():
+def test_waitForFile_noEvents(usePolling):
     # Init a file watcher on the wrong pattern
     #  so that only checkFileTimeouts will find the file
     global exitThread, watchTmpPath, rndTimeouts
@@ -85,7 +92,7 @@ def test_waitForFile_noEvents():
     clearWatchDir()
 
     wrongFilePattern = '*.dcm2'
-    watcher = fileWatcher.FileWatcher()
+    watcher = fileWatcher.FileWatcher(usePolling=usePolling)
     watcher.initFileNotifier(watchTmpPath, wrongFilePattern, 300000)
 
     copyThread = startCopyThread()
@@ -103,14 +110,14 @@ def test_waitForFile_noEvents():
         copyThread.join()
 
 
-def test_waitForFile_wrongDir():
+def test_waitForFile_wrongDir(usePolling):
      # Init a file watcher on the wrong directory,
      #  the filewatch should time out and fail
     global exitThread, watchTmpPath, rndTimeouts
 
     clearWatchDir()
 
-    watcher = fileWatcher.FileWatcher()
+    watcher = fileWatcher.FileWatcher(usePolling=usePolling)
     wrongPath = os.path.join(watchTmpPath, 'nodir')
     os.makedirs(wrongPath, exist_ok=True)
     watcher.initFileNotifier(wrongPath, '*.dcm', 300000)
@@ -137,3 +144,187 @@ def test_waitForFile_wrongDir():
     finally:
         exitThread = True
         copyThread.join()
+
+
+def test_waitForFile_concurrent(usePolling):
+    """Multiple threads wait on different files at the same time"""
+    global watchTmpPath
+
+    clearWatchDir()
+
+    watcher = fileWatcher.FileWatcher(usePolling=usePolling)
+    watcher.initFileNotifier(watchTmpPath, '*.dcm', 0)
+
+    numFiles = 4
+    results = {}
+    def waitThread(dicomName):
+        results[dicomName] = watcher.waitForFile(dicomName, timeout=5, timeCheckIncrement=5)
+    waitThreads = []
+    # start waiting in reverse order of file arrival
+    for i in reversed(range(numFiles)):
+        dicomName = f'001_000013_00000{i}.dcm'
+        thread = threading.Thread(target=waitThread, args=(dicomName,))
+        thread.start()
+        waitThreads.append(thread)
+    time.sleep(0.2)
+    startTime = time.time()
+    for i in range(numFiles):
+        dicomName = os.path.join(test_sampleProjectDicomPath, f'001_000013_00000{i}.dcm')
+        os.system(f'cp {dicomName} {watchTmpPath}')
+    for thread in waitThreads:
+        thread.join()
+    # each waiter was woken by its own file event rather than the 5 sec existence check
+    assert time.time() - startTime < 4
+    for i in range(numFiles):
+        dicomName = f'001_000013_00000{i}.dcm'
+        assert results[dicomName] == os.path.join(watchTmpPath, dicomName)
+
+
+def test_fileWaiterRegistry():
+    registry = fileWatcher.FileWaiterRegistry(maxRecentFiles=2)
+    # a file that arrived before the wait is returned immediately
+    registry.fileArrived('/tmp/a.dcm', 10.0)
+    assert registry.waitForArrival('/tmp/a.dcm', timeout=1) == 10.0
+    # unless the arrival is older than the notBefore time
+    assert registry.waitForArrival('/tmp/a.dcm', timeout=0.1, notBefore=11.0) is None
+    # a waiting thread is woken by the event for its file
+    def delayedArrival():
+        time.sleep(0.2)
+        registry.fileArrived('/tmp/c.dcm', time.time())
+        registry.fileArrived('/tmp/b.dcm', time.time())
+    threading.Thread(target=delayedArrival).start()
+    assert registry.waitForArrival('/tmp/b.dcm', timeout=5) is not None
+    assert len(registry.waiters) == 0
+    # only the most recent files are remembered
+    assert registry.getArrivalTime('/tmp/a.dcm') is None
+    assert list(registry.recentFiles.keys()) == ['/tmp/c.dcm', '/tmp/b.dcm']
+
+
+def test_waitForFile_multipleDirs(usePolling):
+    """One watcher serves files from several directories"""
+    global watchTmpPath
+
+    clearWatchDir()
+    dirs = [os.path.join(watchTmpPath, f'series{i}') for i in range(2)]
+    for watchDir in dirs:
+        os.makedirs(watchDir, exist_ok=True)
+        os.system(f'rm -f {watchDir}/*.dcm')
+
+    watcher = fileWatcher.FileWatcher(usePolling=usePolling)
+    for watchDir in dirs:
+        watcher.addFileNotifier(watchDir, '*.dcm', 0)
+    dicomName = os.path.join(test_sampleProjectDicomPath, '001_000013_000001.dcm')
+    def copyFiles():
+        time.sleep(0.2)
+        for watchDir in dirs:
+            os.system(f'cp {dicomName} {watchDir}')
+    threading.Thread(target=copyFiles).start()
+    for watchDir in dirs:
+        filename = os.path.join(watchDir, '001_000013_000001.dcm')
+        result = watcher.waitForFile(filename, timeout=5, timeCheckIncrement=5)
+        assert result == filename
+        assert watcher.foundWithFileEvent == True or watcher.waitLoopCount == 0
+
+    # a directory that isn't watched is rejected, also after removing its watch
+    with pytest.raises(StateError):
+        watcher.waitForFile(os.path.join(watchTmpPath, 'other', 'a.dcm'), timeout=1)
+    watcher.removeFileNotifier(dirs[0], '*.dcm')
+    assert len(watcher.watches) == 1
+    with pytest.raises(StateError):
+        watcher.waitForFile(os.path.join(dirs[0], '001_000013_000001.dcm'), timeout=1)
+
+
+def test_recursiveWatch(usePolling):
+    """New series directories are discovered and their files watched"""
+    global watchTmpPath
+
+    clearWatchDir()
+    topDir = os.path.join(watchTmpPath, 'recursive')
+    os.system(f'rm -rf {topDir}')
+    os.makedirs(os.path.join(topDir, 'existingSeries'))
+
+    watcher = fileWatcher.FileWatcher(usePolling=usePolling)
+    watcher.addFileNotifier(topDir, '*.dcm', 0, recursive=True)
+    assert watcher.waitForNewDir(topDir, timeout=0.1) is None
+    # existing subdirectories are watched
+    assert os.path.realpath(os.path.join(topDir, 'existingSeries')) in watcher.watches
+
+    dicomName = os.path.join(test_sampleProjectDicomPath, '001_000013_000001.dcm')
+    os.makedirs(os.path.join(topDir, 'series1'))
+    newDir = watcher.waitForNewDir(topDir, timeout=5)
+    assert newDir == os.path.join(topDir, 'series1')
+    # a file written to a temporary name and renamed is found by its event
+    def writeAndRename():
+        time.sleep(0.2)
+        os.system(f'cp {dicomName} {newDir}/tmpfile')
+        os.rename(os.path.join(newDir, 'tmpfile'), os.path.join(newDir, 'image1.dcm'))
+    threading.Thread(target=writeAndRename).start()
+    filename = os.path.join(newDir, 'image1.dcm')
+    assert watcher.waitForFile(filename, timeout=5, timeCheckIncrement=5) == filename
+    assert watcher.foundWithFileEvent == True
+
+    # nested directories, and directories moved in, are also reported
+    os.makedirs(os.path.join(topDir, 'series2', 'sub'))
+    os.makedirs(os.path.join(watchTmpPath, 'movedSeries'), exist_ok=True)
+    os.rename(os.path.join(watchTmpPath, 'movedSeries'), os.path.join(topDir, 'series3'))
+    newDirs = [watcher.waitForNewDir(topDir, timeout=5) for _ in range(3)]
+    assert set(newDirs) == {os.path.join(topDir, 'series2'),
+                            os.path.join(topDir, 'series2', 'sub'),
+                            os.path.join(topDir, 'series3')}
+    assert watcher.waitForNewDir(topDir, timeout=0.2) is None
+
+    watcher.removeFileNotifier(topDir, '*.dcm')
+    assert len(watcher.watches) == 0
+
+
+def test_pollingSizeStability():
+    """The polling watcher reports a file once, after it is completely written"""
+    global watchTmpPath
+
+    clearWatchDir()
+    pollDir = os.path.join(watchTmpPath, 'polling')
+    os.makedirs(pollDir, exist_ok=True)
+    os.system(f'rm -f {pollDir}/*')
+    existingFile = os.path.join(pollDir, 'existing.dcm')
+    with open(existingFile, 'wb') as fp:
+        fp.write(b'x' * 100)
+    os.utime(existingFile, (time.time() - 10, time.time() - 10))
+
+    watcher = fileWatcher.FileWatcher(usePolling=True)
+    assert isinstance(watcher, fileWatcher.PollingFileWatcher)
+    arrivals = []
+    watcher.addArrivalCallback(lambda filename, eventTime: arrivals.append(filename))
+    try:
+        watcher.addFileNotifier(pollDir, '*.dcm', 0)
+        # a file that was complete before the watch started is returned without an event
+        assert watcher.waitForFile(existingFile, timeout=1) == existingFile
+        assert watcher.foundWithFileEvent is False and watcher.waitLoopCount == 0
+
+        # a file written slowly in chunks is only returned once its size is stable
+        numChunks = 8
+        chunk = b'y' * 1000
+        def slowWrite(filename):
+            with open(filename, 'wb') as fp:
+                for _ in range(numChunks):
+                    fp.write(chunk)
+                    fp.flush()
+                    time.sleep(0.03)
+        filename = os.path.join(pollDir, 'slow.dcm')
+        writeThread = threading.Thread(target=slowWrite, args=(filename,))
+        writeThread.start()
+        assert watcher.waitForFile(filename, timeout=5, timeCheckIncrement=5) == filename
+        assert os.path.getsize(filename) == numChunks * len(chunk)
+        assert watcher.foundWithFileEvent is True
+        writeThread.join()
+        time.sleep(0.5)
+        assert arrivals == [os.path.join(os.path.realpath(pollDir), 'slow.dcm')]
+
+        # the poll interval follows the TR estimated from the arrival times
+        assert watcher._getPollInterval(inProgress=True) == watcher.minPollInterval
+        watcher.arrivalTimes[os.path.realpath(pollDir)] = deque([0, 2, 4.1, 6], maxlen=9)
+        assert watcher.getEstimatedTR() == 2
+        assert watcher._getPollInterval(inProgress=False) == 2 / watcher.pollsPerTR
+        watcher.arrivalTimes[os.path.realpath(pollDir)] = deque([0, 60, 120], maxlen=9)
+        assert watcher._getPollInterval(inProgress=False) == watcher.maxPollInterval
+    finally:
+        watcher.__del__()
@@ -4,12 +4,14 @@ import time
 import pytest
 import tempfile
 import numpy as np
+import nibabel as nib
+import pydicom
 from datetime import time as dtime
 from nibabel.nicom import dicomreaders
 
 from rtCommon.dataInterface import DataInterface
-from rtCommon.errors import ValidationError, StateError
-from tests.common import test_dicomPath, test_dicomTruncPath, test_inputDirPath
+from rtCommon.errors import ValidationError, StateError, NotImplementedError
+from tests.common import test_dicomPath, test_dicomTruncPath, test_inputDirPath, rtCloudPath
 from tests.common import countUnanonymizedSensitiveAttrs
 import rtCommon.imageHandling as imgHandler
 
@@ -32,6 +34,15 @@ def test_readDicom():
     with pytest.raises(ValidationError):
         dicomImgTrunc = imgHandler.readDicomFromBuffer(data)
 
+    # Truncated anywhere in the pixel data, or before it, is detected without decoding
+    with open(test_dicomPath, 'rb') as fp:
+        data = fp.read()
+    for truncLen in [len(data) - 1, len(data) // 2, 500]:
+        with pytest.raises(ValidationError):
+            imgHandler.readDicomFromBuffer(data[:truncLen])
+    # the pixels aren't decoded by reading the dicom
+    assert imgHandler.readDicomFromBuffer(data)._pixel_array is None
+
     # if dataInterface is not initialized with allowedDirs or allowedFileTypes,
     # it should fail
     dataInterface = DataInterface()
@@ -77,6 +88,173 @@ def test_readDicom():
     assert countUnanonymizedSensitiveAttrs(dicomImg5) == 0
 
 
+def parseDicomVolumeLoop(dicomImg, sliceDim):
+    """The previous tile-by-tile implementation of parseDicomVolume, for comparison"""
+    image = dicomImg.pixel_array
+    dicomHeight, dicomWidth = image.shape
+    numSlicesPerRow = dicomWidth // sliceDim
+    numSlicesPerCol = dicomHeight // sliceDim
+    volume = np.full((sliceDim, sliceDim, numSlicesPerRow * numSlicesPerCol), np.nan)
+    sliceNum = 0
+    for row in range(numSlicesPerCol):
+        for col in range(numSlicesPerRow):
+            rpos = row * sliceDim
+            cpos = col * sliceDim
+            volume[:, :, sliceNum] = image[rpos: rpos+sliceDim, cpos: cpos+sliceDim]
+            sliceNum += 1
+    return volume
+
+
+def makeMosaicDicom(sliceRows, sliceCols, numSlices, numTilesPerSide):
+    """Returns a copy of the test Dicom with a random mosaic of the given size"""
+    dicomImg = imgHandler.readDicomFromFile(test_dicomPath)
+    rows, cols = sliceRows * numTilesPerSide, sliceCols * numTilesPerSide
+    pixels = np.random.randint(0, 4096, size=(rows, cols), dtype=np.uint16)
+    dicomImg.Rows, dicomImg.Columns = rows, cols
+    dicomImg.PixelData = pixels.tobytes()
+    dicomImg.add_new((0x0019, 0x100a), 'US', numSlices)
+    return dicomImg, pixels
+
+
+def test_parseDicomVolume():
+    dicomImg = imgHandler.readDicomFromFile(test_dicomPath)
+    # NumberOfImagesInMosaic is 27, the remaining 9 tiles of the 6x6 mosaic are dropped
+    volume = imgHandler.parseDicomVolume(dicomImg, 64)
+    assert volume.shape == (64, 64, 27)
+    assert volume.dtype == dicomImg.pixel_array.dtype
+    allTiles = imgHandler.parseDicomVolume(dicomImg, 64, numSlices=36)
+    assert np.array_equal(allTiles, parseDicomVolumeLoop(dicomImg, 64))
+    assert np.array_equal(allTiles[:, :, :27], volume)
+    with pytest.raises(StateError):
+        imgHandler.parseDicomVolume(dicomImg, 64, numSlices=37)
+
+    # non-square slices
+    dicomImg, pixels = makeMosaicDicom(20, 30, 7, 3)
+    volume = imgHandler.parseDicomVolume(dicomImg, (20, 30))
+    assert volume.shape == (20, 30, 7)
+    assert np.array_equal(volume[:, :, 4], pixels[20:40, 30:60])
+    assert np.array_equal(volume[:, :, 6], pixels[40:60, 0:30])
+
+    # written into a caller's buffer
+    out = np.zeros((20, 30, 7), dtype=np.float32)
+    result = imgHandler.parseDicomVolume(dicomImg, (20, 30), out=out)
+    assert result is out
+    assert np.array_equal(out, volume)
+    with pytest.raises(StateError):
+        imgHandler.parseDicomVolume(dicomImg, (20, 30), out=np.zeros((20, 30, 6)))
+
+
+def test_parseDicomVolumeBenchmark():
+    # multiband EPI: 72 slices of 104x104 in a 9x9 mosaic
+    dicomImg, _ = makeMosaicDicom(104, 104, 72, 9)
+    dicomImg.pixel_array  # decode once, outside of the timing
+    numReps = 20
+    startTime = time.perf_counter()
+    for _ in range(numReps):
+        loopVolume = parseDicomVolumeLoop(dicomImg, 104)
+    loopTime = (time.perf_counter() - startTime) / numReps
+    out = np.empty((104, 104, 72), dtype=np.uint16)
+    startTime = time.perf_counter()
+    for _ in range(numReps):
+        volume = imgHandler.parseDicomVolume(dicomImg, 104, out=out)
+    vectorTime = (time.perf_counter() - startTime) / numReps
+    print(f"parseDicomVolume 104x104x72: loop {loopTime*1000:.2f} ms, "
+          f"vectorized {vectorTime*1000:.2f} ms")
+    assert np.array_equal(volume, loopVolume[:, :, :72])
+    assert volume.nbytes * 4 == loopVolume[:, :, :72].nbytes
+    assert vectorTime < loopTime
+
+
+def test_anonymizeDicomBytes():
+    with open(test_dicomPath, 'rb') as fp:
+        data = fp.read()
+    # same result as anonymizing the parsed Dicom and writing it out
+    expected = imgHandler.writeDicomToBuffer(
+        imgHandler.anonymizeDicom(imgHandler.readDicomFromBuffer(data)))
+    anonData = imgHandler.anonymizeDicomBytes(data)
+    assert imgHandler.readDicomFromBuffer(anonData) == imgHandler.readDicomFromBuffer(expected)
+    assert countUnanonymizedSensitiveAttrs(imgHandler.readDicomFromBuffer(anonData)) == 0
+    # implicit VR little endian
+    dicomImg = imgHandler.readDicomFromBuffer(data)
+    dicomImg.file_meta.TransferSyntaxUID = pydicom.uid.ImplicitVRLittleEndian
+    dicomImg.is_implicit_VR = True
+    implicitData = imgHandler.writeDicomToBuffer(dicomImg)
+    anonImplicit = imgHandler.readDicomFromBuffer(imgHandler.anonymizeDicomBytes(implicitData))
+    assert anonImplicit == imgHandler.readDicomFromBuffer(expected)
+    # truncated anywhere is detected
+    for truncLen in [len(data) - 1, len(data) // 2, 1000, 200]:
+        with pytest.raises(ValidationError):
+            imgHandler.anonymizeDicomBytes(data[:truncLen])
+        with pytest.raises(ValidationError):
+            imgHandler.checkDicomBytesComplete(data[:truncLen])
+    imgHandler.checkDicomBytesComplete(data)
+    # a Dicom without the preamble is left to pydicom
+    with pytest.raises(NotImplementedError):
+        imgHandler.anonymizeDicomBytes(data[132:])
+
+
+def test_checkDicomComplete():
+    from pydicom.encaps import encapsulate
+    from pydicom.uid import JPEGBaseline8Bit
+    dicomImg = imgHandler.readDicomFromFile(test_dicomPath)
+    imgHandler.checkDicomComplete(dicomImg)
+    # compressed pixel data is checked for complete encapsulated fragments
+    dicomImg.file_meta.TransferSyntaxUID = JPEGBaseline8Bit
+    dicomImg.PixelData = encapsulate([b'\x00' * 100, b'\x01' * 100])
+    imgHandler.checkDicomComplete(dicomImg)
+    encapsulated = dicomImg.PixelData
+    for truncLen in [len(encapsulated) - 4, len(encapsulated) - 104, 12]:
+        dicomImg.PixelData = encapsulated[:truncLen]
+        with pytest.raises(ValidationError):
+            imgHandler.checkDicomComplete(dicomImg)
+    # a multi-frame image missing whole fragment items is detected, by its basic
+    #   offset table or without one by its number of frames
+    dicomImg.NumberOfFrames = 3
+    frames = [b'\x00' * 100, b'\x01' * 100, b'\x02' * 100]
+    for hasBot in [True, False]:
+        dicomImg.PixelData = encapsulate(frames, has_bot=hasBot)
+        imgHandler.checkDicomComplete(dicomImg)
+        dicomImg.PixelData = dicomImg.PixelData[:-108]
+        with pytest.raises(ValidationError):
+            imgHandler.checkDicomComplete(dicomImg)
+    # an unknown transfer syntax is rejected
+    dicomImg.file_meta.TransferSyntaxUID = '1.2.3.4'
+    with pytest.raises(ValidationError):
+        imgHandler.checkDicomComplete(dicomImg)
+
+
+def test_niftiOrientationPlan():
+    from rtCommon.structDict import StructDict
+    dicomImg = imgHandler.readDicomFromFile(test_dicomPath)
+    mosaicNifti = dicomreaders.mosaic_to_nii(dicomImg)
+    # a reference image in LAS+ orientation
+    refAffine = np.diag([-3.0, 3.0, 3.0, 1.0])
+    reference = nib.Nifti1Image(np.zeros((64, 64, 27), dtype=np.int16), refAffine)
+    refFile = os.path.join(tempfile.mkdtemp(), 'ref_bold.nii')
+    reference.to_filename(refFile)
+    cfg = StructDict({'ref_BOLD': refFile})
+    targetOrientation, dicomOrientation = imgHandler.getAxesForTransform(test_dicomPath, cfg)
+    assert targetOrientation == ('L', 'A', 'S')
+    assert dicomOrientation == nib.aff2axcodes(mosaicNifti.affine)
+    cfg.axesTransform = imgHandler.getTransform(targetOrientation, dicomOrientation)
+
+    # the plan's volume is the same as reorienting the mosaic_to_nii data, in the Dicom dtype
+    plan = imgHandler.getOrientationPlan(dicomImg, cfg.ref_BOLD, cfg.axesTransform)
+    expected = nib.orientations.apply_orientation(mosaicNifti.get_fdata(), cfg.axesTransform)
+    volume = plan.getVolume(dicomImg)
+    assert volume.dtype == dicomImg.pixel_array.dtype
+    assert np.array_equal(volume, expected)
+    # the plan is reused for the same series and reference
+    assert imgHandler.getOrientationPlan(dicomImg, cfg.ref_BOLD, cfg.axesTransform) is plan
+
+    niftiFilename = os.path.join(os.path.dirname(refFile), 'vol_005.nii')
+    imgHandler.saveAsNiftiImage(dicomImg, niftiFilename, cfg, cfg.ref_BOLD)
+    savedNifti = nib.load(niftiFilename)
+    assert np.array_equal(savedNifti.affine, refAffine)
+    assert savedNifti.get_data_dtype() == np.int16
+    assert np.array_equal(savedNifti.get_fdata(), expected)
+
+
 def test_nifti():
     with tempfile.TemporaryDirectory() as tmpDir:
         niftiFilename = os.path.join(tmpDir, 'nifti1.nii')
@@ -84,17 +262,75 @@ def test_nifti():
         niftiImg1 = imgHandler.readNifti(niftiFilename)
 
         dcmImg = imgHandler.readDicomFromFile(test_dicomPath)
-        niftiImgFromDcm = imgHandler.convertDicomImgToNifti(dcmImg)
+        niftiImgFromDcm = imgHandler.convertDicomImgToNifti(dcmImg, useDcm2niix=True)
         assert niftiImg1.header == niftiImgFromDcm.header
         assert np.array_equal(np.array(niftiImg1.dataobj),
                               np.array(niftiImgFromDcm.dataobj))
 
+        # The in-memory conversion matches dcm2niix in voxels, affine and main header fields
+        niftiImgInMem = imgHandler.convertDicomImgToNifti(dcmImg, validate=True)
+        imgHandler.compareNiftiConversions(niftiImgInMem, niftiImg1)
+        assert niftiImgInMem.get_data_dtype() == niftiImg1.get_data_dtype()
+        for field in ('dim', 'pixdim', 'xyzt_units', 'dim_info', 'slice_code',
+                      'qform_code', 'sform_code', 'descrip'):
+            assert np.array_equal(niftiImgInMem.header[field], niftiImg1.header[field]), field
+
+        # Mismatched voxels are reported in validation
+        badData = np.array(niftiImgInMem.dataobj)
+        badData[0, 0, 0] += 1
+        badImg = nib.Nifti1Image(badData, niftiImgInMem.affine, niftiImgInMem.header)
+        with pytest.raises(ValidationError):
+            imgHandler.compareNiftiConversions(badImg, niftiImg1)
+
         # Test trying to convert a truncated dicom to nifti
         niftiTruncFilename = os.path.join(tmpDir, 'nifti_trunc.nii')
         with pytest.raises(StateError):
             imgHandler.convertDicomFileToNifti(test_dicomTruncPath, niftiTruncFilename)
 
 
+def test_niftiInMemorySingleFrame():
+    """A single-frame (non-mosaic) Dicom made from one slice of the test mosaic"""
+    mosaicImg = imgHandler.readDicomFromFile(test_dicomPath)
+    mosaicNifti = imgHandler.convertDicomImgToNifti(mosaicImg)
+    sliceIdx = 8
+    # slice 8 is the third tile of the second row of the 6x6 mosaic of 64x64 slices
+    singleImg = imgHandler.readDicomFromFile(test_dicomPath)
+    tile = mosaicImg.pixel_array[64:128, 128:192].copy()
+    singleImg.PixelData = tile.tobytes()
+    singleImg.Rows, singleImg.Columns = tile.shape
+    singleImg.ImageType = ['ORIGINAL', 'PRIMARY', 'M', 'ND', 'NORM']
+    # remove the Siemens mosaic (CSA) headers
+    for tag in [(0x0029, 0x1010), (0x0029, 0x1020), (0x0019, 0x100a)]:
+        if tag in singleImg:
+            del singleImg[tag]
+    # ImagePositionPatient is the (LPS) position of the top left voxel of the slice
+    topLeft = mosaicNifti.affine @ [0, tile.shape[0] - 1, sliceIdx, 1]
+    singleImg.ImagePositionPatient = [float(-topLeft[0]), float(-topLeft[1]), float(topLeft[2])]
+
+    niftiImg = imgHandler.convertDicomImgToNifti(singleImg, validate=True)
+    assert niftiImg.shape == (64, 64, 1)
+    assert np.array_equal(np.asarray(niftiImg.dataobj)[:, :, 0],
+                          np.asarray(mosaicNifti.dataobj)[:, :, sliceIdx])
+
+
+def test_niftiInMemoryUnsupported():
+    """Dicoms the in-memory conversion can't decode are left to dcm2niix"""
+    from pydicom.encaps import encapsulate
+    from pydicom.uid import JPEG2000Lossless
+    dicomImg = imgHandler.readDicomFromFile(test_dicomPath)
+    dicomImg.file_meta.TransferSyntaxUID = JPEG2000Lossless
+    dicomImg.PixelData = encapsulate([b'\x00' * 100])
+    with pytest.raises(NotImplementedError) as err:
+        imgHandler.convertDicomImgToNiftiInMemory(dicomImg)
+    assert 'compressed transfer syntax' in str(err.value)
+    # pixel data that fails to decode for any other reason
+    dicomImg = imgHandler.readDicomFromFile(test_dicomPath)
+    dicomImg.PixelData = dicomImg.PixelData[:100]
+    with pytest.raises(NotImplementedError) as err:
+        imgHandler.convertDicomImgToNiftiInMemory(dicomImg)
+    assert "can't decode the pixel data" in str(err.value)
+
+
 def test_dicomTimeToTr(dicomImage):
     # The dicomImage acquisition time is 12:47:56.327500
     dcmAcqTm = imgHandler.getDicomAcquisitionTime(dicomImage)
@@ -113,3 +349,61 @@ def test_dicomTimeToTr(dicomImage):
     clockSkew = 0.1
     secToTr = imgHandler.dicomTimeToNextTr(dicomImage, clockSkew, now=now)
     assert math.isclose(secToTr, 0.2275) is True
+
+
+def test_conversionPool():
+    from rtCommon.conversionPool import DicomConversionPool
+    niftiRef = imgHandler.convertDicomImgToNifti(imgHandler.readDicomFromFile(test_dicomPath),
+                                                 useDcm2niix=True)
+    pool = DicomConversionPool(numWorkers=3)
+    try:
+        scratchDir = pool.scratchDir
+        # a backlog of files is converted in parallel, results in submission order
+        niftiImgs = pool.convertFiles([test_dicomPath] * 6)
+        assert len(niftiImgs) == 6
+        for niftiImg in niftiImgs:
+            assert niftiImg.header == niftiRef.header
+            assert np.array_equal(np.asarray(niftiImg.dataobj), np.asarray(niftiRef.dataobj))
+        # in-memory dicoms are converted through tmp files that are removed afterwards
+        dicomImg = imgHandler.readDicomFromFile(test_dicomPath)
+        niftiImg = pool.submit(dicomImg).result()
+        assert np.array_equal(np.asarray(niftiImg.dataobj), np.asarray(niftiRef.dataobj))
+        assert os.listdir(scratchDir) == []
+        # a conversion failure is raised by the future
+        with pytest.raises(StateError):
+            pool.submitFile(test_dicomTruncPath).result()
+    finally:
+        pool.shutdown()
+    assert not os.path.exists(scratchDir)
+    # the shared pool's scratch directory is removed when the process exits
+    import subprocess
+    script = ('from rtCommon.conversionPool import getConversionPool; '
+              'print(getConversionPool().scratchDir)')
+    output = subprocess.run(['python', '-c', script], cwd=rtCloudPath, check=True,
+                            stdout=subprocess.PIPE).stdout.decode().strip()
+    assert output != '' and not os.path.exists(output)
+
+
+def test_convertDicomImgsToNifti(monkeypatch):
+    """A backlog of dicoms is converted in order, the dcm2niix ones by the shared pool"""
+    from rtCommon.conversionPool import DicomConversionPool
+    dicomImgs = [imgHandler.readDicomFromFile(test_dicomPath) for _ in range(4)]
+    niftiRef = imgHandler.convertDicomImgToNifti(dicomImgs[0], useDcm2niix=True)
+    # the odd volumes can't be converted in memory
+    convertInMemory = imgHandler.convertDicomImgToNiftiInMemory
+    def oddToDcm2niix(dicomImg):
+        if [id(img) for img in dicomImgs].index(id(dicomImg)) % 2 == 1:
+            raise NotImplementedError('test dcm2niix fallback')
+        return convertInMemory(dicomImg)
+    monkeypatch.setattr(imgHandler, 'convertDicomImgToNiftiInMemory', oddToDcm2niix)
+    submitted = []
+    poolSubmit = DicomConversionPool.submit
+    def recordSubmit(pool, dicomImg):
+        submitted.append(id(dicomImg))
+        return poolSubmit(pool, dicomImg)
+    monkeypatch.setattr(DicomConversionPool, 'submit', recordSubmit)
+    niftiImgs = imgHandler.convertDicomImgsToNifti(dicomImgs)
+    assert submitted == [id(dicomImgs[1]), id(dicomImgs[3])]
+    assert len(niftiImgs) == 4
+    for niftiImg in niftiImgs:
+        assert np.array_equal(np.asarray(niftiImg.dataobj), np.asarray(niftiRef.dataobj))
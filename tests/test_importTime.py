@@ -0,0 +1,77 @@
+"""
+Startup (cold import) budget for the rtCommon entry points used by services and scripts.
+
+Each entry point is imported in a fresh interpreter with 'python -X importtime' and
+checked for the heavy packages it must not load at import time, since they are what
+makes the startup time creep back up.
+
+Wall clock import times vary too much between machines to check by default. Set
+RTCLOUD_IMPORT_BUDGET_SCALE to also compare the cumulative import time to each entry
+point's budget multiplied by that factor (i.e. 1 on a development machine, more on a
+slow runner).
+
+Run directly to print a report: python tests/test_importTime.py
+"""
+import os
+import sys
+import subprocess
+import pytest
+
+rtCloudPath = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+heavyModules = ['pydicom', 'nibabel', 'pandas', 'bids', 'boto3', 'nilearn', 'scipy', 'watchdog']
+
+# multiplier of the import budgets, None to not check the import times
+budgetScale = os.environ.get('RTCLOUD_IMPORT_BUDGET_SCALE')
+budgetScale = float(budgetScale) if budgetScale else None
+
+# entry point: (budget in seconds, heavy modules it may not import)
+importBudgets = {
+    'rtCommon.clientInterface': (0.5, heavyModules),
+    'rtCommon.dataInterface': (0.5, heavyModules),
+    'rtCommon.bidsInterface': (0.5, heavyModules),
+    'rtCommon.fileWatcher': (0.5, heavyModules),
+    'rtCommon.subjectInterface': (0.5, heavyModules),
+    'rtCommon.wsRemoteService': (0.8, heavyModules),
+    'rtCommon.scannerDataService': (0.8, heavyModules),
+    'rtCommon.subjectService': (0.8, heavyModules),
+}
+
+
+def measureImport(moduleName):
+    """
+    Imports moduleName in a new interpreter. Returns the cumulative import time
+    in seconds reported by -X importtime and the list of heavy modules loaded.
+    """
+    code = (f'import sys; import {moduleName}; '
+            f'print(",".join(m for m in {heavyModules!r} if m in sys.modules))')
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=rtCloudPath,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    cumulativeUs = None
+    for line in proc.stderr.decode('utf-8').splitlines():
+        # format: 'import time: self [us] | cumulative | imported package'
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) == 3 and fields[2].strip() == moduleName:
+            cumulativeUs = int(fields[1])
+    assert cumulativeUs is not None, f'No import time reported for {moduleName}'
+    loaded = [m for m in proc.stdout.decode('utf-8').strip().split(',') if m != '']
+    return cumulativeUs / 1e6, loaded
+
+
+@pytest.mark.parametrize('moduleName', list(importBudgets.keys()))
+def test_importBudget(moduleName):
+    budget, disallowed = importBudgets[moduleName]
+    importSecs, loaded = measureImport(moduleName)
+    heavyLoaded = [m for m in loaded if m in disallowed]
+    assert heavyLoaded == [], f'{moduleName} imports {heavyLoaded} at load time'
+    if budgetScale is not None:
+        budget *= budgetScale
+        assert importSecs < budget, f'{moduleName} import took {importSecs:.3f}s, budget {budget}s'
+
+
+if __name__ == "__main__":
+    for name, (budget, _) in importBudgets.items():
+        secs, loaded = measureImport(name)
+        print(f'{name:32s} {secs:6.3f}s  budget {budget:4.1f}s  heavy: {loaded}')
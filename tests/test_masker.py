@@ -0,0 +1,89 @@
+import os
+import numpy as np
+import nibabel as nib
+import pytest
+from rtCommon.masker import Masker
+from rtCommon.dataInterface import DataInterface
+from rtCommon.imageHandling import readDicomFromFile, convertDicomImgToNifti
+from rtCommon.errors import ValidationError
+from tests.common import rtCloudPath, tmpDir
+
+test_sampleProjectDicomPath = os.path.join(rtCloudPath, 'projects', 'sample',
+    'dicomDir', '20190219.0219191_faceMatching.0219191_faceMatching')
+
+
+def makeMasks(shape):
+    roiA = np.zeros(shape, dtype=np.int8)
+    roiA[10:20, 12:18, 5:9] = 1
+    roiB = np.zeros(shape, dtype=np.int8)
+    roiB[30:34, 30:40, 2] = 1
+    return roiA, roiB
+
+
+def test_maskerExtract():
+    rng = np.random.default_rng(3)
+    volume = rng.random((40, 44, 12)).astype(np.float32)
+    roiA, roiB = makeMasks(volume.shape)
+    masker = Masker({'a': roiA, 'b': roiB})
+    assert masker.numRois == 2
+    means = masker.extract(volume)
+    assert np.allclose(means, [volume[roiA == 1].mean(), volume[roiB == 1].mean()])
+    assert np.allclose(masker.extract(volume, reduce='max'),
+                       [volume[roiA == 1].max(), volume[roiB == 1].max()])
+    assert np.allclose(masker.extract(volume, reduce='sum'),
+                       [volume[roiA == 1].sum(), volume[roiB == 1].sum()])
+    voxels = masker.extract(volume, reduce=None)
+    assert np.array_equal(voxels[1], volume[roiB == 1])
+    assert masker.extractDict(volume)['b'] == pytest.approx(volume[roiB == 1].mean())
+    # Fortran ordered data (as nibabel loads it) and 4D batches
+    batch = np.asfortranarray(rng.random(volume.shape + (5,)))
+    batchMeans = masker.extract(batch)
+    assert batchMeans.shape == (2, 5)
+    for vol in range(5):
+        assert np.allclose(batchMeans[:, vol], masker.extract(batch[..., vol]))
+    # integer data doesn't overflow
+    intVolume = np.full(volume.shape, 30000, dtype=np.int16)
+    assert np.allclose(masker.extract(intVolume, reduce='sum'), [30000 * roiA.sum(), 30000 * roiB.sum()])
+    with pytest.raises(ValidationError):
+        masker.extract(volume[:20])
+
+
+def test_maskerWeightedAndSpec():
+    rng = np.random.default_rng(5)
+    volume = rng.random((40, 44, 12))
+    roiA, _ = makeMasks(volume.shape)
+    weights = roiA * rng.random(volume.shape)
+    maskFile = os.path.join(tmpDir, 'masker_weights.nii')
+    nib.save(nib.Nifti1Image(weights.astype(np.float32), np.eye(4)), maskFile)
+    masker = Masker(maskFile, weighted=True)
+    expected = np.sum(volume * weights) / np.sum(weights)
+    assert masker.extract(volume)[0] == pytest.approx(expected, rel=1e-5)
+    # the spec is json serializable and makes the same masker
+    import json
+    spec = json.loads(json.dumps(masker.getSpec()))
+    copyMasker = Masker.fromSpec(spec)
+    assert copyMasker.roiNames == ['roi0']
+    assert copyMasker.extract(volume)[0] == pytest.approx(expected, rel=1e-5)
+    # images are checked against the mask affine
+    assert copyMasker.extract(nib.Nifti1Image(volume, np.eye(4)))[0] == pytest.approx(expected, rel=1e-5)
+    with pytest.raises(ValidationError):
+        copyMasker.extract(nib.Nifti1Image(volume, np.diag([2, 2, 2, 1])))
+
+
+def test_scannerSideRois():
+    dataInterface = DataInterface(dataRemote=False, allowedDirs=[test_sampleProjectDicomPath],
+                                  allowedFileTypes=['.dcm'])
+    try:
+        streamId = dataInterface.initScannerStream(test_sampleProjectDicomPath,
+                                                   "001_000013_{TR:06d}.dcm", 300*1024)
+        dicomImg = readDicomFromFile(os.path.join(test_sampleProjectDicomPath, '001_000013_000003.dcm'))
+        niftiImg = convertDicomImgToNifti(dicomImg)
+        roiA, roiB = makeMasks(niftiImg.shape)
+        masker = Masker({'a': nib.Nifti1Image(roiA, niftiImg.affine), 'b': roiB})
+        dataInterface.setStreamMasker(streamId, masker.getSpec())
+        roiValues = dataInterface.getImageRois(streamId, 3)
+        volume = niftiImg.get_fdata()
+        assert roiValues['a'] == pytest.approx(volume[roiA == 1].mean())
+        assert roiValues['b'] == pytest.approx(volume[roiB == 1].mean())
+    finally:
+        dataInterface.__del__()
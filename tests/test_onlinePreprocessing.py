@@ -0,0 +1,93 @@
+import os
+import numpy as np
+import pytest
+from rtCommon.onlinePreprocessing import (RunningStats, IncrementalDetrend,
+                                          ExponentialBaseline, OnlinePreprocessor)
+from rtCommon.bidsInterface import BidsInterface
+from rtCommon.errors import RequestError
+from tests.common import rtCloudPath
+
+test_sampleProjectDicomPath = os.path.join(rtCloudPath, 'projects', 'sample',
+    'dicomDir', '20190219.0219191_faceMatching.0219191_faceMatching')
+
+
+def makeTimeSeries(numVols=30, shape=(4, 5, 3), seed=11):
+    rng = np.random.default_rng(seed)
+    times = np.arange(numVols)
+    slopes = rng.normal(size=shape)
+    offsets = rng.normal(100, 10, size=shape)
+    noise = rng.normal(size=shape + (numVols,))
+    return offsets[..., np.newaxis] + slopes[..., np.newaxis] * times + noise
+
+
+def test_runningStats():
+    data = makeTimeSeries()
+    stats = RunningStats()
+    for vol in range(data.shape[-1]):
+        stats.update(data[..., vol])
+        soFar = data[..., :vol + 1]
+        assert np.allclose(stats.mean, soFar.mean(axis=-1))
+        if vol > 0:
+            assert np.allclose(stats.getVariance(), soFar.var(axis=-1, ddof=1))
+    lastVol = data[..., -1]
+    expected = (lastVol - data.mean(axis=-1)) / data.std(axis=-1, ddof=1)
+    assert np.allclose(stats.zscore(lastVol), expected)
+
+
+@pytest.mark.parametrize("order", [0, 1, 2])
+def test_incrementalDetrend(order):
+    data = makeTimeSeries()
+    detrend = IncrementalDetrend(order=order)
+    numVols = data.shape[-1]
+    for vol in range(numVols):
+        detrended = detrend.update(data[..., vol])
+        if vol < order + 1:
+            continue
+        # same as the least squares fit over all the volumes so far
+        times = np.arange(vol + 1) / detrend.timeScale
+        design = np.vander(times, order + 1, increasing=True)
+        series = data[..., :vol + 1].reshape(-1, vol + 1).T
+        betas = np.linalg.lstsq(design, series, rcond=None)[0]
+        expected = series[-1] - design[-1] @ betas
+        assert np.allclose(detrended.reshape(-1), expected, atol=1e-6)
+
+
+def test_exponentialBaseline():
+    baseline = ExponentialBaseline(alpha=0.5)
+    assert baseline.update(np.full(3, 10.0)) == pytest.approx(np.zeros(3))
+    assert baseline.update(np.full(3, 20.0)) == pytest.approx(np.full(3, 10.0))
+    # the baseline moved half way to 20
+    assert baseline.update(np.full(3, 15.0)) == pytest.approx(np.zeros(3))
+
+
+def test_onlinePreprocessor():
+    data = makeTimeSeries()
+    preprocessor = OnlinePreprocessor(detrendOrder=1, zscore=True)
+    for vol in range(data.shape[-1]):
+        results = preprocessor.process(data[..., vol])
+    assert set(results.keys()) == {'detrended', 'zscored', 'processed'}
+    assert results['processed'] is results['zscored']
+    # the linear trend is removed, the z-scores are of the detrended residuals
+    assert np.all(np.abs(results['zscored']) < 5)
+
+
+def test_streamPreprocessing():
+    bidsInterface = BidsInterface(dataRemote=False,
+                                  allowedDirs=[test_sampleProjectDicomPath])
+    entities = {'subject': '01', 'task': 'test', 'run': 1, 'suffix': 'bold', 'datatype': 'func'}
+    streamId = bidsInterface.initDicomBidsStream(test_sampleProjectDicomPath,
+                                                 "001_000013_{TR:06d}.dcm",
+                                                 300*1024, **entities)
+    with pytest.raises(RequestError):
+        bidsInterface.getPreprocessedIncremental(streamId)
+    bidsInterface.setStreamPreprocessing(streamId, detrendOrder=1, zscore=True)
+    # the same preprocessing run locally on the stream's volumes
+    preprocessor = OnlinePreprocessor(detrendOrder=1, zscore=True)
+    for _ in range(4):
+        incremental, results = bidsInterface.getPreprocessedIncremental(streamId)
+        volume = incremental.getImageData()[..., 0]
+        expected = preprocessor.process(volume)
+        assert results['processed'].shape == volume.shape
+        assert np.allclose(results['processed'], expected['processed'])
+    bidsInterface.closeStream(streamId)
+    assert streamId not in bidsInterface.streamPreprocessors
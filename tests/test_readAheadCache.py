@@ -0,0 +1,97 @@
+import os
+import time
+from rtCommon.readAheadCache import ReadAheadCache
+from rtCommon.dataInterface import DataInterface
+from tests.common import tmpDir
+
+
+def writeFile(filename, data):
+    with open(filename, 'wb') as fp:
+        fp.write(data)
+
+
+def waitForPrefetch(cache, numPrefetches, timeout=5):
+    endTime = time.time() + timeout
+    while cache.getStats()['prefetches'] < numPrefetches and time.time() < endTime:
+        time.sleep(0.01)
+
+
+def test_readAheadCacheValidation():
+    cacheDir = os.path.join(tmpDir, 'readAheadCache')
+    os.makedirs(cacheDir, exist_ok=True)
+    filename = os.path.join(cacheDir, 'vol_001.bin')
+    writeFile(filename, b'a' * 100)
+    cache = ReadAheadCache(maxBytes=1000)
+    try:
+        assert cache.readFile(filename) == b'a' * 100
+        assert cache.readFile(filename) == b'a' * 100
+        stats = cache.getStats()
+        assert stats['hits'] == 1 and stats['misses'] == 1
+        assert stats['hitRate'] == 0.5
+        # a rewritten file (different size) is read again from disk
+        writeFile(filename, b'b' * 150)
+        assert cache.readFile(filename) == b'b' * 150
+        assert cache.getStats()['misses'] == 2
+        # same size but a new mtime also invalidates the entry
+        writeFile(filename, b'c' * 150)
+        os.utime(filename, ns=(time.time_ns(), time.time_ns() + 10**9))
+        assert cache.readFile(filename) == b'c' * 150
+        assert cache.getStats()['misses'] == 3
+        cache.invalidate(filename)
+        assert cache.getStats()['numEntries'] == 0
+    finally:
+        cache.shutdown()
+
+
+def test_readAheadCacheEviction():
+    cacheDir = os.path.join(tmpDir, 'readAheadCache')
+    os.makedirs(cacheDir, exist_ok=True)
+    cache = ReadAheadCache(maxBytes=250)
+    try:
+        filenames = [os.path.join(cacheDir, f'evict_{i:03d}.bin') for i in range(4)]
+        for i, filename in enumerate(filenames):
+            writeFile(filename, bytes([i]) * 100)
+            cache.prefetch(filename, time.time())
+        waitForPrefetch(cache, 4)
+        stats = cache.getStats()
+        assert stats['prefetches'] == 4
+        assert stats['evictions'] == 2
+        assert stats['numEntries'] == 2 and stats['numBytes'] == 200
+        # the two newest files are served from memory, the oldest from disk
+        assert cache.readFile(filenames[3]) == bytes([3]) * 100
+        assert cache.readFile(filenames[2]) == bytes([2]) * 100
+        assert cache.readFile(filenames[0]) == bytes([0]) * 100
+        stats = cache.getStats()
+        assert stats['hits'] == 2 and stats['misses'] == 1
+        # a file larger than the cache is never kept
+        bigFile = os.path.join(cacheDir, 'evict_big.bin')
+        writeFile(bigFile, b'x' * 300)
+        assert cache.readFile(bigFile) == b'x' * 300
+        assert cache.getStats()['numBytes'] <= 250
+    finally:
+        cache.shutdown()
+
+
+def test_dataInterfaceReadAhead():
+    watchDir = os.path.join(tmpDir, 'readAheadWatch')
+    os.makedirs(watchDir, exist_ok=True)
+    for name in os.listdir(watchDir):
+        os.remove(os.path.join(watchDir, name))
+    dataInterface = DataInterface(dataRemote=False, allowedDirs=[tmpDir], allowedFileTypes=['.bin'])
+    try:
+        dataInterface.initWatch(watchDir, '*.bin', 0)
+        for i in range(3):
+            filename = os.path.join(watchDir, f'vol_{i:03d}.bin')
+            writeFile(filename, bytes([i]) * 1000)
+            # the file is read into memory from its close-write event
+            waitForPrefetch(dataInterface.readCache, i + 1)
+            assert dataInterface.watchFile(filename, timeout=5) == bytes([i]) * 1000
+            assert dataInterface.getFile(filename) == bytes([i]) * 1000
+        stats = dataInterface.getReadCacheStats()
+        assert stats['prefetches'] == 3
+        assert stats['hits'] == 6 and stats['misses'] == 0
+        # writing a file through the interface invalidates the cached copy
+        dataInterface.putFile(filename, b'new data')
+        assert dataInterface.getFile(filename) == b'new data'
+    finally:
+        dataInterface.__del__()
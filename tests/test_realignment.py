@@ -0,0 +1,86 @@
+import os
+import time
+import numpy as np
+from scipy.ndimage import gaussian_filter, affine_transform
+from rtCommon.realignment import (RigidRealigner, rigidMatrix, rigidParams,
+                                  motionParamsField)
+from rtCommon.bidsInterface import BidsInterface
+from tests.common import rtCloudPath
+
+test_sampleProjectDicomPath = os.path.join(rtCloudPath, 'projects', 'sample',
+    'dicomDir', '20190219.0219191_faceMatching.0219191_faceMatching')
+
+
+def makeBrainVolume(shape=(64, 64, 27), seed=5):
+    # smooth random structure inside an ellipsoid, within the field of view
+    rng = np.random.default_rng(seed)
+    volume = gaussian_filter(rng.random(shape), 3)
+    volume = gaussian_filter((volume > volume.mean()) * 1000.0 + rng.random(shape) * 50, 1.5)
+    grid = np.indices(shape)
+    radii = [0.38 * dim for dim in shape]
+    center = [(dim - 1) / 2 for dim in shape]
+    inside = sum(((grid[i] - center[i]) / radii[i]) ** 2 for i in range(3)) < 1
+    return gaussian_filter(volume * inside, 1)
+
+
+def moveVolume(volume, params, voxelSize):
+    # the moved volume at the transformed positions matches the original volume
+    scale = np.diag(np.append(voxelSize, 1))
+    center = np.eye(4)
+    center[:3, 3] = -(np.array(volume.shape) - 1) / 2
+    voxelMatrix = np.linalg.inv(center) @ np.linalg.inv(scale) @ rigidMatrix(params) @ scale @ center
+    return affine_transform(volume, np.linalg.inv(voxelMatrix), order=3)
+
+
+def test_rigidMatrix():
+    params = np.array([1.5, -2, 0.3, 0.1, -0.05, 0.2])
+    matrix = rigidMatrix(params)
+    assert np.allclose(matrix[:3, :3] @ matrix[:3, :3].T, np.eye(3))
+    assert np.allclose(rigidParams(matrix), params)
+
+
+def test_rigidRealigner():
+    voxelSize = (3, 3, 3.5)
+    reference = makeBrainVolume()
+    realigner = RigidRealigner(reference, voxelSize=voxelSize)
+    _, params = realigner.realign(reference)
+    assert np.allclose(params, 0, atol=1e-3)
+    trueParams = np.array([1.2, -0.8, 0.5, 0.03, -0.02, 0.04])
+    moved = moveVolume(reference, trueParams, voxelSize)
+    startTime = time.time()
+    realigned, params = realigner.realign(moved)
+    elapsed = time.time() - startTime
+    print(f'realignment: {elapsed * 1000:.1f} ms, params {params}')
+    assert np.allclose(params[:3], trueParams[:3], atol=0.05)
+    assert np.allclose(params[3:], trueParams[3:], atol=0.002)
+    mask = reference > reference.mean()
+    assert np.abs(realigned - reference)[mask].mean() < 0.25 * np.abs(moved - reference)[mask].mean()
+    # well within a TR
+    assert elapsed < 1
+
+
+def test_streamRealignment():
+    bidsInterface = BidsInterface(dataRemote=False,
+                                  allowedDirs=[test_sampleProjectDicomPath])
+    entities = {'subject': '01', 'task': 'test', 'run': 1, 'suffix': 'bold', 'datatype': 'func'}
+    streamId = bidsInterface.initDicomBidsStream(test_sampleProjectDicomPath,
+                                                 "001_000013_{TR:06d}.dcm",
+                                                 300*1024, **entities)
+    bidsInterface.setStreamRealignment(streamId)
+    rawStreamId = bidsInterface.initDicomBidsStream(test_sampleProjectDicomPath,
+                                                    "001_000013_{TR:06d}.dcm",
+                                                    300*1024, **entities)
+    for idx in range(4):
+        incremental = bidsInterface.getIncremental(streamId)
+        rawIncremental = bidsInterface.getIncremental(rawStreamId)
+        params = incremental.getMetadataField(motionParamsField)
+        assert len(params) == 6
+        if idx == 0:
+            # the first volume is the reference
+            assert np.allclose(params, 0, atol=1e-3)
+        # the sample subject moves little
+        assert np.all(np.abs(params[:3]) < 2) and np.all(np.abs(params[3:]) < 0.05)
+        assert incremental.getImageDimensions() == rawIncremental.getImageDimensions()
+        assert motionParamsField not in rawIncremental.getImageMetadata()
+    bidsInterface.closeStream(streamId)
+    bidsInterface.closeStream(rawStreamId)
@@ -1,4 +1,6 @@
+import time
 import pytest
+import threading
 from rtCommon.remoteable import Remoteable, RemoteableExtensible, RemoteHandler
 
 
@@ -89,6 +91,90 @@ class TestRemoteable:
         assert val2 == testObj.val2
         pass
 
+    def test_sessionInstances(self):
+        rh = RemoteHandler()
+        sharedObj = SampleClassRemoteable(isRemote=False)
+        rh.registerClassInstance(SampleClassRemoteable, sharedObj)
+        rh.registerSessionFactory(SampleClassRemoteable, lambda: SampleClassRemoteable(isRemote=False))
+        setCall = {'class': 'SampleClassRemoteable', 'attribute': '__setattr__'}
+        getCall = {'class': 'SampleClassRemoteable', 'attribute': 'val2'}
+        rh.runRemoteCall({**setCall, 'args': ('val2', 'session1 value'), 'sessionId': 's1'})
+        rh.runRemoteCall({**setCall, 'args': ('val2', 'session2 value'), 'sessionId': 's2'})
+        assert rh.runRemoteCall({**getCall, 'sessionId': 's1'}) == 'session1 value'
+        assert rh.runRemoteCall({**getCall, 'sessionId': 's2'}) == 'session2 value'
+        # calls without a session use the shared instance
+        assert rh.runRemoteCall(getCall) == sharedObj.val2
+        # closing a session releases its instance
+        rh.runRemoteCall({'cmd': 'closeSession', 'sessionId': 's1'})
+        assert rh.runRemoteCall({**getCall, 'sessionId': 's1'}) == 'instance field val2'
+        assert rh.runRemoteCall({**getCall, 'sessionId': 's2'}) == 'session2 value'
+        # the least recently used session is closed when over the limit
+        rh.maxSessions = 2
+        rh.runRemoteCall({**getCall, 'sessionId': 's3'})
+        assert set(rh.sessionInstances.keys()) == {'s2', 's3'}
+
+    def test_projectRPCSession(self, monkeypatch):
+        from rtCommon.exampleInterface import ExampleInterface
+        from rtCommon.projectServerRPC import ProjectRPCService, ProjectRPCSession
+        remoteHandler = RemoteHandler()
+        remoteHandler.registerClassInstance(ExampleInterface, ExampleInterface(dataRemote=False))
+        createdInstances = []
+        def newExampleInterface():
+            createdInstances.append(ExampleInterface(dataRemote=False))
+            return createdInstances[-1]
+        remoteHandler.registerSessionFactory(ExampleInterface, newExampleInterface)
+        def commFunction(callStruct, timeout=None):
+            return remoteHandler.runRemoteCall(callStruct)
+        monkeypatch.setattr(ProjectRPCService, 'dataCommFunction', None)
+        rpcService = ProjectRPCService(dataRemote=True, sessionInstances=True)
+        rpcService.registerDataCommFunction(commFunction)
+        session1 = ProjectRPCSession(rpcService)
+        session2 = ProjectRPCSession(rpcService)
+        assert session1.sessionId != session2.sessionId
+        assert session1.exposed_ExampleInterface.echo('a') == 'Echo: a'
+        assert session2.exposed_ExampleInterface.echo('b') == 'Echo: b'
+        assert len(createdInstances) == 2
+        assert set(remoteHandler.sessionInstances.keys()) == {session1.sessionId, session2.sessionId}
+        session1.on_disconnect(None)
+        assert set(remoteHandler.sessionInstances.keys()) == {session2.sessionId}
+        session2.on_disconnect(None)
+        assert len(remoteHandler.sessionInstances) == 0
+
+    def test_closeSessionReleasesStreams(self, tmp_path):
+        from rtCommon.dataInterface import DataInterface
+        from rtCommon.projectServerRPC import ProjectRPCService, ProjectRPCSession
+        # instances created for a remote service session are closed with the session
+        rh = RemoteHandler()
+        rh.registerSessionFactory(DataInterface, lambda: DataInterface(
+            dataRemote=False, allowedDirs=[str(tmp_path)], allowedFileTypes=['.dcm']))
+        initCall = {'class': 'DataInterface', 'attribute': 'initScannerStream',
+                    'args': (str(tmp_path), 'scan_{TR:03d}.dcm', 0), 'sessionId': 's1'}
+        rh.runRemoteCall(initCall)
+        dataInterface = rh.sessionInstances['s1']['DataInterface']
+        assert len(dataInterface.streams) == 1
+        rh.runRemoteCall({'cmd': 'closeSession', 'sessionId': 's1'})
+        assert len(dataInterface.streams) == 0
+        assert dataInterface.fileWatcher is None
+        assert dataInterface.readCache.shouldExit is True
+
+        # the projectServer closes the local interfaces of a session that disconnects
+        rpcService = ProjectRPCService(dataRemote=False, sessionInstances=True)
+        session = ProjectRPCSession(rpcService)
+        dataInterface = session.exposed_DataInterface
+        bidsInterface = session.exposed_BidsInterface
+        dataInterface.initScannerStream(str(tmp_path), 'scan_{TR:03d}.dcm', 0)
+        bidsInterface.initDicomBidsStream(str(tmp_path), 'scan_{TR:03d}.dcm', 0,
+                                          subject='01', task='test')
+        dicomDataInterface = bidsInterface.dicomDataInterface
+        assert len(dicomDataInterface.streams) == 1
+        session.on_disconnect(None)
+        assert len(dataInterface.streams) == 0
+        assert dataInterface.fileWatcher is None
+        assert len(bidsInterface.streamMap) == 0
+        assert len(dicomDataInterface.streams) == 0
+        assert dicomDataInterface.fileWatcher is None
+        assert session.exposed_DataInterface is None
+
 
 ### Sample classes for running tests ###
 class MockRPCHandler:
@@ -189,4 +275,188 @@ class SampleClassRemoteExtensible(RemoteableExtensible):
 
 # o.peel(1)
 # o.remotePeel(3)
-# c.juice(2, b=3)
\ No newline at end of file
+# c.juice(2, b=3)
+
+class TestRequestResume:
+    """Requests in-flight when the remote service disconnects are resumed on reconnect"""
+    class FakeConn:
+        def __init__(self, sessionId):
+            self.sessionId = sessionId
+            self.messages = []
+
+        def write_message(self, msg):
+            self.messages.append(msg)
+
+    class FakeIOLoop:
+        def add_callback(self, func, **kwargs):
+            func(**kwargs)
+
+    class FakeClient:
+        def __init__(self):
+            self.sent = []
+
+        def send(self, msg):
+            self.sent.append(msg)
+
+    class ResumeService:
+        numCalls = 0
+
+        def getData(self, size):
+            TestRequestResume.ResumeService.numCalls += 1
+            return bytes(range(256)) * (size // 256)
+
+    def test_resumeRequest(self, monkeypatch):
+        import json
+        import rtCommon.serialization as serialization
+        from rtCommon.webSocketHandlers import RequestHandler, websocketState
+        from rtCommon.wsRemoteService import WsRemoteService
+        monkeypatch.setattr(serialization, 'dataPartSize', 1024)
+        monkeypatch.setitem(websocketState.wsConnectionLists, 'wsResume', [])
+        WsRemoteService.remoteHandler.registerClassInstance(self.ResumeService, self.ResumeService())
+
+        handler = RequestHandler('wsResume', self.FakeIOLoop())
+        conn1 = self.FakeConn('session1')
+        websocketState.wsConnectionLists['wsResume'].append(conn1)
+        msg = {'cmd': 'rpc', 'class': 'ResumeService', 'attribute': 'getData',
+               'args': (4096,), 'kwargs': {}}
+        callId, _ = handler.prepare_request(msg)
+        client1 = self.FakeClient()
+        WsRemoteService.handle_request(client1, json.dumps(msg))
+        assert len(client1.sent) == 4
+        # only the first two parts arrive before the connection drops
+        for part in client1.sent[:2]:
+            handler.callback(conn1, part)
+        websocketState.wsConnectionLists['wsResume'].remove(conn1)
+        handler.close_pending_requests(conn1)
+        assert handler.dataCallbacks[callId].detached is True
+
+        # reconnect with the same session, the request is re-sent with the parts received
+        conn2 = self.FakeConn('session1')
+        websocketState.wsConnectionLists['wsResume'].append(conn2)
+        handler.resume_pending_requests(conn2)
+        assert len(conn2.messages) == 1
+        resumeMsg = json.loads(conn2.messages[0])
+        assert resumeMsg['resume'] is True
+        assert resumeMsg['partsReceived'] == [1, 2]
+        client2 = self.FakeClient()
+        WsRemoteService.handle_request(client2, conn2.messages[0])
+        # the cached result is used, and only the missing parts are sent
+        assert self.ResumeService.numCalls == 1
+        assert [json.loads(part)['partId'] for part in client2.sent] == [3, 4]
+        # a duplicate part is ignored
+        handler.callback(conn2, client1.sent[1])
+        for part in client2.sent:
+            handler.callback(conn2, part)
+        result = None
+        while True:
+            response = handler.get_response(callId, timeout=1)
+            data = serialization.unpackDataMessage(response)
+            if response.get('incomplete') is False:
+                result = data
+                break
+        assert result == self.ResumeService().getData(4096)
+
+    def test_resumeAfterLateClose(self, monkeypatch):
+        """The old connection's close is handled after the service has reconnected"""
+        import json
+        import rtCommon.serialization as serialization
+        from rtCommon.webSocketHandlers import RequestHandler, websocketState
+        from rtCommon.wsRemoteService import WsRemoteService
+        monkeypatch.setattr(serialization, 'dataPartSize', 1024)
+        monkeypatch.setitem(websocketState.wsConnectionLists, 'wsResume', [])
+        WsRemoteService.remoteHandler.registerClassInstance(self.ResumeService, self.ResumeService())
+
+        handler = RequestHandler('wsResume', self.FakeIOLoop())
+        conn1 = self.FakeConn('session2')
+        websocketState.wsConnectionLists['wsResume'].append(conn1)
+        msg = {'cmd': 'rpc', 'class': 'ResumeService', 'attribute': 'getData',
+               'args': (2048,), 'kwargs': {}}
+        callId, _ = handler.prepare_request(msg)
+        client1 = self.FakeClient()
+        WsRemoteService.handle_request(client1, json.dumps(msg))
+        handler.callback(conn1, client1.sent[0])
+
+        # the service reconnects before the old connection's close is handled,
+        #   nothing is detached yet so there is nothing to resume
+        conn2 = self.FakeConn('session2')
+        websocketState.wsConnectionLists['wsResume'].append(conn2)
+        handler.resume_pending_requests(conn2)
+        assert conn2.messages == []
+        websocketState.wsConnectionLists['wsResume'].remove(conn1)
+        handler.close_pending_requests(conn1)
+        # the request is re-sent on the live connection rather than detached
+        assert handler.dataCallbacks[callId].detached is False
+        assert handler.dataCallbacks[callId].dataConn is conn2
+        assert len(conn2.messages) == 1
+        resumeMsg = json.loads(conn2.messages[0])
+        assert resumeMsg['resume'] is True
+        assert resumeMsg['partsReceived'] == [1]
+        client2 = self.FakeClient()
+        WsRemoteService.handle_request(client2, conn2.messages[0])
+        assert [json.loads(part)['partId'] for part in client2.sent] == [2]
+        handler.callback(conn2, client2.sent[0])
+        while True:
+            response = handler.get_response(callId, timeout=1)
+            data = serialization.unpackDataMessage(response)
+            if response.get('incomplete') is False:
+                break
+        assert data == self.ResumeService().getData(2048)
+
+    def test_resumeEvictedResult(self, monkeypatch):
+        import json
+        import rtCommon.serialization as serialization
+        from rtCommon.wsRemoteService import WsRemoteService
+        monkeypatch.setattr(serialization, 'dataPartSize', 1024)
+        WsRemoteService.remoteHandler.registerClassInstance(self.ResumeService, self.ResumeService())
+        numCalls = self.ResumeService.numCalls
+        msg = {'cmd': 'rpc', 'class': 'ResumeService', 'attribute': 'getData',
+               'args': (4096,), 'kwargs': {}, 'callId': 'evicted',
+               'resume': True, 'partsReceived': [1, 2]}
+        # the result isn't cached anymore, so the remaining parts can't be sent
+        client = self.FakeClient()
+        WsRemoteService.handle_request(client, json.dumps(msg))
+        assert len(client.sent) == 1
+        response = json.loads(client.sent[0])
+        assert response['status'] == 400
+        assert 'no longer available' in response['error']
+        assert self.ResumeService.numCalls == numCalls
+
+        # without any parts received the request is just run again
+        msg['partsReceived'] = []
+        client = self.FakeClient()
+        WsRemoteService.handle_request(client, json.dumps(msg))
+        assert [json.loads(part)['partId'] for part in client.sent] == [1, 2, 3, 4]
+        assert self.ResumeService.numCalls == numCalls + 1
+
+    def test_resultCacheBytes(self, monkeypatch):
+        import json
+        from collections import OrderedDict
+        from rtCommon.wsRemoteService import WsRemoteService
+        monkeypatch.setattr(WsRemoteService, 'resultCache', OrderedDict())
+        monkeypatch.setattr(WsRemoteService, 'resultCacheMaxBytes', 10000)
+        WsRemoteService.remoteHandler.registerClassInstance(self.ResumeService, self.ResumeService())
+        for callId, size in [('small1', 4096), ('small2', 4096), ('large', 8192)]:
+            msg = {'cmd': 'rpc', 'class': 'ResumeService', 'attribute': 'getData',
+                   'args': (size,), 'kwargs': {}, 'callId': callId}
+            WsRemoteService.handle_request(self.FakeClient(), json.dumps(msg))
+        # the oldest results are evicted to keep the cached bytes under the limit
+        assert list(WsRemoteService.resultCache.keys()) == ['large']
+        assert WsRemoteService.getCachedResult('small1') is None
+
+    def test_closeWithoutSession(self):
+        from rtCommon.webSocketHandlers import RequestHandler, websocketState
+        handler = RequestHandler('wsNoSession', self.FakeIOLoop())
+        conn = self.FakeConn(None)
+        websocketState.wsConnectionLists['wsNoSession'] = [conn]
+        try:
+            callId, _ = handler.prepare_request({'cmd': 'rpc'})
+            responses = []
+            waitThread = threading.Thread(target=lambda: responses.append(
+                handler.get_response(callId, timeout=5)))
+            waitThread.start()
+            time.sleep(0.1)
+            handler.close_pending_requests(conn)
+            waitThread.join()
+            assert responses[0]['status'] == 499
+        finally:
+            websocketState.wsConnectionLists.pop('wsNoSession', None)
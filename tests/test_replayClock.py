@@ -0,0 +1,77 @@
+import time
+import pytest
+from datetime import datetime
+import rtCommon.utils as utils
+from rtCommon.replayClock import (WallClock, ScaledClock, StepClock, createReplayClock,
+                                  getReplayClock, setReplayClock)
+from rtCommon.errors import InvocationError
+
+
+@pytest.fixture
+def restoreClock():
+    prevClock = getReplayClock()
+    yield
+    setReplayClock(prevClock)
+
+
+def replaySteps(numSteps, demoStep):
+    """Paces numSteps events with demoDelay, returns the clock times of the events"""
+    eventTimes = []
+    prevEventTime = None
+    for _ in range(numSteps):
+        prevEventTime = utils.demoDelay(demoStep, prevEventTime)
+        eventTimes.append(prevEventTime)
+    return eventTimes
+
+
+def test_createReplayClock():
+    assert type(createReplayClock(None)) is WallClock
+    assert type(createReplayClock('wall')) is WallClock
+    assert type(createReplayClock('step')) is StepClock
+    clock = createReplayClock('scaled:20')
+    assert type(clock) is ScaledClock and clock.speed == 20
+    with pytest.raises(InvocationError):
+        createReplayClock('scaled:fast')
+    with pytest.raises(InvocationError):
+        createReplayClock('fastest')
+
+
+def test_stepClockReplay(restoreClock):
+    clock = StepClock()
+    setReplayClock(clock)
+    demoStep = 2
+    startTime = time.time()
+    eventTimes = replaySteps(10, demoStep)
+    # 10 TRs of 2 sec replay immediately but the event times are 1 TR apart
+    assert time.time() - startTime < 1
+    intervals = [b - a for a, b in zip(eventTimes[:-1], eventTimes[1:])]
+    assert intervals == pytest.approx([demoStep] * 9, abs=0.05)
+    assert clock.now() - time.time() == pytest.approx(clock.offset)
+    assert clock.offset >= 9 * demoStep
+
+
+def test_scaledClockReplay(restoreClock):
+    speed = 20
+    setReplayClock(f'scaled:{speed}')
+    demoStep = 1
+    startTime = time.time()
+    eventTimes = replaySteps(6, demoStep)
+    elapsed = time.time() - startTime
+    # 5-6 secs of replay time take about 1/20th of that in real time
+    assert elapsed < 6 * demoStep / speed + 0.5
+    intervals = [b - a for a, b in zip(eventTimes[:-1], eventTimes[1:])]
+    assert intervals == pytest.approx([demoStep] * 5, abs=0.1)
+
+
+def test_timeToNextTrReplayClock(restoreClock):
+    clock = StepClock()
+    setReplayClock(clock)
+    trSecs = 2.0
+    # a TR started 0.5 sec ago (by the replay clock), the next is 1.5 secs away
+    lastTrTime = datetime.fromtimestamp(clock.now() - 0.5).time()
+    now = utils.replayClockTimeOfDay()
+    assert utils.getTimeToNextTR(lastTrTime, trSecs, now, 0) == pytest.approx(1.5, abs=0.1)
+    # advancing the replay clock moves the time to the next TR
+    clock.sleep(1.0)
+    now = utils.replayClockTimeOfDay()
+    assert utils.getTimeToNextTR(lastTrTime, trSecs, now, 0) == pytest.approx(0.5, abs=0.1)
@@ -0,0 +1,98 @@
+import os
+import time
+import numpy as np
+import nibabel as nib
+import pytest
+from nilearn.image import resample_to_img
+from rtCommon.resample import ResamplePlan
+from rtCommon.errors import ValidationError
+from tests.common import tmpDir
+
+
+def makeImages():
+    # a 3mm source volume and a rotated, shifted 2.5mm target grid
+    rng = np.random.default_rng(7)
+    sourceAffine = np.diag([3.0, 3.0, 3.0, 1.0])
+    sourceAffine[:3, 3] = [-30, -30, -20]
+    sourceData = rng.random((20, 20, 14, 3)).astype(np.float32)
+    angle = np.deg2rad(10)
+    rotation = np.array([[np.cos(angle), -np.sin(angle), 0],
+                         [np.sin(angle), np.cos(angle), 0], [0, 0, 1]])
+    targetAffine = np.eye(4)
+    targetAffine[:3, :3] = rotation * 2.5
+    targetAffine[:3, 3] = [-25, -28, -18]
+    sourceImg = nib.Nifti1Image(sourceData, sourceAffine)
+    targetImg = nib.Nifti1Image(np.zeros((22, 24, 16), dtype=np.int16), targetAffine)
+    return sourceImg, targetImg
+
+
+@pytest.mark.parametrize("interpolation", ['nearest', 'linear'])
+def test_resamplePlanMatchesNilearn(interpolation):
+    sourceImg, targetImg = makeImages()
+    plan = ResamplePlan.fromImages(sourceImg, targetImg, interpolation=interpolation)
+    sourceVolume = sourceImg.get_fdata(dtype=np.float32)[..., 0]
+    expected = resample_to_img(nib.Nifti1Image(sourceVolume, sourceImg.affine), targetImg,
+                               interpolation=interpolation).get_fdata()
+    resampled = plan.apply(sourceVolume)
+    assert resampled.shape == targetImg.shape
+    assert resampled.dtype == np.float32
+    # compare away from the edges of the source volume, where the handling of
+    #   partially outside voxels differs
+    targetVoxels = np.indices(targetImg.shape).reshape(3, -1)
+    transform = np.linalg.inv(sourceImg.affine) @ targetImg.affine
+    coords = transform[:3, :3] @ targetVoxels + transform[:3, 3:4]
+    sourceShape = np.array(sourceVolume.shape).reshape(3, 1)
+    interior = np.flatnonzero(np.all((coords >= 1) & (coords <= sourceShape - 2), axis=0))
+    assert len(interior) > 1000
+    assert np.allclose(resampled.ravel()[interior], expected.ravel()[interior], atol=1e-4)
+    # outside of the source volume is the fill value
+    outside = np.setdiff1d(np.arange(resampled.size), plan.targetIndices)
+    assert len(outside) > 0 and np.all(resampled.ravel()[outside] == 0)
+
+
+def test_resamplePlanBatchAndMmap():
+    sourceImg, targetImg = makeImages()
+    plan = ResamplePlan.fromImages(sourceImg, targetImg, interpolation='linear', fillValue=-1)
+    sourceData = sourceImg.get_fdata(dtype=np.float32)
+    # a batch of volumes is the same as resampling each volume
+    batch = plan.apply(sourceData)
+    assert batch.shape == targetImg.shape + (3,)
+    for vol in range(3):
+        assert np.allclose(batch[..., vol], plan.apply(sourceData[..., vol]))
+    assert np.any(batch == -1)
+    # written into a caller's buffer
+    out = np.zeros(targetImg.shape + (3,), dtype=np.float32, order='F')
+    assert plan.apply(sourceData, out=out) is out
+    assert np.array_equal(out, batch)
+    with pytest.raises(ValidationError):
+        plan.apply(sourceData[:10])
+
+    planDir = os.path.join(tmpDir, 'resamplePlan')
+    plan.save(planDir)
+    loadedPlan = ResamplePlan.load(planDir, mmap=True)
+    assert isinstance(loadedPlan.sourceIndices, np.memmap)
+    assert np.array_equal(loadedPlan.apply(sourceData), batch)
+    # nearest keeps the integer data type
+    intData = (sourceData * 1000).astype(np.int16)
+    nearestPlan = ResamplePlan.fromImages(sourceImg, targetImg)
+    assert nearestPlan.apply(intData).dtype == np.int16
+    resampledImg = nearestPlan.applyToImage(nib.Nifti1Image(intData, sourceImg.affine))
+    assert np.array_equal(resampledImg.affine, targetImg.affine)
+
+
+def test_resamplePlanSpeed():
+    sourceImg, targetImg = makeImages()
+    sourceVolume = sourceImg.get_fdata(dtype=np.float32)[..., 0]
+    sourceVolImg = nib.Nifti1Image(sourceVolume, sourceImg.affine)
+    plan = ResamplePlan.fromImages(sourceImg, targetImg, interpolation='linear')
+    numReps = 10
+    startTime = time.perf_counter()
+    for _ in range(numReps):
+        resample_to_img(sourceVolImg, targetImg, interpolation='linear')
+    nilearnTime = (time.perf_counter() - startTime) / numReps
+    startTime = time.perf_counter()
+    for _ in range(numReps):
+        plan.apply(sourceVolume)
+    planTime = (time.perf_counter() - startTime) / numReps
+    print(f"resample: nilearn {nilearnTime*1000:.2f} ms, plan {planTime*1000:.2f} ms")
+    assert planTime < nilearnTime
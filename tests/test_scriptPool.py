@@ -0,0 +1,108 @@
+import os
+import time
+import threading
+from rtCommon.scriptPool import ScriptPool
+from tests.common import tmpDir
+
+testScript = '''
+import sys
+import json
+print('argv ' + json.dumps(sys.argv[1:]))
+print('main ' + __name__)
+print('numpy preloaded ' + str('numpy' in sys.modules))
+'''
+
+
+def writeTestScript():
+    scriptName = os.path.join(tmpDir, 'scriptPoolTest.py')
+    with open(scriptName, 'w') as fp:
+        fp.write(testScript)
+    return scriptName
+
+
+def readOutput(proc):
+    lines = []
+    for bline in iter(proc.stdout.readline, b''):
+        lines.append(bline.decode('utf-8').rstrip())
+    proc.wait(timeout=10)
+    return lines
+
+
+def test_scriptPoolLaunch():
+    scriptName = writeTestScript()
+    pool = ScriptPool(size=1, preloadModules=['numpy'])
+    try:
+        for i in range(2):
+            proc = pool.launch(scriptName, ['-c', f'cfg{i}.toml'])
+            lines = readOutput(proc)
+            assert proc.returncode == 0
+            assert lines == [f'argv ["-c", "cfg{i}.toml"]', 'main __main__', 'numpy preloaded True']
+    finally:
+        pool.shutdown()
+
+
+def test_scriptPoolSlowWorker():
+    # Waiting for a worker that is still importing doesn't block the pool
+    scriptName = writeTestScript()
+    with open(os.path.join(tmpDir, 'scriptPoolSlowImport.py'), 'w') as fp:
+        fp.write('import time\ntime.sleep(2)\n')
+    env = dict(os.environ, PYTHONPATH=tmpDir)
+    pool = ScriptPool(size=1, env=env, preloadModules=['numpy', 'scriptPoolSlowImport'])
+    try:
+        procs = []
+        launchThread = threading.Thread(target=lambda: procs.append(pool.launch(scriptName)))
+        launchThread.start()
+        time.sleep(0.2)
+        assert pool.poolLock.acquire(timeout=1)
+        pool.poolLock.release()
+        launchThread.join(timeout=30)
+        lines = readOutput(procs[0])
+        assert procs[0].returncode == 0
+        assert lines == ['argv []', 'main __main__', 'numpy preloaded True']
+    finally:
+        pool.shutdown()
+
+
+def test_scriptPoolStop():
+    scriptName = os.path.join(tmpDir, 'scriptPoolWait.py')
+    with open(scriptName, 'w') as fp:
+        fp.write('import sys\nprint("waiting", flush=True)\nsys.stdin.read()\n')
+    pool = ScriptPool(size=1, preloadModules=[])
+    try:
+        proc = pool.launch(scriptName)
+        assert proc.stdout.readline().decode('utf-8').rstrip() == 'waiting'
+        assert proc.poll() is None
+        # same stop semantics as a normally started script
+        proc.stdin.close()
+        proc.terminate()
+        proc.wait(timeout=10)
+        assert proc.returncode is not None
+    finally:
+        pool.shutdown()
+
+
+def test_scriptPoolEmpty():
+    # With no warm workers the script is started as a new process
+    scriptName = writeTestScript()
+    pool = ScriptPool(size=0)
+    proc = pool.launch(scriptName, ['-c', 'cfg.toml'])
+    lines = readOutput(proc)
+    assert proc.returncode == 0
+    assert lines[0] == 'argv ["-c", "cfg.toml"]'
+    pool.shutdown()
+
+
+def test_webServerStopsPool():
+    # The web server's warm workers are stopped when its request handler closes
+    from rtCommon.structDict import StructDict
+    from rtCommon.webServer import WsBrowserRequestHandler
+    params = StructDict({'confDir': tmpDir, 'mainScript': None, 'initScript': None,
+                         'finalizeScript': None, 'warmPoolSize': 1})
+    handler = WsBrowserRequestHandler(None, params, StructDict())
+    procs = [worker.proc for worker in handler.scriptPool.workers]
+    assert len(procs) == 1
+    handler.close()
+    assert handler.scriptPool.workers == []
+    for proc in procs:
+        proc.wait(timeout=10)
+        assert proc.returncode is not None
@@ -116,3 +116,21 @@ def test_generateDataParts(bigTestFile, mediumTestFile):
     assert bigParts > 1
     assert resMediumData == mediumData
     assert resBigData == bigData
+
+
+def test_generateDataPartsResume(mediumTestFile):
+    # Simulate a transfer interrupted after the first part and resumed
+    with open(mediumTestFile, 'rb') as fp:
+        mediumData = fp.read()
+    firstGen = generateDataParts(mediumData, {'test': 'resume'}, compress=False)
+    firstPart = next(firstGen)
+    assert firstPart['partId'] == 1
+    assert unpackDataMessage(firstPart) is None
+    # Resume skipping the part already received
+    resData = None
+    resumeParts = []
+    for msgPart in generateDataParts(mediumData, {'test': 'resume'}, compress=False, skipParts=[1]):
+        resumeParts.append(msgPart['partId'])
+        resData = unpackDataMessage(msgPart)
+    assert resumeParts == list(range(2, firstPart['numParts'] + 1))
+    assert resData == mediumData